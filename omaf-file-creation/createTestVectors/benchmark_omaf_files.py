@@ -0,0 +1,901 @@
+#!/usr/bin/env python
+"""
+This script is a part of The Fraunhofer OMAF Javascript Player implementation.
+(c) Copyright  1995 - 2019 Fraunhofer-Gesellschaft zur Foerderung der angewandten Forschung e.V. All rights reserved.
+
+Please see [LICENSE.txt](../LICENSE.txt) file for the terms of use of the contents of this repository.
+
+It measures the overhead of create_omaf_files.py without real content and without real encoders.
+
+All input files are synthetic and all external tools (TApp360Convert, TAppEncoder, kvazaar, HHI encoder, ffmpeg and
+hevc2omaf) are replaced by stubs which read their input, burn a configurable amount of CPU time per frame and write
+outputs of realistic size. The stub encoders write Annex-B bitstreams with parameter sets, AUD, SEI and EOS NAL units.
+
+Benchmarks:
+nal_scan:    get_nal_units on a synthetic bitstream
+nal_filter:  filter_nalu_file and NalStreamFilter on the same bitstream
+tiling:      step 3 tiling (tile_yuv420) of a synthetic CMP yuv
+convert:     built-in ERP to CMP converter (--NativeConvert, with numpy if it is installed): lookup table, frames per
+             second and the accuracy on a smooth function of the sphere compared with the function itself and with
+             the stored output of TApp360Convert (reference/)
+live_merge:  merge_live_window (--LivePackaging) on a window packaged by hevc2omaf (reference/), compared with
+             the packaging of the whole bitstreams, and its check of the segment structure
+scheduling:  execute_jobs overhead per job and makespan of a job graph compared to its lower bound
+pipeline:    makespan of steps 1-5 of create_omaf_files.py with the stub tools
+distributed: the same pipeline as coordinator (--Coordinator) with several workers (--Worker) on localhost
+
+The results are written as JSON. If a baseline (results of an earlier run) is given, every result is compared with
+it and the script fails if a benchmark got slower by more than the tolerance.
+
+Example usage:
+./benchmark_omaf_files.py -o baseline.json
+./benchmark_omaf_files.py -o results.json --Baseline baseline.json --Tolerance 10
+./benchmark_omaf_files.py --Only nal_scan nal_filter --StreamMB 256 -o nal.json
+./benchmark_omaf_files.py --Only distributed --Workers 3 -t 6 -o distributed.json
+"""
+
+import sys
+import os
+import time
+import argparse
+import shutil
+import json
+import platform
+import tempfile
+import subprocess
+import socket
+import struct
+import math
+import gzip
+import tarfile
+import re
+
+import create_omaf_files as omaf
+
+__author__ = "Dimitri Podborski"
+__version__ = "0.2"
+__maintainer__ = "Dimitri Podborski"
+__email__ = "dimitri.podborski@hhi.fraunhofer.de"
+__status__ = "Development"
+
+
+STUB_TOOLS = ['TApp360Convert', 'TAppEncoder', 'FileInputTest', 'kvazaar', 'ffmpeg', 'hevc2omaf']
+STUB_SETTINGS_ENV = 'OMAF_BENCHMARK_STUB'
+BENCHMARKS = ['nal_scan', 'nal_filter', 'tiling', 'convert', 'live_merge', 'scheduling', 'pipeline',
+              'distributed']
+RAP_PERIOD = 8
+# ERP width, height and CMP face size of the accuracy check of the built-in converter
+CONVERT_CHECK = (512, 256, 128)
+# output of TApp360Convert (bin/linux) for the ERP of the accuracy check
+CONVERT_REFERENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reference', 'erp512x256_cmp128.yuv.gz')
+# minimum PSNR of the Y, U and V planes of the built-in converter compared with the sphere function and with
+# TApp360Convert, which low-pass filters the chroma planes
+CONVERT_MIN_PSNR = {'sphere': (54.0, 54.0, 54.0), 'TApp360Convert': (56.5, 37.5, 35.5)}
+# live profile of hevc2omaf (bin/linux) for the 24 tiles of 768x768 and 384x384 at QP 32 (every tile is the same
+# chunk of 9 frames encoded by HM with a closed GOP) with 9 frames per segment: window/ packaged from one chunk with
+# an EOB NAL unit at the end like package_segments, full/ packaged from two chunks, whose second segment is the
+# merged window
+LIVE_REFERENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reference', 'hevc2omaf_live.tar.gz')
+LIVE_WINDOW = (1, 9, 9)
+
+
+# SYNTHETIC FILES
+def get_payload(size):
+    """
+    Returns random bytes without zero bytes, so the payload never contains a start code.
+    """
+    return os.urandom(size).replace('\x00', '\x01')
+
+
+def write_nal_unit(f, nal_type, payload, au_start=False):
+    f.write('\x00' + omaf.START_CODE if au_start else omaf.START_CODE)
+    f.write(chr(nal_type << 1) + '\x01')
+    f.write(payload)
+
+
+def get_sps_payload(width, height):
+    """
+    Returns the start of a sequence parameter set up to the picture size (see omaf.get_sps_picture_size) with
+    emulation prevention bytes: Main profile, 4:2:0, no conformance window.
+    """
+    def ue(value):
+        bits = format(value + 1, 'b')
+        return '0' * (len(bits) - 1) + bits
+    # VPS id, one sub-layer, profile_tier_level, SPS id and chroma format, the stop bit ends the payload
+    bits = '0000' + '000' + '1' + '00000001' + '01100000' + '0' * 24 + '1001' + '0' * 44 + format(123, '08b')
+    bits += ue(0) + ue(1) + ue(width) + ue(height) + '0' + '1'
+    bits += '0' * (-len(bits) % 8)
+    payload = []
+    zeros = 0
+    for k in range(0, len(bits), 8):
+        byte = chr(int(bits[k:k + 8], 2))
+        if zeros >= 2 and byte <= '\x03':
+            payload.append('\x03')
+            zeros = 0
+        payload.append(byte)
+        zeros = zeros + 1 if byte == '\x00' else 0
+    return ''.join(payload)
+
+
+def write_hevc_frames(f, first_frame, frames, frame_bytes, first=True, last=True, sps=None, rap_period=RAP_PERIOD):
+    """
+    Writes access units like an encoder with a random access period of rap_period: AUD, parameter sets in front of
+    each IRAP picture (and the first picture of the stream), prefix SEI, one slice, suffix SEI and an EOS at the end
+    of the stream. first and last tell if the frames are at the start or at the end of the stream. sps is the
+    payload of the SPS (see get_sps_payload), random bytes are written if it is not given.
+    :return: number of NAL units
+    """
+    types = dict((name, omaf.NalUnitType.index(name)) for name in ['IDR_W_RADL', 'TRAIL_R', 'TRAIL_N', 'VPS_NUT',
+                                                                  'SPS_NUT', 'PPS_NUT', 'AUD_NUT', 'EOS_NUT',
+                                                                  'PREFIX_SEI_NUT', 'SUFFIX_SEI_NUT'])
+    payload = get_payload(frame_bytes + 64)
+    nalu_cnt = 0
+    for frame in range(first_frame, first_frame + frames):
+        write_nal_unit(f, types['AUD_NUT'], '\x50', au_start=True)
+        nalu_cnt += 1
+        if frame % rap_period == 0 or (first and frame == first_frame):
+            for name in ['VPS_NUT', 'SPS_NUT', 'PPS_NUT']:
+                write_nal_unit(f, types[name], sps if name == 'SPS_NUT' and sps else payload[:24], au_start=True)
+            nalu_cnt += 3
+        write_nal_unit(f, types['PREFIX_SEI_NUT'], payload[:32])
+        if frame % rap_period == 0:
+            slice_type = types['IDR_W_RADL']
+            slice_bytes = frame_bytes * 4  # intra pictures are larger
+        else:
+            slice_type = types['TRAIL_R'] if frame % 2 == 0 else types['TRAIL_N']
+            slice_bytes = frame_bytes
+        while len(payload) < slice_bytes:
+            payload += payload
+        # the slice header starts with first_slice_segment_in_pic_flag = 1
+        write_nal_unit(f, slice_type, chr(ord(payload[0]) | 0x80) + payload[1:slice_bytes])
+        write_nal_unit(f, types['SUFFIX_SEI_NUT'], payload[:16])
+        nalu_cnt += 3
+    if last:
+        write_nal_unit(f, types['EOS_NUT'], '', au_start=True)
+        nalu_cnt += 1
+    return nalu_cnt
+
+
+def create_hevc_file(path, size_mb, frame_bytes=50000):
+    """
+    Creates a bitstream of about size_mb MB.
+    :return: number of NAL units
+    """
+    frames = max(1, int(size_mb * 1e6 / (frame_bytes * (RAP_PERIOD + 3) / RAP_PERIOD)))
+    with open(path, mode='wb') as f:
+        return write_hevc_frames(f, 0, frames, frame_bytes)
+
+
+def get_yuv420_frame(width, height, n):
+    """
+    Returns a raw yuv420p frame with a simple pattern which changes with every frame.
+    """
+    line = ''.join(chr((x + n * 3) & 0xFF) for x in range(256)) * (width / 256 + 2)
+    luma = ''.join(line[y % 256:y % 256 + width] for y in range(height))
+    chroma = chr((n * 5) & 0xFF) * (width * height / 4)
+    return luma + chroma + chroma
+
+
+def create_yuv420_file(path, width, height, frames):
+    with open(path, mode='wb') as f:
+        for n in range(frames):
+            f.write(get_yuv420_frame(width, height, n))
+
+
+def get_sphere_sample(lon, lat, plane):
+    """
+    Returns the sample of a smooth function of the sphere with another frequency in each plane.
+    """
+    frequency = [6, 4, 5][plane]
+    return int(128 + 90 * math.sin(frequency * lon + 1) * math.cos(frequency * lat) + 0.5)
+
+
+def get_sphere_erp_frame(width, height):
+    """
+    Returns a yuv420p ERP frame of the function of get_sphere_sample, the chroma samples are at the positions of
+    the chroma sample location type 0 of HEVC (see omaf.get_erp_to_cmp_taps).
+    """
+    planes = []
+    for plane, (sub, offset_x, offset_y) in enumerate([(1, 0.5, 0.5), (2, 0.5, 1.0), (2, 0.5, 1.0)]):
+        lons = [math.pi - (sub * x + offset_x) * 2 * math.pi / width for x in range(width / sub)]
+        lats = [(sub * y + offset_y) * math.pi / height for y in range(height / sub)]
+        planes += [''.join(chr(get_sphere_sample(lon, lat, plane)) for lon in lons) for lat in lats]
+    return ''.join(planes)
+
+
+def get_sphere_cmp_frame(face_size):
+    """
+    Returns the yuv420p CMP frame of the function of get_sphere_sample with the packing of omaf.CMP_FRAME_PACKING.
+    """
+    planes = []
+    for plane, (sub, offset_x, offset_y) in enumerate([(1, 0.5, 0.5), (2, 0.5, 1.0), (2, 0.5, 1.0)]):
+        positions = [(2.0 * (sub * n + offset_x) / face_size - 1, 2.0 * (sub * n + offset_y) / face_size - 1)
+                     for n in range(face_size / sub)]
+        for packing_row in omaf.CMP_FRAME_PACKING:
+            for pv in [y for x, y in positions]:
+                for face, rotation in packing_row:
+                    for pu in [x for x, y in positions]:
+                        rotated = {0: (pu, pv), 90: (-pv, pu), 180: (-pu, -pv), 270: (pv, -pu)}[rotation]
+                        px, py, pz = omaf.get_cube_face_point(face, *rotated)
+                        planes.append(chr(get_sphere_sample(math.atan2(pz, px), math.atan2(math.hypot(px, pz), py),
+                                                            plane)))
+    return ''.join(planes)
+
+
+def get_psnr(frame, reference, width, height):
+    """
+    :return: PSNR of the Y, U and V planes of two yuv420p frames
+    """
+    psnr = []
+    for begin, end in [(0, width * height), (width * height, width * height * 5 / 4),
+                       (width * height * 5 / 4, width * height * 3 / 2)]:
+        mse = sum((ord(a) - ord(b)) ** 2 for a, b in zip(frame[begin:end], reference[begin:end])) / float(end - begin)
+        psnr.append(10 * math.log10(255 * 255 / mse) if mse else 99.0)
+    return psnr
+
+
+# STUB TOOLS
+def get_option(args, name, default=None):
+    """
+    Returns the value of an option which is given as "name value" or "name=value".
+    """
+    for idx, arg in enumerate(args):
+        if arg == name and idx + 1 < len(args):
+            return args[idx + 1]
+        if arg.startswith(name + '='):
+            return arg[len(name) + 1:]
+    return default
+
+
+def burn_cpu(seconds):
+    end = time.clock() + seconds
+    while time.clock() < end:
+        pass
+
+
+def read_frames(input_path, frame_size, skip=0, frames=None):
+    """
+    Reads frames of frame_size bytes from a file or stdin ('-') and yields each frame.
+    """
+    f = sys.stdin if input_path == '-' else open(input_path, mode='rb')
+    try:
+        if skip:
+            f.seek(skip * frame_size)
+        n = 0
+        while frames is None or n < frames:
+            frame = f.read(frame_size)
+            if len(frame) < frame_size:
+                break
+            n += 1
+            yield frame
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def run_stub_converter(args, settings):
+    width = int(get_option(args, '--SourceWidth'))
+    height = int(get_option(args, '--SourceHeight'))
+    frames = get_option(args, '--FramesToBeEncoded')
+    # the CMP frame consists of 3x2 faces
+    out_width = int(get_option(args, '--CodingFaceWidth')) * 3
+    out_height = int(get_option(args, '--CodingFaceHeight')) * 2
+    out_size = out_width * out_height * 3 / 2
+    # like TApp360Convert, the extension of the output file is replaced with the format
+    output_path = "{}_{}x{}_0Hz_{}b_420.yuv".format(os.path.splitext(get_option(args, '--OutputFile'))[0],
+                                                     out_width, out_height, get_option(args, '--InputBitDepth', 8))
+    with open(output_path, mode='wb') as out:
+        for frame in read_frames(get_option(args, '--InputFile'), width * height * 3 / 2,
+                                 int(get_option(args, '--FrameSkip', 0)), int(frames) if frames else None):
+            burn_cpu(settings['convert_seconds'])
+            out.write((frame * (out_size / len(frame) + 1))[:out_size])
+    return 0
+
+
+def run_stub_encoder(tool, args, settings):
+    # the random access period is taken from the same options as the real encoder
+    if tool == 'kvazaar':
+        input_path, output_path = get_option(args, '-i'), get_option(args, '-o')
+        width, height = [int(x) for x in get_option(args, '--input-res').split('x')]
+        frames, skip = get_option(args, '--frames'), get_option(args, '--seek', 0)
+        rap_period = get_option(args, '--period')
+    elif tool == 'TAppEncoder':
+        input_path, output_path = get_option(args, '--InputFile'), get_option(args, '--BitstreamFile')
+        width, height = int(get_option(args, '--SourceWidth')), int(get_option(args, '--SourceHeight'))
+        frames, skip = get_option(args, '--FramesToBeEncoded'), get_option(args, '--FrameSkip', 0)
+        rap_period = get_option(args, '--IntraPeriod')
+        if not rap_period and get_option(args, '-c'):
+            rap_period = omaf.get_rap_period(0, get_option(args, '-c'))
+    else:
+        input_path, output_path = get_option(args, '--InputFileName'), get_option(args, '--BitstreamFileName')
+        width, height = int(get_option(args, '--Width')), int(get_option(args, '--Height'))
+        frames, skip = get_option(args, '--NumFrames'), 0
+        rap_period = get_option(args, '--IDRPeriod')
+    rap_period = int(rap_period) if rap_period and int(rap_period) > 0 else RAP_PERIOD
+    # the size of the bitstream is proportional to the number of pixels
+    frame_bytes = max(64, settings['frame_bytes'] * width * height / (768 * 768))
+    seconds = settings['encode_seconds'] * width * height / (768 * 768)
+    sps = get_sps_payload(width, height)
+    with open(output_path, mode='wb') as out:
+        n = int(skip)
+        for _ in read_frames(input_path, width * height * 3 / 2, int(skip), int(frames) if frames else None):
+            burn_cpu(seconds)
+            write_hevc_frames(out, n, 1, frame_bytes, first=n == int(skip), last=False, sps=sps,
+                              rap_period=rap_period)
+            n += 1
+        write_hevc_frames(out, n, 0, frame_bytes, first=False, sps=sps, rap_period=rap_period)
+    return 0
+
+
+def run_stub_ffmpeg(args, settings):
+    sizes = [[int(x) for x in args[idx + 1].split('x')] for idx, arg in enumerate(args) if arg == '-s:v']
+    if get_option(args, '-f') == 'hevc':
+        # decoding (--Quality): one mid gray picture per slice of the stub bitstream
+        out_width, out_height = sizes[-1]
+        buf = omaf.map_file(get_option(args, '-i'))
+        nalus = omaf.get_nal_units(buf) if buf else []
+        pictures = sum(1 for nal_type in nalus.types if nal_type < omaf.NalUnitType.index('VPS_NUT')) if buf else 0
+        for _ in range(pictures):
+            sys.stdout.write('\x80' * (out_width * out_height * 3 / 2))
+        sys.stdout.close()
+        return 0
+    in_width, in_height = sizes[0]
+    out_width, out_height = sizes[-1]
+    video_filter = get_option(args, '-filter:v', '')
+    for part in video_filter.replace('[', ' ').replace(';', ' ').split():
+        if part.startswith('crop=') or part.startswith('pad='):
+            out_width, out_height = [int(x) for x in part.split('=')[1].split(':')[:2]]
+    out_size = out_width * out_height * 3 / 2
+    skip = int(get_option(args, '-skip_initial_bytes', 0)) / (in_width * in_height * 3 / 2)
+    frames = get_option(args, '-frames:v')
+    out = sys.stdout if args[-1] == '-' else open(args[-1], mode='wb')
+    for frame in read_frames(get_option(args, '-i'), in_width * in_height * 3 / 2, skip,
+                             int(frames) if frames else None):
+        out.write((frame * (out_size / len(frame) + 1))[:out_size])
+    out.close()
+    return 0
+
+
+def get_box(box_type, payload):
+    return struct.pack('>I4s', len(payload) + 8, box_type) + payload
+
+
+def run_stub_packager(args, settings):
+    """
+    Writes the files of hevc2omaf with the size of the input bitstreams: the vod file and the live profile with one
+    track, an initialization segment and a media segment (moof with mfhd and tfdt, mdat) per --segmentSize frames.
+    """
+    input_dir, output_dir = get_option(args, '--inputDir'), get_option(args, '--outputDir')
+    prefix = get_option(args, '--inputFilePrefix')
+    frames, fps = int(get_option(args, '--duration')), float(get_option(args, '--fps'))
+    segment_frames = int(get_option(args, '--segmentSize', omaf.PACKAGER_SEGMENT_FRAMES))
+    size = 0
+    for root, dirs, files in os.walk(input_dir):
+        for name in files:
+            with open(os.path.join(root, name), mode='rb') as f:
+                size += len(f.read())
+    live_dir = os.path.join(output_dir, 'dash', 'live')
+    omaf.make_dirs_if_not_exist(live_dir)
+    with open(os.path.join(output_dir, 'dash', prefix + '.mp4'), mode='wb') as f:
+        f.write('\x00' * size)
+    timescale = 90000
+    segment_duration = int(segment_frames * timescale / fps)
+    segments = (frames + segment_frames - 1) / segment_frames
+    with open(os.path.join(live_dir, prefix + '_init.mp4'), mode='wb') as f:
+        mehd = get_box('mehd', struct.pack('>II', 0, int(frames * timescale / fps)))
+        f.write(get_box('moov', get_box('mvex', mehd)))
+    for n in range(segments):
+        with open(os.path.join(live_dir, 'Track_1_Seg_{}.mp4'.format(n + 1)), mode='wb') as f:
+            mfhd = get_box('mfhd', struct.pack('>II', 0, n + 1))
+            tfdt = get_box('tfdt', struct.pack('>II', 0, n * segment_duration))
+            f.write(get_box('moof', mfhd + get_box('traf', tfdt)))
+            f.write(get_box('mdat', '\x00' * (size / segments)))
+    with open(os.path.join(output_dir, 'dash', prefix + '_live.mpd'), mode='w') as f:
+        f.write('<MPD mediaPresentationDuration="PT{0:.3f}S"><Period duration="PT{0:.3f}S"><AdaptationSet>'
+                '<SegmentTemplate timescale="{1}" duration="{2}" startNumber="1"'
+                ' initialization="live/{3}_init.mp4" media="live/Track_1_Seg_$Number$.mp4"/>'
+                '</AdaptationSet></Period></MPD>\n'.format(frames / fps, timescale, segment_duration, prefix))
+    return 0
+
+
+def run_stub(tool, args):
+    settings = json.loads(os.environ[STUB_SETTINGS_ENV])
+    if tool == 'TApp360Convert':
+        return run_stub_converter(args, settings)
+    elif tool == 'ffmpeg':
+        return run_stub_ffmpeg(args, settings)
+    elif tool == 'hevc2omaf':
+        return run_stub_packager(args, settings)
+    return run_stub_encoder(tool, args, settings)
+
+
+def create_stub_tools(work_dir, settings):
+    """
+    Creates shell wrappers which run this script as stub tool. TApp360Convert, TAppEncoder, FileInputTest and
+    hevc2omaf are created in work_dir/bin/[YourOS] (pass it to create_omaf_files.py with --BinDir), kvazaar and ffmpeg
+    in work_dir/path which has to be added to $PATH.
+    """
+    script = os.path.abspath(__file__).replace('.pyc', '.py')
+    for os_dir in ['linux', 'osx']:
+        omaf.make_dirs_if_not_exist(os.path.join(work_dir, 'bin', os_dir))
+    omaf.make_dirs_if_not_exist(os.path.join(work_dir, 'path'))
+    for tool in STUB_TOOLS:
+        dirs = [os.path.join(work_dir, 'path')]
+        if tool not in ['kvazaar', 'ffmpeg']:
+            dirs = [os.path.join(work_dir, 'bin', os_dir) for os_dir in ['linux', 'osx']]
+        for tool_dir in dirs:
+            path = os.path.join(tool_dir, tool)
+            with open(path, 'w') as f:
+                f.write("#!/bin/sh\n{}='{}' exec '{}' '{}' --Stub {} \"$@\"\n".format(
+                    STUB_SETTINGS_ENV, json.dumps(settings), sys.executable, script, tool))
+            os.chmod(path, 0755)
+
+
+def get_stub_env(work_dir):
+    """
+    Returns the environment to run create_omaf_files.py with the stub tools of work_dir (see create_stub_tools).
+    """
+    return dict(os.environ, PATH=os.path.join(work_dir, 'path') + os.pathsep + os.environ.get('PATH', ''))
+
+
+# BENCHMARKS
+def run_quiet(func):
+    """
+    Runs func with stdout redirected to /dev/null (e.g. execute_jobs prints every finished job).
+    """
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        return func()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def run_forked(func, *args):
+    """
+    Runs func(*args) in a child process like the FunctionJobs of the pipeline, so the memory it leaves behind does
+    not slow down the benchmark.
+    :return: False if func failed
+    """
+    process = omaf.FunctionProcess(func, args)
+    _, status = os.waitpid(process.pid, 0)
+    return status == 0
+
+
+def measure(func, repeat):
+    """
+    Runs func repeat times.
+    :return: (shortest run time in seconds, result of the last run)
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.time()
+        result = func()
+        seconds = time.time() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+
+def benchmark_nal_scan(args, work_dir):
+    path = os.path.join(work_dir, 'stream.265')
+    nalu_cnt = create_hevc_file(path, args.StreamMB)
+    size = os.path.getsize(path)
+
+    def scan():
+        buf = omaf.map_file(path)
+        nalus = omaf.get_nal_units(buf)
+        buf.close()
+        return len(nalus)
+
+    seconds, found = measure(scan, args.Repeat)
+    nalu_cnt -= 1  # the EOS NAL unit at the end of the stream has no payload and is not counted by get_nal_units
+    if found != nalu_cnt:
+        print "ERROR: get_nal_units found {} of {} NAL units".format(found, nalu_cnt)
+        return None
+    return {'seconds': seconds, 'bytes': size, 'nal_units': nalu_cnt, 'mb_per_second': size / 1e6 / seconds}
+
+
+def benchmark_nal_filter(args, work_dir):
+    path = os.path.join(work_dir, 'stream.265')
+    if not os.path.exists(path):
+        create_hevc_file(path, args.StreamMB)
+    size = os.path.getsize(path)
+    output_path = os.path.join(work_dir, 'stream_filtered.265')
+    stream_output_path = os.path.join(work_dir, 'stream_filtered_inline.265')
+
+    def filter_stream():
+        with open(path, mode='rb') as f, open(stream_output_path, mode='wb') as out:
+            nal_filter = omaf.NalStreamFilter(out)
+            while True:
+                data = f.read(omaf.PIPE_READ_SIZE)
+                if not data:
+                    break
+                nal_filter.write(data)
+            nal_filter.close()
+
+    seconds, _ = measure(lambda: omaf.filter_nalu_file(path, output_path), args.Repeat)
+    stream_seconds, _ = measure(filter_stream, args.Repeat)
+
+    # the filtered stream must not contain any other non picture NAL units than parameter sets
+    buf = omaf.map_file(output_path)
+    nalus = omaf.get_nal_units(buf)
+    buf.close()
+    max_type = omaf.NalUnitType.index('PPS_NUT')
+    dropped = [omaf.NalUnitType[nal_type] for nal_type in set(nalus.types) if nal_type > max_type]
+    with open(output_path, mode='rb') as f, open(stream_output_path, mode='rb') as f_stream:
+        same_output = f.read() == f_stream.read()
+    if dropped or not same_output:
+        print "ERROR: filter kept {}, inline filter output is {}".format(
+            dropped, "identical" if same_output else "different")
+        return None
+    return {'seconds': seconds, 'stream_seconds': stream_seconds, 'bytes': size,
+            'filtered_bytes': os.path.getsize(output_path), 'mb_per_second': size / 1e6 / seconds}
+
+
+def benchmark_tiling(args, work_dir):
+    tile_dir = os.path.join(work_dir, 'tiles')
+    omaf.make_dirs_if_not_exist(tile_dir)
+    path = os.path.join(work_dir, 'highres.yuv')
+    layout = omaf.TileLayout()
+    create_yuv420_file(path, layout.width, layout.height, args.Frames)
+    size = os.path.getsize(path)
+    seconds, ok = measure(lambda: omaf.tile_yuv420(path, tile_dir, layout, 0), args.Repeat)
+    width, height = layout.get_tile_size(0)
+    last_tile = os.path.join(tile_dir, omaf.get_tile_name(width, height, layout.tile_count - 1))
+    if not ok or os.path.getsize(last_tile) * layout.tile_count != size:
+        print "ERROR: tiling failed"
+        return None
+    return {'seconds': seconds, 'bytes': size, 'frames': args.Frames, 'mb_per_second': size / 1e6 / seconds}
+
+
+def benchmark_convert(args, work_dir):
+    # accuracy on the sphere function
+    width, height, face_size = CONVERT_CHECK
+    layout = omaf.TileLayout(face_size)
+    path = os.path.join(work_dir, 'sphere_erp.yuv')
+    with open(path, mode='wb') as f:
+        f.write(get_sphere_erp_frame(width, height))
+    lut_path = os.path.join(work_dir, 'luts', 'sphere.lut')
+    output_path = os.path.join(work_dir, 'sphere_cmp.yuv')
+    if not run_forked(omaf.create_erp_to_cmp_lut, lut_path, width, height, layout) or \
+            not omaf.convert_erp_to_cmp(path, output_path, width, height, layout, lut_path):
+        print "ERROR: conversion of the sphere function failed"
+        return None
+    with open(output_path, mode='rb') as f:
+        frame = f.read()
+    with gzip.open(CONVERT_REFERENCE, mode='rb') as f:
+        references = {'sphere': get_sphere_cmp_frame(face_size), 'TApp360Convert': f.read()}
+    result = {}
+    for name, reference in references.items():
+        psnr = get_psnr(frame, reference, layout.width, layout.height)
+        result['psnr_' + name] = psnr
+        if any(value < minimum for value, minimum in zip(psnr, CONVERT_MIN_PSNR[name])):
+            print "ERROR: Y, U, V PSNR compared with {} {:.2f}, {:.2f}, {:.2f} dB (minimum {})".format(
+                name, psnr[0], psnr[1], psnr[2], CONVERT_MIN_PSNR[name])
+            return None
+
+    # speed with one process on the synthetic ERP yuv of the pipeline, the lookup table is created in a child process
+    # like in the pipeline
+    layout = omaf.TileLayout(args.Width / 32 * 8)
+    path = os.path.join(work_dir, 'erp_{}x{}.yuv'.format(args.Width, args.Height))
+    if not os.path.exists(path):
+        create_yuv420_file(path, args.Width, args.Height, args.Frames)
+    lut_path = os.path.join(work_dir, 'luts', 'erp.lut')
+    output_path = os.path.join(work_dir, 'erp_cmp.yuv')
+    lut_seconds, ok = measure(lambda: run_forked(omaf.create_erp_to_cmp_lut, lut_path, args.Width, args.Height,
+                                                 layout), 1)
+    if not ok:
+        print "ERROR: lookup table creation failed"
+        return None
+    seconds, ok = measure(lambda: omaf.convert_erp_to_cmp(path, output_path, args.Width, args.Height, layout,
+                                                          lut_path, 0, args.Frames), args.Repeat)
+    if not ok:
+        print "ERROR: conversion failed"
+        return None
+    result.update(seconds=seconds, lut_seconds=lut_seconds, frames=args.Frames, face_size=layout.face_size,
+                  frames_per_second=args.Frames / seconds, numpy=bool(omaf.numpy))
+    return result
+
+
+def benchmark_live_merge(args, work_dir):
+    reference_dir = os.path.join(work_dir, 'live_reference')
+    if not os.path.exists(reference_dir):
+        with tarfile.open(LIVE_REFERENCE, mode='r:gz') as tar:
+            tar.extractall(reference_dir)
+    full_dir = os.path.join(reference_dir, 'full', 'omaf')
+    window_dir = os.path.join(work_dir, 'live_window')
+
+    def merge():
+        shutil.rmtree(window_dir, ignore_errors=True)
+        shutil.copytree(os.path.join(reference_dir, 'window', 'omaf'), window_dir)
+        return omaf.merge_live_window(window_dir, LIVE_WINDOW)
+    seconds, moves = measure(merge, args.Repeat)
+    # the merged window has to be the second segment of the whole packaging, only the bandwidth in the MPD differs
+    differ = []
+    for path, omaf_path in moves:
+        with open(os.path.join(window_dir, path), mode='rb') as f:
+            data = f.read()
+        with open(os.path.join(full_dir, omaf_path), mode='rb') as f:
+            reference = f.read()
+        if omaf_path.endswith('.mpd'):
+            data, reference = [re.sub(r' bandwidth="\d+"', '', mpd) for mpd in (data, reference)]
+        if not data == reference:
+            differ.append(omaf_path)
+    if differ or not moves:
+        print "ERROR: {} of {} merged files differ from the whole packaging: {}".format(len(differ), len(moves),
+                                                                                      ', '.join(differ[:5]))
+        return None
+
+    # windows with another structure are rejected
+    for path, old, new in [('dash/erp_live.mpd', 'startNumber="1"', 'startNumber="0"'),
+                           ('dash/erp_live.mpd', '_Seg_$Number$.mp4', '_$Number$.mp4')]:
+        merge()
+        with open(os.path.join(window_dir, path)) as f:
+            mpd = f.read()
+        with open(os.path.join(window_dir, path), 'w') as f:
+            f.write(mpd.replace(old, new))
+        try:
+            omaf.merge_live_window(window_dir, LIVE_WINDOW)
+        except ValueError:
+            continue
+        print "ERROR: merge_live_window accepted a window with {} instead of {}".format(new, old)
+        return None
+    merge()
+    path = os.path.join(window_dir, 'dash', 'live', 'Ext_1_Seg_1.mp4')
+    with open(path, mode='rb') as f:
+        buf = bytearray(f.read())
+    omaf.shift_fragments(buf, 1, 0)
+    with open(path, mode='wb') as f:
+        f.write(buf)
+    try:
+        omaf.merge_live_window(window_dir, LIVE_WINDOW)
+        print "ERROR: merge_live_window accepted a window with fragments which are not numbered after each other"
+        return None
+    except ValueError:
+        pass
+    return {'seconds': seconds, 'files': len(moves)}
+
+
+def benchmark_scheduling(args, work_dir):
+    # overhead of the runner: many jobs which do nothing
+    jobs = [omaf.Job('true') for _ in range(args.Jobs)]
+    overhead_seconds, ok = measure(lambda: run_quiet(lambda: omaf.execute_jobs(jobs, args.NumThreads)), 1)
+    if not ok:
+        return None
+
+    # a graph like the pipeline: 2 sources -> 24 tiles each -> one encode per tile and QP -> 1 packaging job
+    # durations in seconds, the costs of the jobs are their durations
+    def create_graph():
+        graph = []
+        package = omaf.Job('sleep 0.05', cost=0.05)
+        for size, encode in [(768, 0.4), (384, 0.1)]:
+            source = omaf.Job('sleep 0.2', cost=0.2)
+            graph.append(source)
+            for n in range(24):
+                for qp in range(args.QPs):
+                    duration = encode * (1 + (n % 5) / 4.0)  # some tiles are more complex
+                    job = omaf.Job('sleep {}'.format(duration), deps=[source], cost=duration)
+                    graph.append(job)
+                    package.deps.append(job)
+        graph.append(package)
+        return graph
+
+    graph = create_graph()
+    dependents = dict((job, []) for job in graph)
+    for job in graph:
+        for dep in job.deps:
+            dependents[dep].append(job)
+    critical_path = max(omaf.get_remaining_costs(graph, dependents).values())
+    lower_bound = max(critical_path, sum(job.cost for job in graph) / args.NumThreads)
+    seconds, ok = measure(lambda: run_quiet(lambda: omaf.execute_jobs(create_graph(), args.NumThreads)), 1)
+    if not ok:
+        return None
+    return {'seconds': seconds, 'lower_bound': lower_bound, 'efficiency': lower_bound / seconds,
+            'jobs': len(graph), 'overhead_ms_per_job': overhead_seconds * 1000.0 / args.Jobs}
+
+
+def run_pipeline(args, work_dir, name, extra_args=()):
+    """
+    Runs steps 1-5 of create_omaf_files.py with the stub tools on a synthetic ERP yuv in work_dir/name.
+    :return: (run time in seconds, report of the run) or None on error
+    """
+    input_path = os.path.join(work_dir, 'erp_{}x{}.yuv'.format(args.Width, args.Height))
+    if not os.path.exists(input_path):
+        create_yuv420_file(input_path, args.Width, args.Height, args.Frames)
+    output_dir = os.path.join(work_dir, name)
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+    cmd = [sys.executable, os.path.abspath(omaf.__file__).replace('.pyc', '.py'), '-s', '1-5', '-i', input_path,
+           '-wdt', str(args.Width), '-hgt', str(args.Height), '-f', str(args.Frames - 1), '-o', output_dir,
+           '-t', str(args.NumThreads), '--codec', str(args.Codec), '--BinDir',
+           os.path.join(work_dir, 'bin', os.path.basename(omaf.get_bin_dir())),
+           '-q'] + [str(32 - 5 * n) for n in range(args.QPs)]
+    if args.Codec == 0:
+        cmd += ['-c', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'conf',
+                                   'encoder_randomaccess_main_RAP9.cfg')]
+    cmd += list(extra_args) + args.PipelineArgs
+    log_path = os.path.join(work_dir, name + '.log')
+    with open(log_path, 'w') as log:
+        start = time.time()
+        returncode = subprocess.call(cmd, cwd=work_dir, env=get_stub_env(work_dir), stdout=log,
+                                     stderr=subprocess.STDOUT)
+        seconds = time.time() - start
+    if returncode != 0:
+        print "ERROR: pipeline failed, see {}".format(log_path)
+        return None
+    report_dir = os.path.join(output_dir, 'reports')
+    reports = sorted(name for name in os.listdir(report_dir) if not name.endswith('_trace.json'))
+    with open(os.path.join(report_dir, reports[-1])) as f:
+        return seconds, json.load(f)
+
+
+def benchmark_pipeline(args, work_dir):
+    run = run_pipeline(args, work_dir, 'pipeline')
+    if not run:
+        return None
+    seconds, report = run
+    summary = report['summary']
+    return {'seconds': seconds, 'frames': args.Frames, 'jobs': summary['jobs'], 'cpu': summary['cpu'],
+            'local_utilization': summary['local_utilization']}
+
+
+def get_free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def benchmark_distributed(args, work_dir):
+    """
+    Runs the pipeline as coordinator with --Workers worker processes on localhost, which share the -t cores. Every
+    worker has to execute encoder jobs.
+    """
+    address = '127.0.0.1:{}'.format(get_free_port())
+    cores = max(1, args.NumThreads / args.Workers)
+    workers = []
+    for k in range(args.Workers):
+        log = open(os.path.join(work_dir, 'worker{}.log'.format(k)), 'w')
+        workers.append(subprocess.Popen([sys.executable, os.path.abspath(omaf.__file__).replace('.pyc', '.py'),
+                                         '--Worker', address, '-t', str(cores), '--BinDir',
+                                         os.path.join(work_dir, 'bin', os.path.basename(omaf.get_bin_dir()))],
+                                        cwd=work_dir, env=get_stub_env(work_dir), stdout=log,
+                                        stderr=subprocess.STDOUT))
+        log.close()
+    try:
+        run = run_pipeline(args, work_dir, 'distributed', ['--Coordinator', address])
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.wait()
+    if not run:
+        return None
+    seconds, report = run
+    remote = [record for record in report['jobs'] if record['host'] != 'local']
+    hosts = set(record['host'] for record in remote)
+    if len(hosts) != args.Workers:
+        print "ERROR: {} of {} workers executed jobs".format(len(hosts), args.Workers)
+        return None
+    return {'seconds': seconds, 'frames': args.Frames, 'jobs': len(report['jobs']), 'remote_jobs': len(remote),
+            'workers': args.Workers, 'cpu': report['summary']['cpu']}
+
+
+def compare_results(results, baseline, tolerance):
+    """
+    Prints the run time of each benchmark compared to the baseline.
+    :return: names of the benchmarks which are slower than the baseline by more than tolerance percent
+    """
+    regressions = []
+    for name in BENCHMARKS:
+        if name not in results:
+            continue
+        seconds = results[name]['seconds']
+        if name not in baseline.get('results', {}):
+            print "{:12} {:8.3f}s".format(name, seconds)
+            continue
+        base_seconds = baseline['results'][name]['seconds']
+        change = (seconds / base_seconds - 1.0) * 100 if base_seconds else 0.0
+        regression = change > tolerance
+        print "{:12} {:8.3f}s (baseline {:8.3f}s, {:+.1f}%){}".format(
+            name, seconds, base_seconds, change, " REGRESSION" if regression else "")
+        if regression:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    # stub tools are started as: benchmark_omaf_files.py --Stub tool [arguments of the tool]
+    if len(sys.argv) > 2 and sys.argv[1] == '--Stub':
+        return run_stub(sys.argv[2], sys.argv[3:])
+
+    print "OMAF file creation benchmark version {}\n".format(__version__)
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter,
+                                     description='Benchmark create_omaf_files.py with synthetic inputs and stub tools.')
+    parser.add_argument('-o', '--Output', default='benchmark.json', help='JSON file for the results')
+    parser.add_argument('--Baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--Tolerance', type=float, default=10.0, help='Allowed slow down compared to the baseline in\n'
+                                                                      'percent')
+    parser.add_argument('--Only', nargs='+', choices=BENCHMARKS, help='Run only these benchmarks')
+    parser.add_argument('--Repeat', type=int, default=3, help='Repetitions of the micro benchmarks (best run counts)')
+    parser.add_argument('-t', '--NumThreads', type=int, default=4, help='Number of parallel processes.')
+    parser.add_argument('--StreamMB', type=float, default=64, help='Size of the synthetic bitstream in MB')
+    parser.add_argument('-f', '--Frames', type=int, default=8, help='Number of frames of the synthetic yuv files')
+    parser.add_argument('-wdt', '--Width', type=int, default=2048, help='Width of the synthetic ERP yuv')
+    parser.add_argument('-hgt', '--Height', type=int, default=1024, help='Height of the synthetic ERP yuv')
+    parser.add_argument('--QPs', type=int, default=2, help='Number of QPs (pipeline and scheduling)')
+    parser.add_argument('--Workers', type=int, default=2, help='Number of local workers of the distributed\n'
+                                                               'benchmark, they share the -t cores')
+    parser.add_argument('--Jobs', type=int, default=200, help='Number of empty jobs to measure the runner overhead')
+    parser.add_argument('--codec', dest='Codec', type=int, default=1, help='Stub encoder used in the pipeline:\n'
+                                                                            '  0 = HM, 1 = kvazaar, 2 = HHI encoder')
+    parser.add_argument('--EncodeSeconds', type=float, default=0.02, help='CPU seconds the stub encoders spend per\n'
+                                                                          '768x768 frame')
+    parser.add_argument('--ConvertSeconds', type=float, default=0.05, help='CPU seconds the stub converter spends per\n'
+                                                                           'frame')
+    parser.add_argument('--FrameBytes', type=int, default=20000, help='Bitstream bytes per 768x768 frame of the stub\n'
+                                                                      'encoders')
+    parser.add_argument('--PipelineArgs', nargs=argparse.REMAINDER, default=[],
+                        help='Additional arguments for create_omaf_files.py (must be the last option)')
+    parser.add_argument('--WorkDir', help='Directory for the synthetic files (default: temporary directory)')
+    parser.add_argument('--Keep', action='store_true', help='Do not remove the synthetic files')
+    args = parser.parse_args()
+
+    work_dir = args.WorkDir or tempfile.mkdtemp(prefix='omaf_benchmark_')
+    omaf.make_dirs_if_not_exist(work_dir)
+    work_dir = os.path.abspath(work_dir)
+    settings = {'encode_seconds': args.EncodeSeconds, 'convert_seconds': args.ConvertSeconds,
+                'frame_bytes': args.FrameBytes}
+    create_stub_tools(work_dir, settings)
+
+    functions = {'nal_scan': benchmark_nal_scan, 'nal_filter': benchmark_nal_filter, 'tiling': benchmark_tiling,
+                 'convert': benchmark_convert, 'live_merge': benchmark_live_merge,
+                 'scheduling': benchmark_scheduling, 'pipeline': benchmark_pipeline,
+                 'distributed': benchmark_distributed}
+    results = {}
+    failed = []
+    try:
+        for name in BENCHMARKS:
+            if args.Only and name not in args.Only:
+                continue
+            omaf.print_message("Benchmark {}".format(name))
+            result = functions[name](args, work_dir)
+            if result is None:
+                failed.append(name)
+                continue
+            results[name] = result
+            print json.dumps(result, indent=1, sort_keys=True)
+    finally:
+        if not args.Keep and not args.WorkDir:
+            shutil.rmtree(work_dir, True)
+
+    settings.update(threads=args.NumThreads, stream_mb=args.StreamMB, frames=args.Frames, width=args.Width,
+                    height=args.Height, qps=args.QPs, codec=args.Codec, workers=args.Workers,
+                    pipeline_args=args.PipelineArgs)
+    with open(args.Output, 'w') as f:
+        json.dump({'version': __version__, 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'host': platform.node(),
+                   'python': platform.python_version(), 'settings': settings, 'results': results}, f, indent=1,
+                  sort_keys=True)
+
+    omaf.print_message("Results written to {}".format(args.Output))
+    baseline = {}
+    if args.Baseline:
+        with open(args.Baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('settings') != settings:
+            print "WARN: the baseline was measured with different settings"
+    regressions = compare_results(results, baseline, args.Tolerance)
+    if failed:
+        print "Error: benchmarks failed: {}".format(', '.join(failed))
+        return -1
+    if regressions:
+        print "Error: benchmarks are slower than the baseline: {}".format(', '.join(regressions))
+        return -1
+    return 0
+
+
+# run
+if __name__ == '__main__':
+    sys.exit(main())
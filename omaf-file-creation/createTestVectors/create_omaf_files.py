@@ -31,6 +31,10 @@ process 1017 frames of raw_video.yuv with two QPs 32 and 25 and use max 12 threa
 
 ./create_omaf_files.py -s 4-5 -i folder/with/yuvs -f 270 -fr 30 -q 32 -t 8 --codec 0 -c conf/encoder_randomaccess_main_RAP9.cfg -p Garage -o HMencodings
 only encode and package 270 frames of yuv files from 'folder/with/yuvs' directory and name the sequenze 'Garage'
+
+The script is split into modules next to it: omaf_jobs (job runner), omaf_distributed (coordinator and workers),
+omaf_converter (ERP to CMP converter), omaf_packaging (bitstreams and packaging) and omaf_analysis (tile analysis and
+quality). create_omaf_files re-exports all of them, so the functions can be imported from it.
 """
 
 import sys
@@ -39,8 +43,21 @@ import time
 import argparse
 import shutil
 import re
+import threading
+import Queue
+import json
+import socket
+import glob
+import itertools
+import multiprocessing
 import shlex, subprocess
 
+from omaf_jobs import *
+from omaf_distributed import *
+from omaf_converter import *
+from omaf_packaging import *
+from omaf_analysis import *
+
 __author__ = "Dimitri Podborski"
 __version__ = "0.2"
 __maintainer__ = "Dimitri Podborski"
@@ -48,188 +65,118 @@ __email__ = "dimitri.podborski@hhi.fraunhofer.de"
 __status__ = "Development"
 
 
-NalUnitType = ['TRAIL_N',
-  'TRAIL_R',
-  'TSA_N',
-  'TLA_R',
-  'STSA_N',
-  'STSA_R',
-  'RADL_N',
-  'RADL_R',
-  'RASL_N',
-  'RASL_R',
-  'RSV_VCL_N10',
-  'RSV_VCL_R11',
-  'RSV_VCL_N12',
-  'RSV_VCL_R13',
-  'RSV_VCL_N14',
-  'RSV_VCL_R15',
-  'BLA_W_LP',
-  'BLA_W_RADL',
-  'BLA_N_LP',
-  'IDR_W_RADL',
-  'IDR_N_LP',
-  'CRA_NUT',
-  'RSV_IRAP_VCL22',
-  'RSV_IRAP_VCL23',
-  'RSV_VCL24',
-  'RSV_VCL25',
-  'RSV_VCL26',
-  'RSV_VCL27',
-  'RSV_VCL28',
-  'RSV_VCL29',
-  'RSV_VCL30',
-  'RSV_VCL31',
-  'VPS_NUT',
-  'SPS_NUT',
-  'PPS_NUT',
-  'AUD_NUT',
-  'EOS_NUT',
-  'EOB_NUT',
-  'FD_NUT',
-  'PREFIX_SEI_NUT',
-  'SUFFIX_SEI_NUT',
-  'RSV_NVCL41',
-  'RSV_NVCL42',
-  'RSV_NVCL43',
-  'RSV_NVCL44',
-  'RSV_NVCL45',
-  'RSV_NVCL46',
-  'RSV_NVCL47',
-  'UNSPEC48',
-  'UNSPEC49',
-  'UNSPEC50',
-  'UNSPEC51',
-  'UNSPEC52',
-  'UNSPEC53',
-  'UNSPEC54',
-  'UNSPEC55',
-  'UNSPEC56',
-  'UNSPEC57',
-  'UNSPEC58',
-  'UNSPEC59',
-  'UNSPEC60',
-  'UNSPEC61',
-  'UNSPEC62',
-  'UNSPEC63',
-  'INVALID']
-
-
-# FUNCTIONS
-def get_nal_units(buf):
-    nalus = list()
-    for i in range(0, len(buf) - 6):
-        if buf[i + 1] == '\x00' and buf[i + 2] == '\x00' and buf[i + 3] == '\x01':
-            nalu = {'offset': 0, 'auStart': False, 'type': 0, 'layerID': 0, 'tempID': 0}
-            if buf[i] == '\x00':
-                nalu['offset'] = i
-                nalu['auStart'] = True
-            else:
-                nalu['offset'] = i + 1
-            h1 = buf[i + 4]
-            h2 = buf[i + 5]
-
-            nalu['type'] = (ord(h1) & 0x7E) >> 1
-            nalu['layerID'] = ((ord(h1) & 0x01) << 5) + ((ord(h2) & 0xF8) >> 3)
-            nalu['tempID'] = (ord(h2) & 0x07) - 1
-            nalus.append(nalu)
-    return nalus
-
-
-def find_filtered_nalu_offsets(nalus):
-    offsets = list()
-    nalu_cnt = len(nalus)
-    for idx in range(nalu_cnt):
-        if nalus[idx]['type'] > NalUnitType.index('PPS_NUT'):
-            continue  # skip all non picture NALs (but don't touch param sets)
-        begin = nalus[idx]['offset']
-        if idx < nalu_cnt - 1:
-            end = nalus[idx + 1]['offset']
-        else:
-            end = -1
-        offsets.append([begin, end])
-
-    return offsets
-
-
-def write_file_from_offsets(filename, buffer, split_offsets):
-    with open(filename, mode='wb') as file:
-        for offsetpair in split_offsets:
-            file.write(buffer[offsetpair[0]:offsetpair[1]])
-
+STREAM_BUFFER_FRAMES = 4
 
-def make_dirs_if_not_exist(dir_path):
-    if not os.path.exists(dir_path):
-        os.makedirs(dir_path)
 
+# number of threads each encoder uses (HHI encoder is started with --NumThreads 2)
+ENCODER_THREADS = {0: 1, 1: 1, 2: 2}
 
-def print_message(msg):
-    print "\n" + "#" * 80
-    print "### " + str(msg)
-    print "#" * 80 + "\n"
 
+# --Preview: number of segments if no frame count is given and kvazaar preset
+PREVIEW_SEGMENTS = 2
+PREVIEW_PRESET = 'ultrafast'
+# HM options (they override the configuration file) and --Quality of the HHI encoder for each kvazaar preset, other
+# presets use the configuration file and HHI_QUALITY. ESD (early skip detection) makes HM abort with these options.
+HM_PRESET_OPTIONS = {
+    PREVIEW_PRESET: "--SearchRange=16 --RDOQ=0 --RDOQTS=0 --AMP=0 --TransformSkip=0 --ECU=1 --CFM=1"
+                    " --MaxPartitionDepth=3",
+}
+HHI_QUALITY = 14
+HHI_PRESET_QUALITY = {
+    PREVIEW_PRESET: 1,
+}
 
-def execute_cmd(cmd_string):
-    ret_code = subprocess.call(cmd_string, shell=True)
-    if not ret_code == 0:
-        print "ERROR: something went wrong with: ", cmd_string
-        sys.exit(-1)
 
-
-def execute_cmds(cmds_string, num_threads=8):
-    count = len(cmds_string)
-    n = 0
-    if count == 0:
-        return
-    processes = []
-    while True:
-        while cmds_string and len(processes) < num_threads:
-            cmd = cmds_string.pop()
-
-            args = shlex.split(cmd)
-            processes.append(subprocess.Popen(args))
-
-        for p in processes:
-            if p.poll() is not None:
-                if p.returncode == 0:
-                    processes.remove(p)
-                    n += 1
-                    print "{} jobs finished. Still to finish: {}".format(n, count-n)
+class FrameWriter(threading.Thread):
+    """
+    Writes frames from a bounded queue to one or more consumers. A consumer is either a file object or a
+    (fifo_path, process) pair. The producer is only blocked if max_frames frames are waiting. If a consumer fails,
+    the remaining frames are dropped so that the producer never blocks forever.
+    """
+    def __init__(self, consumers, max_frames=STREAM_BUFFER_FRAMES):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.consumers = consumers
+        self.queue = Queue.Queue(max_frames)
+        self.error = None
+
+    def put(self, frame):
+        self.queue.put(frame)
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        outputs = []
+        try:
+            for consumer in self.consumers:
+                if isinstance(consumer, tuple):
+                    output = open_fifo_for_writing(*consumer)
+                    if not output:
+                        raise IOError("{} exited before reading its input".format(consumer[0]))
+                    outputs.append(output)
                 else:
-                    print "ERROR: executing command: errorcode={}".format(p.returncode)
-                    sys.exit(-1)
-
-        if len(processes) == 0 and len(cmds_string) == 0:
+                    outputs.append(consumer)
+        except (IOError, OSError) as e:
+            self.error = e
+
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            if self.error:
+                continue
+            try:
+                for output in outputs:
+                    output.write(frame)
+            except (IOError, OSError) as e:
+                self.error = e
+
+        for output in outputs:
+            try:
+                output.close()
+            except (IOError, OSError) as e:
+                self.error = self.error or e
+
+
+def stream_tiles(input_file, layout, tier, tile_writers, frame_writers=()):
+    """
+    Reads raw yuv420p CMP frames of a tier from input_file until EOF and puts tile n of every frame into
+    tile_writers[n]. The complete frames are additionally put into all frame_writers.
+    :return: number of frames
+    """
+    width, height = layout.get_tile_size(tier)
+    frame_size = width * layout.cols * height * layout.rows * 3 / 2
+    frames = 0
+    while True:
+        frame = input_file.read(frame_size)
+        if len(frame) < frame_size:
             break
-        else:
-            time.sleep(0.05)
-
-
-def check_tiles(dir_path, frames):
-    ctr = 0
-    tile_frames = 0
-    for file_str in os.listdir(dir_path):
-        if not file_str.endswith('.yuv') or "Tile" not in file_str:
-            continue
-        if "384" in file_str:
-            tile_frames = get_frame_cnt_yuv420(os.path.join(dir_path, file_str), 384, 384)
-            ctr += 1
-        elif "768" in file_str:
-            tile_frames = get_frame_cnt_yuv420(os.path.join(dir_path, file_str), 768, 768)
-            ctr += 1
-        if not tile_frames==frames:
+        for frame_writer in frame_writers:
+            frame_writer.put(frame)
+        for writer, tile in zip(tile_writers, split_yuv420_frame(frame, width, height, layout.cols, layout.rows)):
+            writer.put(tile)
+        frames += 1
+    return frames
+
+
+def check_tiles(dir_path, frames, layout):
+    for tier, n in layout.get_tiles():
+        width, height = layout.get_tile_size(tier)
+        file_path = os.path.join(dir_path, get_tile_name(width, height, n))
+        if not os.path.isfile(file_path) or not get_frame_cnt_yuv420(file_path, width, height) == frames:
             return False
-    return ctr == 48
+    return True
 
 
-def check_hevc_tiles(dir_path, qp):
-    ctr = 0
-    for file_str in os.listdir(dir_path):
-        if not file_str.endswith('.265') or "qp{}".format(qp) not in file_str:
-            continue
-        if "384" in file_str or "768" in file_str:
-            ctr += 1
-    return ctr == 48
+def check_hevc_tiles(dir_path, qp, layout):
+    names = set()  # file names without prefix
+    for tier, n in layout.get_tiles():
+        width, height = layout.get_tile_size(tier)
+        names.add(get_hevc_name('', width, height, qp, n))
+    found = set(name for file_str in os.listdir(dir_path) for name in names if file_str.endswith(name))
+    return len(found) == len(names)
 
 
 def find_files_in_dir(dir_path, search_string):
@@ -246,12 +193,6 @@ def find_files_in_dir(dir_path, search_string):
     return ret_val
 
 
-def get_frame_cnt_yuv420(file_path, width, height):
-    file_size = os.path.getsize(file_path)
-    frame_size = (width*height*3)/2
-    return int(file_size/frame_size)
-
-
 def get_file_prefix(file_in):
     file_in_base = os.path.basename(file_in)
     match = re.search(r'\s*((\d+)x(\d+))', file_in_base)
@@ -262,7 +203,16 @@ def get_file_prefix(file_in):
     return filename_prefix.replace('_', '')
 
 
-def get_step1_cmd(bin_dir, output_dir, file_in, width, height, frame_cnt, bit_depth, chroma_format):
+def get_converter_output(output_file, layout, bit_depth=8):
+    """
+    Returns the path of the file which TApp360Convert writes for --OutputFile=output_file: it replaces the extension
+    with the picture size, the frame rate (0, it is not given), the bit depth and the chroma format.
+    """
+    return "{}_{}x{}_0Hz_{}b_420.yuv".format(os.path.splitext(output_file)[0], layout.width, layout.height, bit_depth)
+
+
+def get_step1_cmd(bin_dir, output_dir, file_in, width, height, frame_cnt, bit_depth, chroma_format, layout,
+                  output_name="highres.yuv", skip_frames=0, rename_output=True):
     cmd = os.path.join(bin_dir, 'TApp360Convert')
     if not os.path.exists(cmd):
         print "\"{}\" not found".format(cmd)
@@ -272,13 +222,21 @@ def get_step1_cmd(bin_dir, output_dir, file_in, width, height, frame_cnt, bit_de
         file_in, bit_depth, chroma_format, width, height)
     if frame_cnt > 0:
         cmd += " --FramesToBeEncoded={}".format(frame_cnt + 1)
-    cmd += " --OutputChromaFormat=420 --CodingGeometryType=1 --CodingFPStructure='2 3  4 0 0 0 5 0  1 0 3 90 2 270'" \
-           " --CodingFaceWidth=1536 --CodingFaceHeight=1536 --OutputFile={}".format(
-        os.path.join(output_dir, "highres.yuv"))
+    if skip_frames > 0:
+        cmd += " --FrameSkip={}".format(skip_frames)
+    cmd += " --OutputChromaFormat=420 --CodingGeometryType=1 --CodingFPStructure='{} {}  {}'" \
+           " --CodingFaceWidth={} --CodingFaceHeight={} --OutputFile={}".format(
+        len(CMP_FRAME_PACKING), len(CMP_FRAME_PACKING[0]),
+        '  '.join(' '.join('{} {}'.format(face, rotation) for face, rotation in row) for row in CMP_FRAME_PACKING),
+        layout.face_size, layout.face_size, os.path.join(output_dir, output_name))
+    if rename_output:
+        # the converter appends the picture format to the file name, the next steps expect output_name
+        cmd += " && mv -f {} {}".format(get_converter_output(os.path.join(output_dir, output_name), layout, bit_depth),
+                                        os.path.join(output_dir, output_name))
     return cmd
 
 
-def get_step2_cmd(input_dir, output_dir):
+def get_step2_cmd(input_dir, output_dir, layout):
     high_res_files = find_files_in_dir(input_dir, "highres")
     if len(high_res_files) == 0:
         print "Error: no highres file found in {}".format(input_dir)
@@ -286,53 +244,169 @@ def get_step2_cmd(input_dir, output_dir):
     elif len(high_res_files) > 1:
         print "Warn: more than 1 highres files found in {}. select first: {}".format(input_dir, high_res_files[0])
 
-    cmd = "ffmpeg -y -loglevel quiet -f rawvideo -pix_fmt yuv420p -s:v 4608x3072 -i {} -pix_fmt yuv420p" \
-           " -s:v 2304x1536 {}".format(high_res_files[0], os.path.join(output_dir, "lowres_2304x1536.yuv"))
-    return cmd
+    return [get_downscale_cmd(high_res_files[0], os.path.join(output_dir, layout.get_tier_name(tier) + ".yuv"),
+                              layout, tier) for tier in range(1, len(layout.scales))]
 
 
-def get_step3_cmd(input_dir, output_dir, guardband_size, guardband_mode):
-    high_res_files = find_files_in_dir(input_dir, "highres")
-    if len(high_res_files) == 0:
-        print "Error: no highres file found in {}".format(input_dir)
-        return None
-    elif len(high_res_files) > 1:
-        print "Warn: more than 1 highres files found in {}. select first: {}".format(input_dir, high_res_files[0])
+def get_downscale_cmd(input_file, output_file, layout, tier, skip_frames=0, frame_cnt=0):
+    """
+    Returns the ffmpeg command which scales the highres CMP yuv down to the CMP yuv of a lower tier. Use '-' for pipes.
+    :param skip_frames: number of frames to skip at the start of the input
+    :param frame_cnt: number of frames to scale, 0 for all frames
+    """
+    if output_file == '-':
+        output_file = "-f rawvideo -"
+    width, height = layout.get_picture_size(tier)
+    cmd = "ffmpeg -y -loglevel quiet -f rawvideo -pix_fmt yuv420p -s:v {}x{}".format(layout.width, layout.height)
+    if skip_frames > 0:
+        cmd += " -skip_initial_bytes {}".format(skip_frames * layout.width * layout.height * 3 / 2)
+    cmd += " -i {}".format(input_file)
+    if frame_cnt > 0:
+        cmd += " -frames:v {}".format(frame_cnt)
+    return cmd + " -pix_fmt yuv420p -s:v {}x{} {}".format(width, height, output_file)
+
+
+def find_step3_input_files(input_dir, layout):
+    """
+    :return: list of the CMP yuv files of all tiers or None
+    """
+    files = []
+    for tier in range(len(layout.scales)):
+        search_string = layout.get_tier_name(tier)
+        tier_files = find_files_in_dir(input_dir, search_string)
+        if len(tier_files) == 0 and tier > 0 and len(layout.scales) == 2:
+            search_string = "lowres"
+            tier_files = find_files_in_dir(input_dir, search_string)
+        if len(tier_files) == 0:
+            print "Error: no {} file found in {}".format(search_string, input_dir)
+            return None
+        elif len(tier_files) > 1:
+            print "Warn: more than 1 {} files found in {}. select first: {}".format(search_string, input_dir,
+                                                                                    tier_files[0])
+        files.append(tier_files[0])
+    return files
 
-    low_res_files = find_files_in_dir(input_dir, "lowres")
-    if len(low_res_files) == 0:
-        print "Error: no lowres file found in {}".format(input_dir)
+
+def get_tile_name(width, height, n):
+    return "Tile_{}x{}_{}.yuv".format(width, height, n)
+
+
+def get_hevc_name(file_prefix, width, height, qp, n):
+    return "{}_{}x{}_qp{}_seg{}.265".format(file_prefix, width, height, qp, n)
+
+
+def get_guardband_filter(width, height, guardband_size, guardband_mode):
+    gb = guardband_size
+    return "scale={}:{}[sc]; [sc]pad={}:{}:{}:{}[pd]; [pd]fillborders={}:{}:{}:{}:{}".format(
+        width - gb * 2, height - gb * 2, width, height, gb, gb, gb, gb, gb, gb, guardband_mode)
+
+
+def get_step3_cmd(input_dir, output_dir, guardband_size, guardband_mode, layout):
+    input_files = find_step3_input_files(input_dir, layout)
+    if not input_files:
         return None
-    elif len(low_res_files) > 1:
-        print "Warn: more than 1 lowres files found in {}. select first: {}".format(input_dir, low_res_files[0])
 
     cmds = []
-    for size in [768, 384]:
-        for n in range(24):
-            input_file = high_res_files[0]
-            output_file = "Tile_{}x{}_{}.yuv".format(size, size, n)
-            if size == 384:
-                input_file = low_res_files[0]
-            x = (n % 6) * size
-            y = int(n / 6) * size
-            cmd = "ffmpeg"
-
-            # do we use guardbands?
-            if guardband_size == 0:  # no
-                cmd += " -y -loglevel quiet -f rawvideo -pix_fmt yuv420p" \
-                       " -s:v {}x{} -i {} -filter:v \"crop={}:{}:{}:{}\"" \
-                       " {}".format(size * 6, size * 4, input_file, size, size, x, y, os.path.join(output_dir, output_file))
-            else:
-                gb = guardband_size
-                cmd += " -y -loglevel quiet -f rawvideo -pix_fmt yuv420p" \
-                       " -s:v {}x{} -i {} -filter:v \"crop={}:{}:{}:{}[cr];[cr]scale={}:{}[sc]; [sc]pad={}:{}:{}:{}[pd]; [pd]fillborders={}:{}:{}:{}:{}\"" \
-                       " {}".format(size * 6, size * 4, input_file, size, size, x, y, size - gb * 2, size - gb * 2, size,
-                                    size, gb, gb, gb, gb, gb, gb, guardband_mode, os.path.join(output_dir, output_file))
-            cmds.append(cmd)
+    for tier, n in layout.get_tiles():
+        width, height = layout.get_tile_size(tier)
+        output_file = os.path.join(output_dir, get_tile_name(width, height, n))
+        cmds.append(get_crop_cmd(input_files[tier], output_file, layout, tier, n, guardband_size, guardband_mode))
     return cmds
 
 
-def get_step4_cmd(bin_dir, input_dir, output_dir, file_prefix, qps, fps, frame_cnt, config_file, codec):
+def get_crop_cmd(input_file, output_file, layout, tier, n, guardband_size, guardband_mode):
+    width, height = layout.get_tile_size(tier)
+    x, y = layout.get_tile_offset(tier, n)
+    picture_width, picture_height = layout.get_picture_size(tier)
+    cmd = "ffmpeg"
+
+    # do we use guardbands?
+    if guardband_size == 0:  # no
+        cmd += " -y -loglevel quiet -f rawvideo -pix_fmt yuv420p" \
+               " -s:v {}x{} -i {} -filter:v \"crop={}:{}:{}:{}\"" \
+               " {}".format(picture_width, picture_height, input_file, width, height, x, y, output_file)
+    else:
+        cmd += " -y -loglevel quiet -f rawvideo -pix_fmt yuv420p" \
+               " -s:v {}x{} -i {} -filter:v \"crop={}:{}:{}:{}[cr];[cr]{}\"" \
+               " {}".format(picture_width, picture_height, input_file, width, height, x, y,
+                            get_guardband_filter(width, height, guardband_size, guardband_mode), output_file)
+    return cmd
+
+
+def split_yuv420_frame(frame, tile_width, tile_height, cols, rows):
+    """
+    Splits a raw yuv420p frame which consists of cols x rows tiles of tile_width x tile_height into a list of raw
+    tile frames.
+    """
+    width = tile_width * cols
+    luma_size = width * tile_height * rows
+    # (offset, width, tile width, tile height) of the Y, U and V planes
+    planes = [(0, width, tile_width, tile_height),
+              (luma_size, width / 2, tile_width / 2, tile_height / 2),
+              (luma_size * 5 / 4, width / 2, tile_width / 2, tile_height / 2)]
+    tiles = []
+    for n in range(cols * rows):
+        x = n % cols
+        y = n / cols
+        lines = []
+        for plane_offset, plane_width, plane_tile_width, plane_tile_height in planes:
+            start = plane_offset + y * plane_tile_height * plane_width + x * plane_tile_width
+            for line_start in xrange(start, start + plane_tile_height * plane_width, plane_width):
+                lines.append(frame[line_start:line_start + plane_tile_width])
+        tiles.append(''.join(lines))
+    return tiles
+
+
+def tile_yuv420(input_file, output_dir, layout, tier, guardband_size=0, guardband_mode='smear', complexity_path=None):
+    """
+    Splits the raw yuv420p file of a tier into the tiles of the layout and writes Tile_{width}x{height}_{n}.yuv files.
+    Each frame of the input file is read only once and is cropped into all tiles. If guard bands are used, each tile
+    is piped to an ffmpeg process which only does the scaling, padding and border filling. The TileComplexity of all
+    tiles is measured in the same pass and written to complexity_path if it is given.
+    :return: True on success
+    """
+    width, height = layout.get_tile_size(tier)
+    frame_size = width * layout.cols * height * layout.rows * 3 / 2
+    outputs = []
+    processes = []
+    for n in range(layout.tile_count):
+        output_file = os.path.join(output_dir, get_tile_name(width, height, n))
+        if guardband_size == 0:
+            outputs.append(open(output_file, mode='wb'))
+        else:
+            cmd = "ffmpeg -y -loglevel quiet -f rawvideo -pix_fmt yuv420p -s:v {}x{} -i - -filter:v \"{}\" {}".format(
+                width, height, get_guardband_filter(width, height, guardband_size, guardband_mode), output_file)
+            processes.append(subprocess.Popen(shlex.split(cmd), stdin=subprocess.PIPE))
+            outputs.append(processes[-1].stdin)
+
+    complexities = [TileComplexity(width, height) for n in range(layout.tile_count)] if complexity_path else []
+    with open(input_file, mode='rb') as f:
+        while True:
+            frame = f.read(frame_size)
+            if len(frame) < frame_size:
+                break
+            tiles = split_yuv420_frame(frame, width, height, layout.cols, layout.rows)
+            for output, tile in zip(outputs, tiles):
+                output.write(tile)
+            for complexity, tile in zip(complexities, tiles):
+                complexity.add_frame(tile)
+
+    for output in outputs:
+        output.close()
+    if complexity_path:
+        write_tile_complexity(complexity_path, complexities)
+    for p in processes:
+        if not p.wait() == 0:
+            print "ERROR: guard band ffmpeg process failed: errorcode={}".format(p.returncode)
+            return False
+    return True
+
+
+def get_tile_fifo_name(width, height, n, qp):
+    return "Tile_{}x{}_{}_qp{}.fifo".format(width, height, n, qp)
+
+
+def get_encoder_bin(bin_dir, codec, config_file):
     enc_bin = os.path.join(bin_dir, 'TAppEncoder')
     if codec == 2:
         enc_bin = os.path.join(bin_dir, 'FileInputTest')
@@ -344,6 +418,14 @@ def get_step4_cmd(bin_dir, input_dir, output_dir, file_prefix, qps, fps, frame_c
     if not os.path.exists(enc_bin) and not codec == 1:
         print "\"{}\" not found. HM binary missing? If you want to use HHI enc please contact HHI.".format(enc_bin)
         return None
+    return enc_bin
+
+
+def get_step4_cmd(bin_dir, input_dir, output_dir, file_prefix, qps, fps, frame_cnt, config_file, codec, layout,
+                  inline_filter=False, stream_input=False, segment_frames=PACKAGER_SEGMENT_FRAMES, preset='slower'):
+    enc_bin = get_encoder_bin(bin_dir, codec, config_file)
+    if not enc_bin:
+        return None
 
     if codec == 0 and len(qps) > 1:
         # HM needs to be updated to support multiple QPs
@@ -353,91 +435,1017 @@ def get_step4_cmd(bin_dir, input_dir, output_dir, file_prefix, qps, fps, frame_c
 
     cmds = []
     for qp in qps:
-        for size in [768, 384]:
-            for n in range(24):
-                input_file = "Tile_{}x{}_{}.yuv".format(size, size, n)
-                output_file = "{}_{}x{}_qp{}_seg{}.265".format(file_prefix, size, size, qp, n)
-                log_file = "{}_{}x{}_qp{}_seg{}.log".format(file_prefix, size, size, qp, n)
-                input_file = os.path.join(input_dir, input_file)
-                output_file = os.path.join(output_dir, 'qp{}'.format(qp), output_file)
-                log_file = os.path.join(output_dir, 'qp{}'.format(qp), log_file)
-
-                input_file_frames = get_frame_cnt_yuv420(input_file, size, size)
-
-                if frame_cnt + 1 > input_file_frames:
-                    print "Error: provided frame count {}+1 is to big " \
-                        "for file {} with {} frames.".format(frame_cnt, input_file, input_file_frames)
-                    return None
-
-                cmd = enc_bin
-                if codec == 2: # HHI encoder
-                    cmd += " --InputFileName {}".format(input_file)
-                    if input_file_frames < 20:
-                        cmd += " --Prefetch {}".format(input_file_frames)
-                    if frame_cnt > 0:
-                        cmd += " --NumFrames {}".format(frame_cnt + 1)
-                    cmd += " --m 1 --CodingFlags 0 --Verbosity 1 --TicksPerSecond 90000 --NumThreads 2 --SceneCutDetection 0" \
-                           " --Quality 14 -r 0 --FileBitDepth 8 --InternalBitDepth 8 --IDRPeriod 9 --ParallelismMode 3"
-                    cmd += " --Width {} --Height {}  --TemporalRate {} --Qp {}" \
-                           " --BitstreamFileName {} &>{}".format(size, size, fps, qp, output_file, log_file)
-                elif codec == 1: # kvazaar
-                    cmd += " -i {} -o {} ".format(input_file, output_file)
-                    cmd += " --no-open-gop --bipred --mv-constraint frametilemargin --set-qp-in-cu --slices tiles"
-                    cmd += " --no-info --no-psnr --tiles 1x1"
-                    cmd += " --preset slower --gop 8 --period 8 --qp {}".format(qp)
-                    cmd += " --input-res {}x{} --input-fps {}".format(size, size, fps)
-                    if frame_cnt > 0:
-                        cmd += " --frames {}".format(frame_cnt + 1)
-                else: # HM reference HEVC encoder => start it before you go on vacation ;)
-                    cmd += " --InputFile={} -c {}".format(input_file, config_file)
-                    if frame_cnt > 0:
-                        cmd += " --FramesToBeEncoded={}".format(frame_cnt + 1)
-                    cmd += " --SEITempMotionConstrainedTileSets=1 --SEITMCTSTileConstraint=1"
-                    cmd += " --SourceWidth={} --SourceHeight={} --FrameRate={} --QP={} --InputBitDepth=8" \
-                           " --BitstreamFile={} &>{}".format(size, size, fps, qp, output_file, log_file)
-                cmds.append(cmd)
+        for tier, n in layout.get_tiles():
+            width, height = layout.get_tile_size(tier)
+            input_file = os.path.join(input_dir, get_tile_name(width, height, n))
+            output_file = os.path.join(output_dir, 'qp{}'.format(qp), get_hevc_name(file_prefix, width, height, qp, n))
+            log_file = output_file[:-len('.265')] + '.log'
+
+            filtered_file = output_file
+            if inline_filter:
+                output_file += '.fifo'
+            if stream_input:
+                # tiles are streamed through named pipes while they are created
+                input_file = os.path.join(input_dir, get_tile_fifo_name(width, height, n, qp))
+                input_file_frames = frame_cnt + 1 if frame_cnt > 0 else sys.maxint
+            else:
+                input_file_frames = get_frame_cnt_yuv420(input_file, width, height)
+
+            if frame_cnt + 1 > input_file_frames:
+                print "Error: provided frame count {}+1 is to big " \
+                    "for file {} with {} frames.".format(frame_cnt, input_file, input_file_frames)
+                return None
+
+            cmd = get_encode_cmd(enc_bin, codec, input_file, output_file, log_file, width, height, qp, fps,
+                                 frame_cnt, config_file, input_file_frames, preset=preset)
+            if inline_filter:
+                cmd = create_inline_filter_job(cmd, output_file, filtered_file,
+                                               BitrateIndex(get_index_path(filtered_file), fps, segment_frames))
+            if stream_input:
+                if not isinstance(cmd, Job):
+                    cmd = Job(cmd)
+                cmd.inputs.append(input_file)
+            cmds.append(cmd)
     return cmds
 
 
-def get_step5_cmd(mode, bin_dir, input_dir, output_dir, qps, frame_cnt, fps, file_prefix, guardband_size):
-    cmd = os.path.join(bin_dir, 'hevc2omaf')
-    if not os.path.exists(cmd):
-        print "\"{}\" not found".format(cmd)
-        return None
-    cmd += " --mode {} --inputDir {} --outputDir {} --QP {} --duration {} --fps {} --inputFilePrefix {}" \
-           " --guardbands {}".format(mode, input_dir, output_dir, ' '.join(str(q) for q in qps), frame_cnt, fps,
-                                     file_prefix, guardband_size)
+def get_encode_cmd(enc_bin, codec, input_file, output_file, log_file, width, height, qp, fps, frame_cnt,
+                   config_file, input_file_frames, skip_frames=0, preset='slower', qp_offset=0):
+    """
+    Returns the encoder command of a tile. The encoder uses the QP qp + qp_offset (--AdaptiveTiles), the file names
+    are given by the caller and keep the QP, so all tiles of a QP are still packaged together.
+    """
+    qp = min(qp + qp_offset, 51)
+    cmd = enc_bin
+    if codec == 2: # HHI encoder
+        cmd += " --InputFileName {}".format(input_file)
+        if input_file_frames < 20:
+            cmd += " --Prefetch {}".format(input_file_frames)
+        if frame_cnt > 0:
+            cmd += " --NumFrames {}".format(frame_cnt + 1)
+        cmd += " --m 1 --CodingFlags 0 --Verbosity 1 --TicksPerSecond 90000 --NumThreads 2 --SceneCutDetection 0" \
+               " --Quality {} -r 0 --FileBitDepth 8 --InternalBitDepth 8 --IDRPeriod 9 --ParallelismMode 3".format(
+                   HHI_PRESET_QUALITY.get(preset, HHI_QUALITY))
+        cmd += " --Width {} --Height {}  --TemporalRate {} --Qp {}" \
+               " --BitstreamFileName {} &>{}".format(width, height, fps, qp, output_file, log_file)
+    elif codec == 1: # kvazaar
+        cmd += " -i {} -o {} ".format(input_file, output_file)
+        cmd += " --no-open-gop --bipred --mv-constraint frametilemargin --set-qp-in-cu --slices tiles"
+        cmd += " --no-info --no-psnr --tiles 1x1"
+        cmd += " --preset {} --gop 8 --period 8 --qp {}".format(preset, qp)
+        cmd += " --input-res {}x{} --input-fps {}".format(width, height, fps)
+        if frame_cnt > 0:
+            cmd += " --frames {}".format(frame_cnt + 1)
+        if skip_frames > 0:
+            cmd += " --seek {}".format(skip_frames)
+    else: # HM reference HEVC encoder => start it before you go on vacation ;)
+        cmd += " --InputFile={} -c {}".format(input_file, config_file)
+        if preset in HM_PRESET_OPTIONS:
+            cmd += " " + HM_PRESET_OPTIONS[preset]
+        if frame_cnt > 0:
+            cmd += " --FramesToBeEncoded={}".format(frame_cnt + 1)
+        if skip_frames > 0:
+            cmd += " --FrameSkip={}".format(skip_frames)
+        cmd += " --SEITempMotionConstrainedTileSets=1 --SEITMCTSTileConstraint=1"
+        cmd += " --SourceWidth={} --SourceHeight={} --FrameRate={} --QP={} --InputBitDepth=8" \
+               " --BitstreamFile={} &>{}".format(width, height, fps, qp, output_file, log_file)
     return cmd
 
 
-def filter_nalus(input_dir, qps, file_prefix):
+def run_stream_pipeline(step1_cmd, step4_jobs, yuv_dir, qps, layout, bit_depth=8):
+    """
+    Runs steps 1-4 without intermediate yuv files. The converter writes the highres CMP frames into a named pipe, which
+    is created under the name TApp360Convert derives from its --OutputFile highres.yuv.fifo and the bit depth.
+    Each frame is split into the highres tiles and passed to one ffmpeg per lower tier which scales it down. The
+    frames of the lower tiers are read from ffmpeg and split as well. Every tile is written into the named pipes of its
+    encoders (one per QP). All encoders run at the same time. Frames are buffered in bounded queues, so a slow encoder
+    slows down the whole pipeline instead of filling up the memory.
+    :return: True on success
+    """
+    highres_fifo = get_converter_output(os.path.join(yuv_dir, "highres.yuv.fifo"), layout, bit_depth)
+    fifos = [highres_fifo]
     for qp in qps:
-        hevc_dir_filtered = os.path.join(input_dir, "temp", 'qp{}'.format(qp))
-        make_dirs_if_not_exist(hevc_dir_filtered)
-        for size in [768, 384]:
-            for n in range(24):
-                input_filename = "{}_{}x{}_qp{}_seg{}.265".format(file_prefix, size, size, qp, n)
-                input_path = os.path.join(input_dir, 'qp{}'.format(qp), input_filename)
-                output_path = os.path.join(hevc_dir_filtered, input_filename)
-                with open(input_path, mode='rb') as f:
-                    buffer = f.read()
-                    nalus = get_nal_units(buffer)
-                    if len(nalus) < 1:
-                        print 'WARN: no nal units could be found in', input_path
-                        continue
-                    filter_offsets = find_filtered_nalu_offsets(nalus)
-                    write_file_from_offsets(output_path, buffer, filter_offsets)
-        # replace old directory with filtered one
-        shutil.rmtree(os.path.join(input_dir, 'qp{}'.format(qp)))
-        shutil.move(hevc_dir_filtered, input_dir)
-    shutil.rmtree(os.path.join(input_dir, 'temp'))
+        for tier, n in layout.get_tiles():
+            width, height = layout.get_tile_size(tier)
+            fifos.append(os.path.join(yuv_dir, get_tile_fifo_name(width, height, n, qp)))
+    for fifo in fifos:
+        if os.path.exists(fifo):
+            os.remove(fifo)
+        os.mkfifo(fifo)
+
+    # start all encoders, their inputs are the tile pipes
+    encoders = {}
+    for job in step4_jobs:
+        if job.on_start:
+            job.on_start()
+        p = subprocess.Popen(shlex.split(job.cmd))
+        for fifo in job.inputs:
+            encoders[fifo] = p
+        encoders[job] = p
+    converter = subprocess.Popen(shlex.split(step1_cmd))
+    lower_tiers = range(1, len(layout.scales))
+    downscalers = [subprocess.Popen(shlex.split(get_downscale_cmd('-', '-', layout, tier)), stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE) for tier in lower_tiers]
+
+    writers = {}
+    for tier, n in layout.get_tiles():
+        width, height = layout.get_tile_size(tier)
+        consumers = []
+        for qp in qps:
+            fifo = os.path.join(yuv_dir, get_tile_fifo_name(width, height, n, qp))
+            consumers.append((fifo, encoders[fifo]))
+        writers[(tier, n)] = FrameWriter(consumers)
+    downscale_writers = [FrameWriter([downscaler.stdin]) for downscaler in downscalers]
+    all_writers = writers.values() + downscale_writers
+    for writer in all_writers:
+        writer.start()
+
+    low_res_frames = {}  # tier -> number of frames
+
+    def stream_low_res_tiles(tier, downscaler):
+        low_res_frames[tier] = stream_tiles(downscaler.stdout, layout, tier,
+                                            [writers[(tier, n)] for n in range(layout.tile_count)])
+
+    low_res_threads = []
+    for tier, downscaler in zip(lower_tiers, downscalers):
+        thread = threading.Thread(target=stream_low_res_tiles, args=(tier, downscaler))
+        thread.daemon = True
+        thread.start()
+        low_res_threads.append(thread)
+
+    high_res_input = open_fifo_for_reading(highres_fifo, converter)
+    frames = stream_tiles(high_res_input, layout, 0, [writers[(0, n)] for n in range(layout.tile_count)],
+                          downscale_writers)
+    high_res_input.close()
+    for writer in downscale_writers:
+        writer.close()
+    for thread in low_res_threads:
+        thread.join()
+    for tier, n in layout.get_tiles():
+        writers[(tier, n)].close()
+    print "{} frames streamed to {} encoders".format(frames, len(step4_jobs))
+
+    success = True
+    for name, p in [("TApp360Convert", converter)] + [("ffmpeg", downscaler) for downscaler in downscalers]:
+        if not p.wait() == 0:
+            print "ERROR: {} failed: errorcode={}".format(name, p.returncode)
+            success = False
+    for tier in lower_tiers:
+        if not low_res_frames.get(tier) == frames:
+            print "ERROR: {} highres but {} {} frames".format(frames, low_res_frames.get(tier, 0),
+                                                              layout.get_tier_name(tier))
+            success = False
+    for writer in all_writers:
+        if writer.error:
+            print "ERROR: writing frames failed: {}".format(writer.error)
+            success = False
+    for job in step4_jobs:
+        p = encoders[job]
+        job_ok = True
+        if job.on_exit:
+            job_ok = job.on_exit(p.wait()) is not False
+        if not p.wait() == 0 or not job_ok:
+            print "ERROR: executing command: errorcode={}: {}".format(p.returncode, job.cmd)
+            success = False
+    for fifo in fifos:
+        os.remove(fifo)
+    return success
+
+
+def encode_tile_qps(input_file, width, height, frame_cnt, encodes):
+    """
+    Encodes one tile with several QPs at the same time. The tile is read only once and each frame is written to the
+    named pipes of all encoders. Every encoder has its own bounded frame queue, so the encoders run in lockstep and
+    the reader is only blocked by an encoder whose queue is full.
+    :param frame_cnt: number of frames to read, None for all frames
+    :param encodes: list of (encoder command, named pipe the encoder reads from, filtered output or None,
+                    BitrateIndex or None). If a filtered output is given, the encoder writes to the named pipe
+                    filtered_output + '.fifo' and the bitstream is filtered (and indexed) inline.
+    :return: True on success
+    """
+    jobs = []
+    for cmd, fifo_path, filtered_output, index in encodes:
+        if os.path.exists(fifo_path):
+            os.remove(fifo_path)
+        os.mkfifo(fifo_path)
+        if filtered_output:
+            jobs.append(create_inline_filter_job(cmd, filtered_output + '.fifo', filtered_output, index))
+        else:
+            jobs.append(Job(cmd))
 
+    processes = []
+    writers = []
+    for job, (cmd, fifo_path, filtered_output, index) in zip(jobs, encodes):
+        if job.on_start:
+            job.on_start()
+        processes.append(subprocess.Popen(shlex.split(job.cmd)))
+        writers.append(FrameWriter([(fifo_path, processes[-1])]))
+    for writer in writers:
+        writer.start()
+
+    frame_size = width * height * 3 / 2
+    frames = 0
+    with open(input_file, mode='rb') as f:
+        while frame_cnt is None or frames < frame_cnt:
+            frame = f.read(frame_size)
+            if len(frame) < frame_size:
+                break
+            for writer in writers:
+                writer.put(frame)
+            frames += 1
+    for writer in writers:
+        writer.close()
+
+    success = True
+    for job, p, writer in zip(jobs, processes, writers):
+        job_ok = True
+        if job.on_exit:
+            job_ok = job.on_exit(p.wait()) is not False
+        if not p.wait() == 0 or not job_ok or writer.error:
+            print "ERROR: executing command: errorcode={}: {}".format(p.returncode, job.cmd)
+            success = False
+    for cmd, fifo_path, filtered_output, index in encodes:
+        os.remove(fifo_path)
+    return success
+
+
+def get_rap_period(codec, config_file):
+    """
+    Returns the random access period of the encoder settings or None if it is unknown.
+    """
+    if codec == 1:
+        return 8  # kvazaar --period 8
+    elif codec == 2:
+        return 9  # HHI encoder --IDRPeriod 9
+    with open(config_file) as f:
+        match = re.search(r'^IntraPeriod\s*:\s*(\d+)', f.read(), re.MULTILINE)
+    if not match or int(match.group(1)) < 1:
+        return None
+    return int(match.group(1))
 
-def cast_number(num_str):
-    try:
-        return int(num_str)
-    except ValueError:
+
+def get_frame_chunks(frame_cnt, chunk_frames, rap_period):
+    """
+    Splits frame_cnt frames into chunks of at least chunk_frames frames which start at a random access point.
+    :return: list of (first frame, number of frames)
+    """
+    chunk_frames = max(1, (chunk_frames + rap_period - 1) / rap_period) * rap_period
+    chunks = [(first, min(chunk_frames, frame_cnt - first)) for first in range(0, frame_cnt, chunk_frames)]
+    if len(chunks) > 1 and chunks[-1][1] < 2:
+        # the tools get the number of frames - 1 and 0 stands for all frames, so the last chunk is appended to the
+        # previous one
+        chunks[-2:] = [(chunks[-2][0], chunks[-2][1] + chunks[-1][1])]
+    return chunks
+
+
+def concat_yuv_files(input_paths, output_path, frame_size, remove_inputs=False):
+    """
+    Concatenates raw yuv files of consecutive frame ranges. Frames have a fixed size, so each file is appended at the
+    end of the previous one. If the inputs are removed, the first file becomes the output and only the others are
+    copied.
+    :return: True on success
+    """
+    for input_path in input_paths:
+        if not os.path.isfile(input_path) or os.path.getsize(input_path) == 0 or \
+                os.path.getsize(input_path) % frame_size:
+            print "ERROR: {} is not a raw yuv file with frames of {} bytes".format(input_path, frame_size)
+            return False
+    copy_paths = input_paths
+    mode = 'wb'
+    if remove_inputs:
+        os.rename(input_paths[0], output_path)
+        copy_paths = input_paths[1:]
+        mode = 'ab'
+    with open(output_path, mode=mode) as out:
+        for input_path in copy_paths:
+            with open(input_path, mode='rb') as f:
+                shutil.copyfileobj(f, out, PIPE_READ_SIZE)
+    if remove_inputs:
+        for input_path in copy_paths:
+            os.remove(input_path)
+        try:
+            os.removedirs(os.path.dirname(input_paths[0]))
+        except OSError:
+            pass  # the directory contains other files
+    return True
+
+
+def get_input_frame_cnt(args, first_step, input_path, layout):
+    """
+    Returns the number of frames of the input of first_step or None if it is not known (e.g. the input of step 2 is
+    created by step 1).
+    """
+    if first_step == 1 and os.path.isfile(input_path):
+        return get_frame_cnt(input_path, args.SourceWidth, args.SourceHeight, args.InputBitDepth,
+                             args.InputChromaFormat)
+    if not os.path.isdir(input_path):
+        return None
+    if first_step in [2, 3]:
+        files = find_files_in_dir(input_path, "highres")
+        if files:
+            return get_frame_cnt_yuv420(files[0], layout.width, layout.height)
+    elif first_step == 4:
+        width, height = layout.get_tile_size(0)
+        tile_path = os.path.join(input_path, get_tile_name(width, height, 0))
+        if os.path.isfile(tile_path):
+            return get_frame_cnt_yuv420(tile_path, width, height)
+    elif first_step == 5:
+        # bitrate index of any bitstream
+        for path in glob.glob(os.path.join(input_path, 'qp*', '*.json')):
+            try:
+                with open(path) as f:
+                    return json.load(f)['frames']
+            except (IOError, ValueError, KeyError):
+                pass
+    return None
+
+
+def find_input_file(input_dir, search_string, producers):
+    """
+    Returns the file in input_dir with search_string in its name. Files which are created by jobs in producers
+    are preferred over existing files.
+    """
+    for path in sorted(producers):
+        if os.path.dirname(path) == input_dir and search_string in os.path.basename(path):
+            return path
+    files = find_files_in_dir(input_dir, search_string)
+    if len(files) == 0:
+        print "Error: no {} file found in {}".format(search_string, input_dir)
         return None
+    elif len(files) > 1:
+        print "Warn: more than 1 {} files found in {}. select first: {}".format(search_string, input_dir, files[0])
+    return files[0]
+
+
+def find_tier_file(input_dir, layout, tier, producers):
+    """
+    Returns the CMP yuv of a tier in input_dir (see find_input_file). If there are only two tiers, any file with
+    "lowres" in its name is accepted as the lowres file.
+    """
+    search_string = layout.get_tier_name(tier)
+    if tier > 0 and len(layout.scales) == 2 and not find_files_in_dir(input_dir, search_string) and \
+            not any(os.path.dirname(path) == input_dir and search_string in os.path.basename(path)
+                    for path in producers):
+        search_string = "lowres"
+    return find_input_file(input_dir, search_string, producers)
+
+
+def get_pipeline_jobs(args, bin_dir, file_prefix, steps, next_input, layout, coordinator=None):
+    """
+    Creates the jobs of all selected steps as one job graph. Each job only depends on the jobs which create its
+    input files, e.g. crop(tile n) -> encode(tile n, qp) -> filter(tile n, qp) -> package.
+    If a coordinator is given, the encoder jobs are executed by its workers.
+    :return: list of jobs or None on error
+    """
+    jobs = []
+    producers = {}  # file path -> job which creates the file
+    high_res_frames = None  # number of highres frames if it is known
+    chunks = None  # frame ranges of chunk encoding (step 4)
+    chunk_bitstreams = []  # (chunk paths, qp, bitstream name) of each tile and QP
+    concat_jobs = []
+    report_files = set()  # written by --Quality and --Validate, not needed for packaging
+    check_reports = []  # validation reports of all bitstreams (--Validate)
+    frames = args.FramesToBeEncoded + 1
+    if args.FramesToBeEncoded <= 0:
+        # all frames, only needed for the estimates of the jobs
+        frames = get_input_frame_cnt(args, steps[0], next_input, layout) or 1
+
+    def add_job(job, outputs, tile=None, qp=None, intermediate=None):
+        job.deps = [producers[path] for path in job.inputs if path in producers]
+        job.outputs = outputs
+        job.tile = tile
+        job.qp = qp
+        job.intermediate = intermediate
+        jobs.append(job)
+        for path in outputs:
+            producers[path] = job
+
+    def add_check_job(output_file, tier, n, tile, qp, input_file=None):
+        # validate the final bitstream, a broken one is encoded again if its encoder job is part of the run
+        width, height = layout.get_tile_size(tier)
+        check_path = get_check_path(output_file)
+        rap_period = None
+        if args.codec or (args.HMconfig and os.path.isfile(args.HMconfig)):
+            rap_period = get_rap_period(args.codec, args.HMconfig)
+        job = FunctionJob("check {}".format(output_file), validate_bitstream, step=4 if 4 in steps else 5,
+                          args=(output_file, check_path, width, height,
+                                args.FramesToBeEncoded + 1 if args.FramesToBeEncoded > 0 else None, input_file,
+                                rap_period, not args.codec == 0),
+                          cost=estimate_job_cost('filter', width * height, frames), kind='filter')
+        # the tile is kept until its bitstreams are valid
+        job.inputs.extend([output_file, get_index_path(output_file)] + ([input_file] if input_file else []))
+        job.output_bytes = 0  # only the small report
+        add_job(job, [check_path], tile, qp)
+        # the encoder, concatenation and filter jobs of the bitstream
+        pending = list(job.deps)
+        while pending:
+            dep = pending.pop()
+            if dep.step == 4 and dep.tile == tile and dep not in job.retry:
+                job.retry.append(dep)
+                pending.extend(dep.deps)
+        report_files.add(check_path)
+        check_reports.append(check_path)
+
+    def add_alignment_job(hevc_dir):
+        check_path = os.path.join(hevc_dir, 'check.json')
+        job = FunctionJob("check {}".format(hevc_dir), check_bitstream_alignment, step=4 if 4 in steps else 5,
+                          args=(check_path, list(check_reports)), cost=estimate_job_cost('filter', 1, 1),
+                          kind='filter')
+        job.inputs = list(check_reports)
+        job.output_bytes = 0
+        add_job(job, [check_path])
+
+    for step in steps:
+        if step == 1:
+            yuv_dir = os.path.join(args.OutputDir, 'yuv', file_prefix)
+            make_dirs_if_not_exist(yuv_dir)
+            print "NOTE: The sequence you provided is now called \"{}\"" \
+                  " you will find all the output files in directory \"{}\"".format(file_prefix, yuv_dir)
+            high_res_file = os.path.join(yuv_dir, "highres.yuv")
+            if os.path.isfile(next_input):
+                high_res_frames = get_frame_cnt(next_input, args.SourceWidth, args.SourceHeight, args.InputBitDepth,
+                                                args.InputChromaFormat)
+                if args.FramesToBeEncoded > 0:
+                    high_res_frames = min(high_res_frames, args.FramesToBeEncoded + 1)
+            shards = []
+            if args.ShardFrames > 0 and high_res_frames:
+                shards = get_frame_chunks(high_res_frames, args.ShardFrames, 1)
+            lut_path = os.path.join(args.OutputDir, 'luts', 'erp{}x{}_cmp{}.lut'.format(
+                args.SourceWidth, args.SourceHeight, layout.face_size))
+            if args.NativeConvert:
+                # the lookup table is kept for later runs with the same geometry
+                job = FunctionJob("lut {}".format(lut_path), create_erp_to_cmp_lut, step=1,
+                                  args=(lut_path, args.SourceWidth, args.SourceHeight, layout),
+                                  cost=estimate_job_cost('lut', layout.width * layout.height, 1), kind='lut')
+                job.output_bytes = get_erp_to_cmp_lut_size(layout)
+                add_job(job, [lut_path])
+
+            def create_convert_job(output_file, first, count, processes=1):
+                # count = 0 converts all frames
+                if args.NativeConvert:
+                    job = FunctionJob("convert {}".format(output_file), convert_erp_to_cmp, step=1,
+                                      args=(next_input, output_file, args.SourceWidth, args.SourceHeight, layout,
+                                            lut_path, first, count),
+                                      kwargs={'processes': processes},
+                                      cost=estimate_job_cost('remap', layout.width * layout.height,
+                                                             count or frames) / processes,
+                                      kind='remap')
+                    job.threads = processes
+                    job.inputs.append(lut_path)
+                    return job
+                cmd = get_step1_cmd(bin_dir, os.path.dirname(output_file), next_input, args.SourceWidth,
+                                    args.SourceHeight, count - 1, args.InputBitDepth, args.InputChromaFormat, layout,
+                                    os.path.basename(output_file), first)
+                if not cmd:
+                    print "Error: no command to execute in step 1"
+                    return None
+                cost = estimate_job_cost('convert', layout.width * layout.height, count or frames)
+                return Job(cmd, step=1, shell=True, cost=cost, kind='convert')
+
+            if len(shards) > 1:
+                # convert frame ranges in parallel and concatenate them afterwards
+                shard_dir = os.path.join(yuv_dir, 'shards', 'highres')
+                make_dirs_if_not_exist(shard_dir)
+                shard_files = []
+                for k, (first, count) in enumerate(shards):
+                    shard_files.append(os.path.join(shard_dir, "highres_{}.yuv".format(k)))
+                    job = create_convert_job(shard_files[-1], first, count)
+                    if not job:
+                        return None
+                    job.output_bytes = layout.width * layout.height * 3 / 2 * count
+                    add_job(job, [shard_files[-1]], intermediate='shards')
+                job = FunctionJob("concat {}".format(high_res_file), concat_yuv_files, step=1,
+                                  args=(shard_files, high_res_file, layout.width * layout.height * 3 / 2,
+                                        'shards' not in args.Keep),
+                                  cost=estimate_job_cost('filter', layout.width * layout.height, frames), kind='filter')
+                job.inputs.extend(shard_files)
+                add_job(job, [high_res_file], intermediate='highres')
+            else:
+                # the built-in converter converts the frames with all cores
+                job = create_convert_job(high_res_file, 0,
+                                         args.FramesToBeEncoded + 1 if args.FramesToBeEncoded > 0 else 0,
+                                         min(args.NumThreads, frames) if args.NativeConvert else 1)
+                if not job:
+                    return None
+                job.output_bytes = layout.width * layout.height * 3 / 2 * frames
+                add_job(job, [high_res_file], intermediate='highres')
+            next_input = yuv_dir
+        elif step == 2:
+            output_dir = next_input
+            if 1 not in steps:
+                output_dir = args.OutputDir
+                make_dirs_if_not_exist(output_dir)
+            high_res_file = find_input_file(next_input, "highres", producers)
+            if not high_res_file:
+                print "Error: no command to execute in step 2"
+                return None
+            if high_res_file not in producers:
+                high_res_frames = get_frame_cnt_yuv420(high_res_file, layout.width, layout.height)
+            shards = []
+            if args.ShardFrames > 0 and high_res_frames:
+                shards = get_frame_chunks(high_res_frames, args.ShardFrames, 1)
+            for tier in range(1, len(layout.scales)):
+                low_res_file = os.path.join(output_dir, layout.get_tier_name(tier) + ".yuv")
+                width, height = layout.get_picture_size(tier)
+                if len(shards) > 1:
+                    # scale frame ranges down in parallel and concatenate them afterwards
+                    shard_dir = os.path.join(output_dir, 'shards', layout.get_tier_name(tier))
+                    make_dirs_if_not_exist(shard_dir)
+                    shard_files = []
+                    for k, (first, count) in enumerate(shards):
+                        shard_files.append(os.path.join(shard_dir, "{}_{}.yuv".format(layout.get_tier_name(tier), k)))
+                        cmd = get_downscale_cmd(high_res_file, shard_files[-1], layout, tier, first, count)
+                        cost = estimate_job_cost('downscale', layout.width * layout.height, count)
+                        job = Job(cmd, inputs=[high_res_file], step=2, shell=True, cost=cost, kind='downscale')
+                        job.output_bytes = width * height * 3 / 2 * count
+                        add_job(job, [shard_files[-1]], intermediate='shards')
+                    job = FunctionJob("concat {}".format(low_res_file), concat_yuv_files, step=2,
+                                      args=(shard_files, low_res_file, width * height * 3 / 2,
+                                            'shards' not in args.Keep),
+                                      cost=estimate_job_cost('filter', width * height, frames), kind='filter')
+                    job.inputs.extend(shard_files)
+                    add_job(job, [low_res_file], intermediate='lowres')
+                else:
+                    cmd = get_downscale_cmd(high_res_file, low_res_file, layout, tier)
+                    cost = estimate_job_cost('downscale', layout.width * layout.height, frames)
+                    job = Job(cmd, inputs=[high_res_file], step=2, shell=True, cost=cost, kind='downscale')
+                    job.output_bytes = width * height * 3 / 2 * frames
+                    add_job(job, [low_res_file], intermediate='lowres')
+            next_input = output_dir
+        elif step == 3:
+            output_dir = next_input
+            if 2 not in steps:
+                output_dir = args.OutputDir
+                make_dirs_if_not_exist(output_dir)
+            input_files = [find_tier_file(next_input, layout, tier, producers) for tier in range(len(layout.scales))]
+            if not all(input_files):
+                print "Error: no commands to execute in step 3"
+                return None
+            for tier, input_file in enumerate(input_files):
+                width, height = layout.get_tile_size(tier)
+                tiles = [os.path.join(output_dir, get_tile_name(width, height, n)) for n in range(layout.tile_count)]
+                picture_width, picture_height = layout.get_picture_size(tier)
+                if args.FfmpegTiling:
+                    cost = estimate_job_cost('crop', picture_width * picture_height, frames)
+                    for n in range(layout.tile_count):
+                        cmd = get_crop_cmd(input_file, tiles[n], layout, tier, n, args.GuardBandSize,
+                                           args.GuardBandMode)
+                        job = Job(cmd, inputs=[input_file], step=3, cost=cost, kind='crop')
+                        job.output_bytes = width * height * 3 / 2 * frames
+                        add_job(job, [tiles[n]], get_tile_name(width, height, n)[:-len('.yuv')],
+                                intermediate='tiles')
+                else:
+                    tile_args = (input_file, output_dir, layout, tier, args.GuardBandSize, args.GuardBandMode)
+                    outputs = list(tiles)
+                    if args.AdaptiveTiles:
+                        # measure the complexity of the tiles in the same pass
+                        outputs.append(os.path.join(output_dir, get_complexity_name(width, height)))
+                        tile_args += (outputs[-1],)
+                    job = FunctionJob("tile {}".format(input_file), tile_yuv420, step=3, args=tile_args,
+                                      cost=estimate_job_cost('tile', picture_width * picture_height, frames),
+                                      kind='tile')
+                    job.inputs.append(input_file)
+                    job.output_bytes = width * height * 3 / 2 * frames * layout.tile_count
+                    add_job(job, outputs, intermediate='tiles')
+            next_input = output_dir
+        elif step == 4:
+            hevc_dir = os.path.join(args.OutputDir, 'hevc', file_prefix)
+            enc_bin = get_encoder_bin(bin_dir, args.codec, args.HMconfig)
+            if not enc_bin:
+                print "Error: no commands to execute in step 4"
+                return None
+            rap_period = None
+            if args.ChunkFrames > 0:
+                rap_period = get_rap_period(args.codec, args.HMconfig)
+                if args.codec == 2 or not rap_period:
+                    print "WARNING: chunk encoding is not supported with this encoder. Encode whole tiles."
+                    rap_period = None
+                elif args.FramesToBeEncoded <= 0 and 3 in steps:
+                    print "WARNING: chunk encoding needs -f if the tiles are created in the same run. Encode whole tiles."
+                    rap_period = None
+            # filter NALs while encoding if the OS supports named pipes, otherwise filter them afterwards
+            filter_nals = not args.codec == 0
+            inline_filter = filter_nals and args.InlineNalFilter and hasattr(os, 'mkfifo') and not rap_period \
+                and not coordinator
+            # read each tile only once and feed it to the encoders of all QPs
+            fan_out = args.FanOut and len(args.QP) > 1 and hasattr(os, 'mkfifo')
+            if fan_out and (rap_period or coordinator):
+                print "WARNING: --FanOut can not be used together with chunk encoding or a coordinator."
+                fan_out = False
+            # (tier, n) -> list of (qp, arguments of get_encode_cmd, input pipe, encoder output, output file)
+            fan_out_encodes = {}
+            preset = PREVIEW_PRESET if args.Preview else 'slower'  # see HM_PRESET_OPTIONS for HM and HHI
+            fifo_dir = os.path.join(hevc_dir, 'temp')
+            if fan_out:
+                make_dirs_if_not_exist(fifo_dir)
+            complexity_paths = {}  # tier -> complexity file of its tiles (--AdaptiveTiles)
+            if args.AdaptiveTiles and not args.codec == 1:
+                print "WARNING: --AdaptiveTiles is only supported with kvazaar. Encode all tiles with the same settings."
+            elif args.AdaptiveTiles:
+                for tier in range(len(layout.scales)):
+                    width, height = layout.get_tile_size(tier)
+                    complexity_paths[tier] = os.path.join(next_input, get_complexity_name(width, height))
+                    if complexity_paths[tier] in producers:
+                        continue
+                    # the tiles were not created by tile_yuv420, so they are read once more
+                    tile_files = [os.path.join(next_input, get_tile_name(width, height, n))
+                                  for n in range(layout.tile_count)]
+                    job = FunctionJob("analyze {}".format(complexity_paths[tier]), analyze_tiles, step=4,
+                                      args=(tile_files, width, height, complexity_paths[tier]),
+                                      cost=estimate_job_cost('tile', width * height * layout.tile_count, frames),
+                                      kind='tile')
+                    job.inputs.extend(tile_files)
+                    job.output_bytes = 0  # only the small complexity file
+                    add_job(job, [complexity_paths[tier]])
+
+            def get_tile_preset(tile_preset):
+                # --Preview keeps its faster preset
+                return preset if args.Preview else tile_preset
+
+            def adapt_to_tile(job, tier, n, encode_args):
+                # the preset and QP of the tile are chosen when the job is started, encode_args are the arguments of
+                # get_encode_cmd without the preset
+                def apply_settings(tile_preset, qp_offset):
+                    job.cmd = get_encode_cmd(*encode_args, preset=get_tile_preset(tile_preset), qp_offset=qp_offset)
+                set_tile_policy(job, complexity_paths[tier], n, apply_settings)
+
+            def adapt_fan_out_to_tile(job, tier, n, all_encode_args):
+                def apply_settings(tile_preset, qp_offset):
+                    encodes = [(get_encode_cmd(*encode_args, preset=get_tile_preset(tile_preset),
+                                               qp_offset=qp_offset),) + encode[1:]
+                               for encode_args, encode in zip(all_encode_args, job.args[4])]
+                    job.args = job.args[:4] + (encodes,)
+                set_tile_policy(job, complexity_paths[tier], n, apply_settings)
+
+            quality_tiles = {}  # tier -> {qp: list of (quality path, bitrate index path)} (--Quality)
+
+            def add_quality_job(output_file, input_file, tier, n, tile, qp):
+                # decode the final bitstream and compare it with the tile
+                width, height = layout.get_tile_size(tier)
+                quality_path = get_quality_path(output_file)
+                job = FunctionJob("quality {}".format(output_file), measure_tile_quality, step=4,
+                                  args=(output_file, input_file, quality_path, layout, tier, n, args.GuardBandSize,
+                                        args.Quality),
+                                  cost=estimate_job_cost('quality', width * height, frames), kind='quality')
+                job.inputs.extend([output_file, get_index_path(output_file), input_file])
+                if args.Validate:
+                    job.inputs.append(get_check_path(output_file))  # only valid bitstreams are decoded
+                job.output_bytes = 0  # only the small quality file
+                add_job(job, [quality_path], tile, qp)
+                report_files.add(quality_path)
+                quality_tiles.setdefault(tier, {}).setdefault(qp, []).append(
+                    (quality_path, get_index_path(output_file)))
+
+            def create_encode_job(cmd, **kwargs):
+                if coordinator:
+                    files = [args.HMconfig] if args.codec == 0 else []
+                    return RemoteJob(cmd, coordinator, files, **kwargs)
+                return Job(cmd, **kwargs)
+
+            for qp in args.QP:
+                qp_dir = os.path.join(hevc_dir, 'qp{}'.format(qp))
+                temp_dir = os.path.join(hevc_dir, 'temp', 'qp{}'.format(qp))
+                make_dirs_if_not_exist(qp_dir)
+                if (filter_nals and not inline_filter) or rap_period:
+                    make_dirs_if_not_exist(temp_dir)
+                for tier, n in layout.get_tiles():
+                    width, height = layout.get_tile_size(tier)
+                    input_file = os.path.join(next_input, get_tile_name(width, height, n))
+                    tile = get_tile_name(width, height, n)[:-len('.yuv')]
+                    output_file = os.path.join(qp_dir, get_hevc_name(file_prefix, width, height, qp, n))
+                    log_file = output_file[:-len('.265')] + '.log'
+                    index = BitrateIndex(get_index_path(output_file), args.FrameRate, args.SegmentFrames)
+                    encoder_output = output_file
+                    if inline_filter:
+                        encoder_output = output_file + '.fifo'
+                    elif filter_nals:
+                        encoder_output = os.path.join(temp_dir, os.path.basename(output_file))
+
+                    input_file_frames = args.FramesToBeEncoded + 1 if args.FramesToBeEncoded > 0 else sys.maxint
+                    if input_file not in producers:
+                        input_file_frames = get_frame_cnt_yuv420(input_file, width, height)
+                        if args.FramesToBeEncoded + 1 > input_file_frames:
+                            print "Error: provided frame count {}+1 is to big for file {} with {} frames.".format(
+                                args.FramesToBeEncoded, input_file, input_file_frames)
+                            return None
+
+                    if rap_period:
+                        # encode chunks of the tile in parallel and concatenate them afterwards
+                        frame_cnt = args.FramesToBeEncoded + 1 if args.FramesToBeEncoded > 0 else input_file_frames
+                        chunks = get_frame_chunks(frame_cnt, args.ChunkFrames, rap_period)
+                        chunk_files = []
+                        for k, (first, count) in enumerate(chunks):
+                            chunk_name = get_hevc_name(file_prefix, width, height, qp, n)[:-len('.265')]
+                            chunk_file = os.path.join(temp_dir, "{}_chunk{}.265".format(chunk_name, k))
+                            encode_args = (enc_bin, args.codec, input_file, chunk_file,
+                                           chunk_file[:-len('.265')] + '.log', width, height, qp, args.FrameRate,
+                                           count - 1, args.HMconfig, input_file_frames, first)
+                            cmd = get_encode_cmd(*encode_args, preset=preset)
+                            job = create_encode_job(cmd, inputs=[input_file], step=4,
+                                                    threads=ENCODER_THREADS[args.codec],
+                                                    cost=estimate_job_cost('encode{}'.format(args.codec),
+                                                                           width * height, count, qp),
+                                                    kind='encode{}'.format(args.codec))
+                            job.output_bytes = estimate_bitstream_bytes(width * height, count, qp)
+                            if complexity_paths:
+                                adapt_to_tile(job, tier, n, encode_args)
+                            add_job(job, [chunk_file], tile, qp, 'chunks')
+                            chunk_files.append(chunk_file)
+                        job = FunctionJob("concat {}".format(encoder_output), concat_bitstreams, step=4,
+                                          args=(chunk_files, encoder_output, 'chunks' not in args.Keep),
+                                          cost=estimate_job_cost('filter', width * height, frames), kind='filter')
+                        job.inputs.extend(chunk_files)
+                        add_job(job, [encoder_output], tile, qp, 'unfiltered' if filter_nals else None)
+                        chunk_bitstreams.append((chunk_files, qp, os.path.basename(output_file)))
+                        concat_jobs.append(job)
+                    elif fan_out:
+                        # all QPs of the tile are encoded by one job, which is created below
+                        fifo_path = os.path.join(fifo_dir, get_tile_fifo_name(width, height, n, qp))
+                        encode_args = (enc_bin, args.codec, fifo_path, encoder_output, log_file, width, height, qp,
+                                       args.FrameRate, args.FramesToBeEncoded, args.HMconfig, input_file_frames)
+                        fan_out_encodes.setdefault((tier, n), []).append(
+                            (qp, encode_args, fifo_path, encoder_output, output_file))
+                        continue
+                    else:
+                        encode_args = (enc_bin, args.codec, input_file, encoder_output, log_file, width, height,
+                                       qp, args.FrameRate, args.FramesToBeEncoded, args.HMconfig, input_file_frames)
+                        cmd = get_encode_cmd(*encode_args, preset=preset)
+                        if inline_filter:
+                            job = create_inline_filter_job(cmd, encoder_output, output_file, index)
+                        else:
+                            job = create_encode_job(cmd)
+                        job.step = 4
+                        job.cost = estimate_job_cost('encode{}'.format(args.codec), width * height, frames, qp)
+                        job.kind = 'encode{}'.format(args.codec)
+                        job.threads = ENCODER_THREADS[args.codec]
+                        job.inputs.append(input_file)
+                        job.output_bytes = estimate_bitstream_bytes(width * height, frames, qp)
+                        if complexity_paths:
+                            adapt_to_tile(job, tier, n, encode_args)
+                        if inline_filter:
+                            add_job(job, [output_file, index.path], tile, qp)
+                        else:
+                            add_job(job, [encoder_output], tile, qp, 'unfiltered' if filter_nals else None)
+                    if filter_nals and not inline_filter:
+                        job = FunctionJob("filter {}".format(encoder_output), filter_nalu_file, step=4,
+                                          args=(encoder_output, output_file, 'unfiltered' not in args.Keep, index),
+                                          cost=estimate_job_cost('filter', width * height, frames), kind='filter')
+                        job.inputs.append(encoder_output)
+                        add_job(job, [output_file, index.path], tile, qp)
+                    elif not filter_nals:
+                        job = FunctionJob("index {}".format(output_file), index_bitstream, step=4,
+                                          args=(output_file, index),
+                                          cost=estimate_job_cost('filter', width * height, frames), kind='filter')
+                        job.inputs.append(output_file)
+                        job.output_bytes = 0  # only the small index
+                        add_job(job, [index.path], tile, qp)
+                    if args.Validate:
+                        add_check_job(output_file, tier, n, tile, qp, input_file)
+                    if args.Quality > 0:
+                        add_quality_job(output_file, input_file, tier, n, tile, qp)
+            for tier, n in layout.get_tiles():
+                if (tier, n) not in fan_out_encodes:
+                    continue
+                encodes = fan_out_encodes[(tier, n)]
+                width, height = layout.get_tile_size(tier)
+                input_file = os.path.join(next_input, get_tile_name(width, height, n))
+                tile = get_tile_name(width, height, n)[:-len('.yuv')]
+                job = FunctionJob("encode {}".format(input_file), encode_tile_qps, step=4,
+                                  args=(input_file, width, height,
+                                        args.FramesToBeEncoded + 1 if args.FramesToBeEncoded > 0 else None,
+                                        [(get_encode_cmd(*encode_args, preset=preset), fifo_path,
+                                          output_file if inline_filter else None,
+                                          BitrateIndex(get_index_path(output_file), args.FrameRate, args.SegmentFrames)
+                                          if inline_filter else None)
+                                         for qp, encode_args, fifo_path, encoder_output, output_file in encodes]),
+                                  cost=max(estimate_job_cost('encode{}'.format(args.codec), width * height, frames, qp)
+                                           for qp in args.QP),
+                                  kind='encode{}'.format(args.codec))
+                job.threads = ENCODER_THREADS[args.codec] * len(encodes)
+                job.inputs.append(input_file)
+                if complexity_paths:
+                    adapt_fan_out_to_tile(job, tier, n, [encode[1] for encode in encodes])
+                job.output_bytes = sum(estimate_bitstream_bytes(width * height, frames, qp) for qp in args.QP)
+                outputs = []
+                for qp, encode_args, fifo_path, encoder_output, output_file in encodes:
+                    outputs += [output_file, get_index_path(output_file)] if inline_filter else [encoder_output]
+                add_job(job, outputs, tile, intermediate=None if inline_filter or not filter_nals else 'unfiltered')
+                for qp, encode_args, fifo_path, encoder_output, output_file in encodes:
+                    index = BitrateIndex(get_index_path(output_file), args.FrameRate, args.SegmentFrames)
+                    if filter_nals and not inline_filter:
+                        job = FunctionJob("filter {}".format(encoder_output), filter_nalu_file, step=4,
+                                          args=(encoder_output, output_file, 'unfiltered' not in args.Keep, index),
+                                          cost=estimate_job_cost('filter', width * height, frames), kind='filter')
+                        job.inputs.append(encoder_output)
+                        add_job(job, [output_file, index.path], tile, qp)
+                    elif not filter_nals:
+                        job = FunctionJob("index {}".format(output_file), index_bitstream, step=4,
+                                          args=(output_file, index),
+                                          cost=estimate_job_cost('filter', width * height, frames), kind='filter')
+                        job.inputs.append(output_file)
+                        job.output_bytes = 0  # only the small index
+                        add_job(job, [index.path], tile, qp)
+                    if args.Validate:
+                        add_check_job(output_file, tier, n, tile, qp, input_file)
+                    if args.Quality > 0:
+                        add_quality_job(output_file, input_file, tier, n, tile, qp)
+            if check_reports:
+                add_alignment_job(hevc_dir)
+            if quality_tiles:
+                summary_path = os.path.join(hevc_dir, 'quality.json')
+                job = FunctionJob("quality {}".format(hevc_dir), summarize_quality, step=4,
+                                  args=(summary_path, [(layout.get_tier_name(tier), quality_tiles[tier])
+                                                       for tier in sorted(quality_tiles)]),
+                                  cost=estimate_job_cost('filter', 1, 1), kind='filter')
+                job.inputs = [path for tier in sorted(quality_tiles) for qp in sorted(quality_tiles[tier])
+                              for path, index_path in quality_tiles[tier][qp]]
+                job.output_bytes = 0
+                add_job(job, [summary_path])
+            next_input = hevc_dir
+        elif step == 5:
+            omaf_dir = os.path.join(args.OutputDir, 'omaf', file_prefix)
+            make_dirs_if_not_exist(omaf_dir)
+            cmd = get_step5_cmd(args.mode, bin_dir, next_input, omaf_dir, args.QP, args.FramesToBeEncoded,
+                                args.FrameRate, file_prefix, args.GuardBandSize, args.SegmentFrames)
+            if not cmd:
+                print "Error: no command to execute in step 5"
+                return None
+            pixels = sum(width * height for width, height in
+                         [layout.get_picture_size(tier) for tier in range(len(layout.scales))])
+            cost = estimate_job_cost('package', pixels * len(args.QP), frames)
+            if args.Validate and 4 not in steps:
+                # the existing bitstreams are only checked
+                for qp in args.QP:
+                    for tier, n in layout.get_tiles():
+                        width, height = layout.get_tile_size(tier)
+                        add_check_job(os.path.join(next_input, 'qp{}'.format(qp),
+                                                   get_hevc_name(file_prefix, width, height, qp, n)),
+                                      tier, n, get_tile_name(width, height, n)[:-len('.yuv')], qp)
+                add_alignment_job(next_input)
+            inputs = [path for path in producers
+                      if os.path.dirname(os.path.dirname(path)) == next_input and path not in report_files]
+            if check_reports:
+                inputs.append(os.path.join(next_input, 'check.json'))  # only valid bitstreams are packaged
+            if not args.LivePackaging:
+                job = Job(cmd, step=5, shell=True, cost=cost, kind='package')
+                job.inputs = inputs
+                add_job(job, [omaf_dir])
+                continue
+            if not chunks:
+                print "WARNING: --LivePackaging needs chunk encoding (--ChunkFrames) in the same run." \
+                      " Package all segments at the end."
+            # package the segments of each window of chunks as soon as they are encoded, each window after the
+            # previous one, and add them to the published segments
+            package_dir = os.path.join(args.OutputDir, 'omaf', 'temp', file_prefix)
+            duration = args.FramesToBeEncoded if args.FramesToBeEncoded > 0 else sum(count for first, count in
+                                                                                        chunks or []) - 1
+            live_jobs = []
+            for first_chunk, chunk_cnt, first_frame, frame_cnt in get_live_windows(chunks or [], args.SegmentFrames,
+                                                                                   duration):
+                window_dir = os.path.join(package_dir, str(first_frame))
+                bitstreams = [(chunk_files[first_chunk:first_chunk + chunk_cnt],
+                               os.path.join(window_dir, 'hevc', 'qp{}'.format(qp), name))
+                              for chunk_files, qp, name in chunk_bitstreams]
+                window_cmd = get_step5_cmd(args.mode, bin_dir, os.path.join(window_dir, 'hevc'),
+                                           os.path.join(window_dir, 'omaf'), args.QP, frame_cnt, args.FrameRate,
+                                           file_prefix, args.GuardBandSize, args.SegmentFrames)
+                job = FunctionJob("package frames {}-{}".format(first_frame, first_frame + frame_cnt - 1),
+                                  package_segments, step=5,
+                                  args=(window_cmd, window_dir, omaf_dir, bitstreams, filter_nals,
+                                        (first_frame / args.SegmentFrames, first_frame, frame_cnt)),
+                                  cost=estimate_job_cost('package', pixels * len(args.QP), frame_cnt), kind='package')
+                job.inputs = [path for chunk_files, output_path in bitstreams for path in chunk_files]
+                add_job(job, [])
+                job.deps.extend(live_jobs[-1:])
+                live_jobs.append(job)
+            # earlier windows first, their chunks are encoded before the later chunks of the other tiles
+            for k, job in enumerate(live_jobs):
+                job.priority = len(live_jobs) - k
+            window_dir = os.path.join(package_dir, 'all')
+            cmd = get_step5_cmd(args.mode, bin_dir, next_input, os.path.join(window_dir, 'omaf'), args.QP,
+                                args.FramesToBeEncoded, args.FrameRate, file_prefix, args.GuardBandSize,
+                                args.SegmentFrames)
+            # the whole bitstreams for the vod and local files and the live segments after the windows
+            job = FunctionJob("package {}".format(file_prefix), package_segments, step=5,
+                              args=(cmd, window_dir, omaf_dir),
+                              cost=cost, kind='package')
+            job.inputs = inputs
+            add_job(job, [omaf_dir])
+            job.deps.extend(live_jobs[-1:])
+            if live_jobs and 'chunks' not in args.Keep:
+                # the chunks are removed by the concatenation, so it has to wait for the last window
+                for concat_job in concat_jobs:
+                    concat_job.deps.append(live_jobs[-1])
+    return jobs
+
+
+def print_job_plan(jobs, all_jobs, num_threads, removable, max_rss):
+    """
+    Prints the jobs of a run without executing them (--Plan): the estimated run time and output size of each job, the
+    predicted makespan on num_threads cores (see simulate_jobs), the peak disk usage of all job outputs (intermediate
+    files of the classes in removable are removed like by IntermediateFiles) and the peak memory of the jobs which run
+    at the same time (max_rss of each kind of job in earlier runs). Recommends a number of cores.
+    :param jobs: jobs which will be executed
+    :param all_jobs: all jobs of the graph, also the ones which are up to date
+    """
+    if not jobs:
+        print "All jobs are up to date"
+        return
+    dependents = dict((job, []) for job in jobs)
+    for job in jobs:
+        for dep in job.deps:
+            dependents[dep].append(job)
+    sizes = {}  # output path -> size on disk before the run
+    for job in all_jobs:
+        for path in job.outputs:
+            sizes[path] = get_path_size(path)
+    new_sizes = {}  # output path -> estimated size after its job has finished
+
+    def get_size(path):
+        if path in new_sizes:
+            return new_sizes[path]
+        return sizes[path] if path in sizes else get_path_size(path)
+
+    for job in get_topological_order(jobs, dependents):
+        output_bytes = job.output_bytes
+        if output_bytes is None:
+            # filtering, concatenation and packaging keep the size of the inputs
+            output_bytes = sum(get_size(path) for path in set(job.inputs))
+        for path in job.outputs:
+            new_sizes[path] = output_bytes / len(job.outputs)
+
+    def get_peaks(schedule):
+        # disk usage when a job has finished (before its inputs are removed) and memory of the running jobs
+        consumers = {}
+        for job in all_jobs:
+            for path in job.outputs:
+                if job.intermediate in removable:
+                    consumers[path] = 0
+        for job in jobs:
+            for path in set(job.inputs):
+                if path in consumers:
+                    consumers[path] += 1
+        current = dict(sizes)
+        disk = peak_disk = sum(current.values())
+        memory = peak_memory = 0
+        events = [(start, 1, job) for start, end, job in schedule] + [(end, 0, job) for start, end, job in schedule]
+        for event_time, is_start, job in sorted(events, key=lambda event: event[:2]):
+            if is_start:
+                memory += max_rss.get(job.kind, 0)
+                peak_memory = max(peak_memory, memory)
+                continue
+            memory -= max_rss.get(job.kind, 0)
+            for path in job.outputs:
+                disk += new_sizes[path] - current[path]
+                current[path] = new_sizes[path]
+            peak_disk = max(peak_disk, disk)
+            for path in set(job.inputs):
+                if path in consumers:
+                    consumers[path] -= 1
+                    if consumers[path] == 0:
+                        disk -= current[path]
+                        current[path] = 0
+        return peak_disk, peak_memory
+
+    print "{:>4}  {:<10} {:>7} {:>10} {:>11}  {}".format('step', 'kind', 'threads', 'time [s]', 'output [MB]', 'job')
+    for job in jobs:
+        print "{:>4}  {:<10} {:>7} {:>10.1f} {:>11.1f}  {}".format(
+            job.step, job.kind or '', job.threads, job.cost, sum(new_sizes[path] for path in job.outputs) / 1e6,
+            job.get_name())
+    for step in sorted(set(job.step for job in jobs)):
+        step_jobs = [job for job in jobs if job.step == step]
+        print "Step {}: {} jobs, {:.0f}s CPU, {:.0f} MB output".format(
+            step, len(step_jobs), sum(job.cost * job.threads for job in step_jobs),
+            sum(new_sizes[path] for job in step_jobs for path in job.outputs) / 1e6)
+
+    cores = multiprocessing.cpu_count()
+    makespans = {}
+    for threads in sorted(set([1, 2, 4, 8, 16, 32, 64, 128, 256, cores, num_threads])):
+        makespans[threads] = max(end for start, end, job in simulate_jobs(jobs, threads))
+    critical_path = max(get_remaining_costs(jobs, dependents).values())
+    peak_disk, peak_memory = get_peaks(simulate_jobs(jobs, num_threads))
+    print "Predicted makespan with -t {}: {:.0f}s ({:.1f}h), longest chain of jobs: {:.0f}s".format(
+        num_threads, makespans[num_threads], makespans[num_threads] / 3600, critical_path)
+    print "Predicted peak disk usage of all job outputs: {:.0f} MB".format(peak_disk / 1e6)
+    if max_rss:
+        print "Predicted peak memory of all running jobs: {:.0f} MB".format(peak_memory / 1e6)
+    print "Predicted makespan with other numbers of cores: {}".format(', '.join(
+        "{}: {:.0f}s".format(threads, makespan) for threads, makespan in sorted(makespans.items())))
+
+    # the fewest cores which are at most 5% slower than the fastest run
+    best = min(makespans.values())
+    recommended = min(threads for threads, makespan in makespans.items() if makespan <= best * 1.05)
+    if recommended <= cores:
+        print "Recommended: -t {}".format(recommended)
+    else:
+        print "Recommended: {} cores. This machine has {} cores, run the encoder jobs on {} workers with -t {}" \
+              " (see --Coordinator)".format(recommended, cores, (recommended - 1) / cores, cores)
+    try:
+        physical_memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        physical_memory = None
+    if max_rss and physical_memory and get_peaks(simulate_jobs(jobs, min(recommended, cores)))[1] > physical_memory:
+        print "WARNING: the jobs may need more memory than the {:.0f} MB of this machine".format(physical_memory / 1e6)
 
 
 def get_steps(steps_str):
@@ -461,26 +1469,63 @@ def get_steps(steps_str):
     return steps
 
 
-def main():
-    print "OMAF file creation script version {}\n".format(__version__)
-    # COMMAND LINE STUFF
+def run_stream_steps(args, bin_dir, filename_prefix, layout):
+    """
+    Runs steps 1-4 as a single pipeline (see run_stream_pipeline).
+    :return: directory with the HEVC bitstreams or None on error
+    """
+    yuv_dir = os.path.join(args.OutputDir, 'yuv', filename_prefix)
+    hevc_dir = os.path.join(args.OutputDir, 'hevc', filename_prefix)
+    make_dirs_if_not_exist(yuv_dir)
+    for qp in args.QP:
+        make_dirs_if_not_exist(os.path.join(hevc_dir, "qp{}".format(qp)))
+
+    print_message("Steps 1-4: convert, scale down, tile and encode without intermediate yuv files")
+    step1_cmd = get_step1_cmd(bin_dir, yuv_dir, args.input, args.SourceWidth, args.SourceHeight,
+                              args.FramesToBeEncoded, args.InputBitDepth, args.InputChromaFormat, layout,
+                              "highres.yuv.fifo", rename_output=False)
+    if not step1_cmd:
+        print "Error: no command to execute in step 1"
+        return None
+    inline_filter = not args.codec == 0
+    step4_jobs = get_step4_cmd(bin_dir, yuv_dir, hevc_dir, filename_prefix, args.QP, args.FrameRate,
+                               args.FramesToBeEncoded, args.HMconfig, args.codec, layout, inline_filter,
+                               stream_input=True, segment_frames=args.SegmentFrames,
+                               preset=PREVIEW_PRESET if args.Preview else 'slower')
+    if not step4_jobs:
+        print "Error: no commands to execute in step 4"
+        return None
+    print "command: {}".format(step1_cmd)
+    print "First encoder command: {}".format(step4_jobs[0])
+    if not run_stream_pipeline(step1_cmd, step4_jobs, yuv_dir, args.QP, layout, args.InputBitDepth):
+        return None
+    return hevc_dir
+
+
+def get_argument_parser():
+    """
+    Returns the parser of the command line options. Its result is the args parameter of prepare_sequence and
+    run_sequences, e.g. get_argument_parser().parse_args(['-s', '1-5', '-i', 'raw_video.yuv']).
+    """
     parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter,
                                      description='Create OMAF viewport-dependent profile/ 3GPP Advance media  mp4 files and DASH MPD.\n\n'
                                                  'This script can perform following steps:\n'
                                                  '  Step 1 - Projection convertion: ERP yuv to high res CMP yuv\n'
                                                  '  Step 2 - ScStep ale down: highres CMP yuv to additional lowres CMP yuv\n'
                                                  '  Step 3 - Tiling: split both high and low res files into 24 tiles (each).\n'
+                                                 '           Other tile grids and resolution tiers: --TileGrid, --Tiers\n'
                                                  '  Step 4 - Encoding: run HM and encode each tile as MCTS for provided QPs\n'
                                                  '  Step 5 - Packaging: package encoded HEVC bitstreams to OMAF files')
-    parser.add_argument('-s', '--steps', required=True, help='Select steps to perform e.g.: \n'
+    parser.add_argument('-s', '--steps', help='Select steps to perform e.g.: \n'
                                                              '1   = ERP to CMP conversion only\n'
                                                              '5   = package HEVC files only'
                                                              '3-5 = do tiling, then encode and package')
-    parser.add_argument('-i', '--input', required=True, help='input depending on the lowest selected step:\n'
+    parser.add_argument('-i', '--input', help='input depending on the lowest selected step:\n'
                                                              'Step 1: path to ERP yuv\n'
                                                              'Step 2: path to a directory with an yuv file with "highres" string inside a filename\n'
                                                              'Step 3: path to a directory with 2 yuv files (high and low resolution).\n'
                                                              '        Filenames SHALL include substring ["lowres"|"highres"]\n'
+                                                             '        (with --Tiers: "lowres_{width}x{height}" for each lower tier)\n'
                                                              'Step 4: path to a directory with yuv files for each tile\n'
                                                              'Step 5: path to a directory with HEVC encoded files')
     parser.add_argument('-o', '--OutputDir', default='out', help='Output directory')
@@ -494,8 +1539,92 @@ def main():
     parser.add_argument('-q', '--QP', type=int, default=[32], nargs='+', help='Quanitzation parameter for encodings (bitrate)')
     parser.add_argument('-c', '--HMconfig', help='HM configuration file')
     parser.add_argument('-t', '--NumThreads', type=int, default=4, help='Number of parallel processes.')
+    parser.add_argument('--AdaptiveThreads', nargs=2, type=int, metavar=('MIN', 'MAX'),
+                        help='Adapt the number of parallel processes between\n'
+                             'MIN and MAX to the free memory, the memory\n'
+                             'pressure and the idle cores (Linux). Starts with\n'
+                             'the number of the last run or -t.')
     parser.add_argument('-gbs', '--GuardBandSize', type=int, default=0, help='Guard band size')
     parser.add_argument('-gbm', '--GuardBandMode', default='smear', help='Guard band mode: smear - copy pixels, mirror - mirror pixels')
+    parser.add_argument('--FaceSize', type=int, default=1536, help='Width and height of the CMP faces. The highres\n'
+                                                                    'picture consists of 3x2 faces.')
+    parser.add_argument('--TileGrid', default='6x4', help='Number of tile columns and rows (COLSxROWS) of each\n'
+                                                          'resolution tier, e.g. 12x8.')
+    parser.add_argument('--Tiers', type=int, default=[1, 2], nargs='+', help='Resolution tiers as scale down factors of\n'
+                                                                             'the highres picture, e.g. 1 2 4 for a\n'
+                                                                             'highres and two lowres tiers.')
+    parser.add_argument('--NativeConvert', action='store_true', help='Convert ERP to CMP in step 1 with the built-in\n'
+                                                                     'converter instead of TApp360Convert (8 bit\n'
+                                                                     '4:2:0 input only). A lookup table is computed\n'
+                                                                     'once per geometry and kept in luts/ of the\n'
+                                                                     'output directory.')
+    parser.add_argument('--ShardFrames', type=int, default=0, help='Convert (step 1) and scale down (step 2) ranges\n'
+                                                                    'of this many frames in parallel and concatenate\n'
+                                                                    'the yuv files. 0 = off')
+    parser.add_argument('--FfmpegTiling', action='store_true', help='Create tiles in step 3 with one ffmpeg crop job\n'
+                                                                    'per tile instead of splitting the frames in a single pass.')
+    parser.add_argument('--Stream', action='store_true', help='Run steps 1-4 without intermediate yuv files. Frames\n'
+                                                              'are piped from the converter to all encoders at once.')
+    parser.add_argument('--ChunkFrames', type=int, default=0, help='Encode each tile in chunks of at least this many\n'
+                                                                    'frames (rounded up to the random access period) in\n'
+                                                                    'parallel and concatenate the bitstreams. 0 = off')
+    parser.add_argument('--AdaptiveTiles', action='store_true', help='Measure the complexity of each tile while it\n'
+                                                                     'is created and encode flat and static tiles\n'
+                                                                     'with a faster preset and a higher QP (kvazaar\n'
+                                                                     'only, see TILE_POLICY).')
+    parser.add_argument('--Quality', nargs='?', type=int, const=1, default=0, metavar='N',
+                        help='Decode each encoded tile (ffmpeg) and write its\n'
+                             'PSNR and WS-PSNR next to its bitrate index,\n'
+                             'compare only every Nth frame (default 1).\n'
+                             'hevc/<prefix>/quality.json sums up all tiles.')
+    parser.add_argument('--Preview', action='store_true', help='Quick test of the whole pipeline: the layout of the\n'
+                                                               'full run, 2 segments unless -f is given, the\n'
+                                                               'first QP and the fastest encoder settings. Creates\n'
+                                                               'an OMAF package which can be played. Smaller\n'
+                                                               'faces (--FaceSize) stop after step 4.')
+    parser.add_argument('--Validate', action='store_true', help='Check every bitstream before packaging: access\n'
+                                                                'units, IRAP positions, picture size and NAL\n'
+                                                                'unit types. A broken bitstream is encoded once\n'
+                                                                'more, then the run stops with its report.')
+    parser.add_argument('--FanOut', action='store_true', help='Read each tile only once and feed it to the encoders\n'
+                                                               'of all QPs at the same time (named pipes).')
+    parser.add_argument('--SegmentFrames', type=int, default=PACKAGER_SEGMENT_FRAMES, help='Segment duration in\n'
+                                                                                           'frames of the packaged\n'
+                                                                                           'files and of the bitrate\n'
+                                                                                           'index of each bitstream.')
+    parser.add_argument('--LivePackaging', action='store_true', help='Package the segments of each chunk (step 5)\n'
+                                                                     'as soon as it is encoded for all tiles and QPs\n'
+                                                                     'and add them to the live MPD. Needs\n'
+                                                                     '--ChunkFrames, a multiple of --SegmentFrames.\n'
+                                                                     'Each chunk is packaged once, the whole\n'
+                                                                     'bitstreams once more at the end.')
+    parser.add_argument('--Force', action='store_true', help='Run all jobs, also the ones which are up to date\n'
+                                                             'according to jobs.json in the output directory.')
+    parser.add_argument('--Cleanup', action='store_true', help='Remove the highres, lowres and tile yuv files as soon\n'
+                                                               'as all jobs which read them have finished.')
+    parser.add_argument('--Keep', nargs='+', default=[], choices=INTERMEDIATE_CLASSES,
+                        help='Keep these intermediate files, also the ones\n'
+                             'which are always removed: shards (step 1/2),\n'
+                             'chunks and unfiltered bitstreams (step 4).')
+    parser.add_argument('--InlineNalFilter', action='store_true', help='Filter NAL units while the encoder writes the\n'
+                                                                       'bitstream (named pipes). Not used with HM.')
+    parser.add_argument('--Plan', nargs='*', metavar='REPORT_DIR', help='Only print the jobs with their estimated run\n'
+                                                                       'time and output size, the predicted makespan,\n'
+                                                                       'disk usage and a number of cores. The estimates\n'
+                                                                       'are calibrated with the reports of earlier runs\n'
+                                                                       'in the output directory and in REPORT_DIRs.')
+    parser.add_argument('--Coordinator', metavar='[HOST:]PORT', help='Listen on this address and let workers\n'
+                                                                   '(--Worker) execute the encoder jobs of step 4.')
+    parser.add_argument('--Worker', metavar='HOST:PORT', help='Run as a worker of the coordinator at this address\n'
+                                                            'with -t cores until interrupted. -s and -i are not needed.')
+    parser.add_argument('--Batch', metavar='FILE', help='Process several sequences with one pool of -t cores. Each\n'
+                                                        'line of FILE holds the options of one sequence (e.g. -s,\n'
+                                                        '-i, -p, -f, -q), which are added to the options of the\n'
+                                                        'command line. Options which apply to the whole run (-o, -t,\n'
+                                                        '--Cleanup, --Keep, --Plan, --Coordinator) can only be\n'
+                                                        'given on the command line.')
+    parser.add_argument('--BinDir', help='Directory with TApp360Convert, TAppEncoder and hevc2omaf\n'
+                                         '(default: bin/[linux|osx|win] next to this script)')
 
     parser.add_argument('--codec', type=int, default=1, help='Select codec:\n'
                                                              '  0 = HM reference HEVC encoder\n'
@@ -506,22 +1635,94 @@ def main():
                                                                 'omafvd:  MPEG-OMAF viewport dependent profile\n'
                                                                 'avm:  3GPP Advanced Media Video profile')
 
-    args = parser.parse_args()
+    return parser
+
+
+def get_bin_dir():
+    """
+    Returns the directory with the binaries for this OS next to this script or None if the OS is not supported.
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    for platform, os_dir in [('darwin', 'osx'), ('linux', 'linux'), ('win', 'win')]:
+        if sys.platform.startswith(platform):
+            return os.path.join(script_dir, 'bin', os_dir)
+    return None
+
 
-    # check params
+class Sequence(object):
+    """
+    Jobs of one input sequence, see prepare_sequence.
+    """
+    def __init__(self, args, prefix, steps, jobs):
+        self.args = args
+        self.prefix = prefix
+        self.steps = steps  # steps which are executed as jobs
+        self.jobs = jobs
+
+
+def set_preview_options(args):
+    """
+    Changes the options of a sequence for --Preview: a few segments, a single QP and the fastest encoder settings, so
+    an OMAF package with the layout of a full run is created in minutes. The layout is not changed, since hevc2omaf
+    writes the picture sizes, region-wise packing and extractors of the default layout into every package.
+    """
+    if args.FramesToBeEncoded <= 0:
+        args.FramesToBeEncoded = PREVIEW_SEGMENTS * args.SegmentFrames
+    args.QP = args.QP[:1]
+    if args.AdaptiveTiles:
+        print "WARNING: --AdaptiveTiles is not used with --Preview, all tiles are encoded with the fastest preset."
+        args.AdaptiveTiles = False
+    if args.LivePackaging:
+        print "WARNING: --LivePackaging is not used with --Preview, all segments are packaged at the end."
+        args.LivePackaging = False
+    print "NOTE: preview with {0}x{0} faces, {1} frames and QP {2}".format(args.FaceSize, args.FramesToBeEncoded,
+                                                                        args.QP[0])
+
+
+def prepare_sequence(args, bin_dir, coordinator=None):
+    """
+    Checks the options of one sequence and creates the jobs of its steps (see get_pipeline_jobs). The steps 1-4 of
+    --Stream are executed right away.
+    :param args: options of the sequence (see get_argument_parser)
+    :param coordinator: Coordinator which executes the encoder jobs or None
+    :return: Sequence or None on error
+    """
     steps = get_steps(args.steps)
     if not steps:
         print "Error: provided steps are not valid"
-        return -1
+        return None
     filename_prefix = args.FilePrefix
     if 1 in steps and not filename_prefix:
         filename_prefix = get_file_prefix(args.input)
     if not filename_prefix:
         print "Error: please provide file prefix with option [-p|--FilePrefix] since it can not be guessed from filename"
-        return -1
+        return None
+    if args.Preview:
+        set_preview_options(args)
+    grid = [cast_number(x) for x in args.TileGrid.split('x')]
+    if not len(grid) == 2 or None in grid:
+        print "Error: provided tile grid is not valid, use COLSxROWS e.g. 6x4"
+        return None
+    layout = TileLayout(args.FaceSize, grid[0], grid[1], args.Tiers)
+    layout_error = layout.get_error(args.GuardBandSize)
+    if layout_error:
+        print "Error: provided tile layout is not valid: {}".format(layout_error)
+        return None
+    if 5 in steps and not layout.is_default() and args.Preview:
+        print "WARNING: hevc2omaf can only package the default layout (--FaceSize 1536 --TileGrid 6x4 --Tiers 1 2)." \
+              " The preview stops after step 4."
+        steps = [step for step in steps if step < 5]
+        args.steps = '{}-{}'.format(steps[0], steps[-1]) if steps else ''
+    elif 5 in steps and not layout.is_default():
+        print "Error: hevc2omaf can only package the default layout (--FaceSize 1536 --TileGrid 6x4 --Tiers 1 2)." \
+              " Run the steps up to 4 only."
+        return None
+    if args.NativeConvert and 1 in steps and not (args.InputBitDepth == 8 and args.InputChromaFormat == 420):
+        print "Error: --NativeConvert can only convert 8 bit 4:2:0 yuv files"
+        return None
     if args.codec == 0 and not args.HMconfig and 4 in steps:
         print "Error: please provide the config file for HM using [-c|HMconfig] option"
-        return -1
+        return None
     if args.codec == 0 and len(args.QP) > 1 and 4 in steps:
         # HM needs to be updated to support multiple QPs
         print "WARNING: Multiple QPs are not supported for now. HM Encoder needs to be updated for this. " \
@@ -535,88 +1736,226 @@ def main():
     else:
         print "Error: please provide a correct mode type"
 
+    next_input = args.input
+    if args.Stream:
+        if not steps[:4] == [1, 2, 3, 4] or args.GuardBandSize or not hasattr(os, 'mkfifo'):
+            print "Error: --Stream requires steps 1-4, no guard bands and an OS with named pipes"
+            return None
+        if args.Coordinator:
+            print "Error: --Stream can not be used together with --Coordinator"
+            return None
+        if args.Plan is not None:
+            print "Error: --Plan can not be used together with --Stream"
+            return None
+        if args.NativeConvert:
+            print "Error: --NativeConvert can not be used together with --Stream"
+            return None
+        if args.AdaptiveTiles:
+            print "WARNING: --AdaptiveTiles is not used with --Stream, the tiles are encoded while they are created."
+        if args.Quality > 0:
+            print "WARNING: --Quality is not used with --Stream, the tiles are not stored."
+        next_input = run_stream_steps(args, bin_dir, filename_prefix, layout)
+        if not next_input:
+            return None
+        steps = steps[4:]
+    if not steps:
+        return Sequence(args, filename_prefix, steps, [])
+
+    jobs = get_pipeline_jobs(args, bin_dir, filename_prefix, steps, next_input, layout, coordinator)
+    if jobs is None:
+        return None
+    for job in jobs:
+        job.sequence = filename_prefix
+    step_names = {1: "conversion", 2: "scale down", 3: "tiling", 4: "encoding", 5: "packaging"}
+    print_message("Steps {}: run {} jobs ({})".format(args.steps, len(jobs), ', '.join(
+        "{} {}".format(len([job for job in jobs if job.step == step]), step_names[step]) for step in steps)))
+    return Sequence(args, filename_prefix, steps, jobs)
+
 
-    bin_dir = None
-    if sys.platform.startswith('darwin'):
-        bin_dir = os.path.join(os.getcwd(), 'bin/osx')
-    elif sys.platform.startswith('linux'):
-        bin_dir = os.path.join(os.getcwd(), 'bin/linux')
-    elif sys.platform.startswith('win'):
-        bin_dir = os.path.join(os.getcwd(), 'bin/win')
+def run_sequences(args, sequences, coordinator=None, max_rss=None):
+    """
+    Executes the jobs of all sequences with one pool of args.NumThreads cores (see execute_jobs). The job lists of
+    the sequences are interleaved, so jobs of different sequences with the same priority take turns. Jobs which are
+    up to date are skipped (see JobCache). With args.Plan the jobs are only printed (see print_job_plan).
+    :param args: options which apply to all sequences: OutputDir, NumThreads, AdaptiveThreads, Cleanup, Keep and Plan
+    :param max_rss: peak RSS of each kind of job (see load_job_calibration), used by --Plan and --AdaptiveThreads
+    :return: True if all jobs finished successfully
+    """
+    cache = JobCache(os.path.join(args.OutputDir, 'jobs.json'))
+    jobs = []
+    queues = []
+    for sequence in sequences:
+        jobs_to_run = cache.get_jobs_to_run(sequence.jobs, skip_done=not sequence.args.Force)
+        if len(jobs_to_run) < len(sequence.jobs):
+            print "{}: {} of {} jobs are up to date and will be skipped".format(
+                sequence.prefix, len(sequence.jobs) - len(jobs_to_run), len(sequence.jobs))
+        jobs += sequence.jobs
+        queues.append(jobs_to_run)
+    jobs_to_run = [job for jobs_of_turn in itertools.izip_longest(*queues) for job in jobs_of_turn if job is not None]
+    removable = set(['shards', 'chunks', 'unfiltered'])  # removed by the jobs which read them
+    if args.Cleanup:
+        removable |= set(['highres', 'lowres', 'tiles'])
+    removable -= set(args.Keep)
+    if args.Plan is not None:
+        print_job_plan(jobs_to_run, jobs, args.NumThreads, removable, max_rss or {})
+        return True
+
+    if coordinator:
+        coordinator.start()
+        print "Coordinator is waiting for workers on {}".format(coordinator.get_address())
+    control = None
+    if args.AdaptiveThreads and not ConcurrencyControl.is_supported():
+        print "WARNING: --AdaptiveThreads needs the /proc file system of Linux, using -t {}".format(args.NumThreads)
+    elif args.AdaptiveThreads:
+        make_dirs_if_not_exist(os.path.join(args.OutputDir, 'reports'))
+        control = ConcurrencyControl(args.AdaptiveThreads[0], args.AdaptiveThreads[1], args.NumThreads,
+                                     os.path.join(args.OutputDir, 'reports', 'concurrency.json'), max_rss)
+    stats = JobStats(control.max_threads if control else args.NumThreads)
+    files = IntermediateFiles(jobs, jobs_to_run, removable)
+    try:
+        finished = execute_jobs(jobs_to_run, args.NumThreads, cache, coordinator, stats, files, control)
+    finally:
+        if control:
+            control.write()
+            print "Parallel jobs: {} (used longest), peak memory of all jobs: {:.0f} MB, written to {}".format(
+                control.get_settled_limit(), control.peak_rss / 1e6, control.path)
+        if coordinator:
+            coordinator.close()
+        stats.peak_disk_bytes = files.peak_bytes
+        if files.removed_bytes:
+            print "Removed {:.0f} MB of intermediate files".format(files.removed_bytes / 1e6)
+        if stats.records:
+            report_dir = os.path.join(args.OutputDir, 'reports')
+            make_dirs_if_not_exist(report_dir)
+            report_name = os.path.join(report_dir, time.strftime('run_%Y%m%d_%H%M%S'))
+            stats.write_report(report_name + '.json')
+            stats.write_trace(report_name + '_trace.json')
+            stats.print_summary()
+            print "Resource usage of all jobs: {0}.json, timeline: {0}_trace.json".format(report_name)
+    if not finished:
+        print "Error: not all jobs finished successfully"
+        return False
+
+    if not set(['chunks', 'unfiltered']) & set(args.Keep):
+        for sequence in sequences:
+            temp_dir = os.path.join(args.OutputDir, 'hevc', sequence.prefix, 'temp')
+            if 4 in sequence.steps and os.path.isdir(temp_dir):
+                shutil.rmtree(temp_dir)
+    return True
+
+
+def read_batch_file(parser, path, argv, global_args):
+    """
+    Reads the options of each sequence from a batch file. Each line which is not empty or a comment (#) holds the
+    options of one sequence, which are added to the options in argv.
+    :param global_args: options of the command line, options which apply to the whole run must not be changed
+    :return: list of the options of each sequence or None on error
+    """
+    try:
+        with open(path) as f:
+            lines = f.readlines()
+    except IOError as e:
+        print "Error: can not read batch file: {}".format(e)
+        return None
+    sequence_args = []
+    for line_no, line in enumerate(lines, 1):
+        options = shlex.split(line, comments=True)
+        if not options:
+            continue
+        try:
+            args = parser.parse_args(argv + options)
+        except SystemExit:
+            print "Error: invalid options in line {} of {}".format(line_no, path)
+            return None
+        if not args.steps or not args.input:
+            print "Error: -s/--steps and -i/--input are required in line {} of {}".format(line_no, path)
+            return None
+        for name in ['OutputDir', 'NumThreads', 'AdaptiveThreads', 'Cleanup', 'Keep', 'Plan', 'Coordinator']:
+            if getattr(args, name) != getattr(global_args, name):
+                print "Error: --{} can only be given on the command line (line {} of {})".format(name, line_no, path)
+                return None
+        sequence_args.append(args)
+    if not sequence_args:
+        print "Error: no sequences in batch file {}".format(path)
+    return sequence_args or None
+
+
+def main(argv=None):
+    """
+    Command line front end: runs all steps of one sequence or of all sequences of a --Batch file.
+    :param argv: command line options, default sys.argv[1:]
+    :return: exit code
+    """
+    print "OMAF file creation script version {}\n".format(__version__)
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = get_argument_parser()
+    args = parser.parse_args(argv)
+
+    bin_dir = args.BinDir or get_bin_dir()
     if not bin_dir:
         print "ERROR: your OS is not supported"
         return -1
 
-    next_input = args.input
-    for step in steps:
-        if step == 1:
-            yuv_dir = os.path.join(args.OutputDir, 'yuv', filename_prefix)
-            make_dirs_if_not_exist(yuv_dir)
-            print "NOTE: The sequence you provided is now called \"{}\"" \
-                  " you will find all the output files in directory \"{}\"".format(filename_prefix, yuv_dir)
-            print_message("Step 1: convert ERP yuv to high res CMP yuv")
-            cmd = get_step1_cmd(bin_dir, yuv_dir, next_input, args.SourceWidth, args.SourceHeight,
-                                args.FramesToBeEncoded, args.InputBitDepth, args.InputChromaFormat)
-            if not cmd:
-                print "Error: no command to execute in step 1"
-                return -1
-            print "command: {}".format(cmd)
-            execute_cmd(cmd)
-            next_input = yuv_dir
-        elif step == 2:
-            print_message("Step 2: (scale down): scale down high res CMP yuv to low res CMP yuv")
-            output_dir = next_input
-            if 1 not in steps:
-                output_dir = args.OutputDir
-                make_dirs_if_not_exist(output_dir)
-            cmd = get_step2_cmd(next_input, output_dir)
-            if not cmd:
-                print "Error: no command to execute in step 2"
-                return -1
-            print "command: {}".format(cmd)
-            execute_cmd(cmd)
-            next_input = output_dir
-        elif step == 3:
-            output_dir = next_input
-            if 2 not in steps:
-                output_dir = args.OutputDir
-                make_dirs_if_not_exist(output_dir)
-            cmds = get_step3_cmd(next_input, output_dir, args.GuardBandSize, args.GuardBandMode)
-            if not cmds:
-                print "Error: no commands to execute in step 4"
-                return -1
-            print_message("Step 3: (create tiles): run {} tile cropping jobs".format(len(cmds)))
-            print "First command: {}".format(cmds[0])
-            execute_cmds(cmds)
-            next_input = output_dir
-        elif step == 4:
-            hevc_dir = os.path.join(args.OutputDir, 'hevc', filename_prefix)
-            make_dirs_if_not_exist(hevc_dir)
-            if args.QP:
-                for qp in args.QP:
-                    make_dirs_if_not_exist(os.path.join(hevc_dir, "qp{}".format(qp)))
-            cmds = get_step4_cmd(bin_dir, next_input, hevc_dir, filename_prefix, args.QP, args.FrameRate,
-                                 args.FramesToBeEncoded, args.HMconfig, args.codec)
-            if not cmds:
-                print "Error: no commands to execute in step 4"
-                return -1
-            print_message("Step 4: (encode): run {} encoding jobs".format(len(cmds)))
-            print "First command: {}".format(cmds[0])
-            execute_cmds(cmds)
-
-            # if not HM is used, filter NALs
-            if not args.codec == 0:
-                filter_nalus(hevc_dir, args.QP, filename_prefix)
-            next_input = hevc_dir
-        elif step == 5:
-            omaf_dir = os.path.join(args.OutputDir, 'omaf', filename_prefix)
-            make_dirs_if_not_exist(omaf_dir)
-
-            print_message("Step 5 (OMAF packaging)")
-            cmd = get_step5_cmd(args.mode, bin_dir, next_input, omaf_dir, args.QP, args.FramesToBeEncoded, args.FrameRate,
-                                filename_prefix, args.GuardBandSize)
-            print "command: {}".format(cmd)
-            execute_cmd(cmd)
+    if args.Worker:
+        address = parse_address(args.Worker, 'localhost')
+        if not address:
+            print "Error: provided coordinator address is not valid"
+            return -1
+        Worker(address, args.NumThreads, bin_dir).run()
+        return 0
+    if args.AdaptiveThreads and not 1 <= args.AdaptiveThreads[0] <= args.AdaptiveThreads[1]:
+        print "Error: --AdaptiveThreads MIN MAX needs 1 <= MIN <= MAX"
+        return -1
+    if args.Batch:
+        sequence_args = read_batch_file(parser, args.Batch, argv, args)
+        if not sequence_args:
+            return -1
+    else:
+        if not args.steps or not args.input:
+            parser.error("arguments -s/--steps and -i/--input are required")
+        sequence_args = [args]
+
+    # calibrate the estimated cost of the jobs with earlier runs
+    throughput, max_rss, calibration_jobs = load_job_calibration([os.path.join(args.OutputDir, 'reports')] +
+                                                                 (args.Plan or []))
+    if args.Plan is not None:
+        for kind in sorted(throughput):
+            print "Throughput of {} jobs: {:.3g} pixels/s (default {:.3g})".format(kind, throughput[kind],
+                                                                                 JOB_THROUGHPUT[kind])
+        print "Calibrated with {} jobs of earlier runs".format(calibration_jobs)
+    JOB_THROUGHPUT.update(throughput)
+    coordinator = None
+    if args.Coordinator and args.Plan is None:
+        address = parse_address(args.Coordinator)
+        if not address:
+            print "Error: provided coordinator address is not valid"
+            return -1
+        try:
+            coordinator = Coordinator(address)
+        except socket.error as e:
+            print "Error: can not listen on {}: {}".format(args.Coordinator, e)
+            return -1
+
+    sequences = []
+    for seq_args in sequence_args:
+        sequence = prepare_sequence(seq_args, seq_args.BinDir or bin_dir, coordinator)
+        if not sequence:
+            if coordinator:
+                coordinator.close()
+            return -1
+        if sequence.prefix in [other.prefix for other in sequences]:
+            print "Error: sequence {} is given twice, use different file prefixes (-p)".format(sequence.prefix)
+            if coordinator:
+                coordinator.close()
+            return -1
+        sequences.append(sequence)
+    if not any(sequence.jobs for sequence in sequences):
+        if coordinator:
+            coordinator.close()
+        return 0
+    if not run_sequences(args, sequences, coordinator, max_rss):
+        return -1
     return 0
 
 
@@ -0,0 +1,449 @@
+"""
+This module is a part of The Fraunhofer OMAF Javascript Player implementation.
+(c) Copyright  1995 - 2019 Fraunhofer-Gesellschaft zur Foerderung der angewandten Forschung e.V. All rights reserved.
+
+Please see [LICENSE.txt](../LICENSE.txt) file for the terms of use of the contents of this repository.
+
+It contains the analysis steps of create_omaf_files.py: the tile complexity analysis (--AdaptiveTiles), the bitstream
+validation and the tile quality measurement.
+"""
+
+import os
+import json
+import math
+import audioop
+import shlex, subprocess
+
+from omaf_converter import get_frame_cnt_yuv420
+from omaf_packaging import NalUnitTable, NalUnitType, get_nal_units, map_file
+
+__author__ = "Dimitri Podborski"
+__version__ = "0.2"
+__maintainer__ = "Dimitri Podborski"
+__email__ = "dimitri.podborski@hhi.fraunhofer.de"
+__status__ = "Development"
+
+
+# maps unsigned to signed 8 bit samples for audioop and back
+SIGNED_BYTES = ''.join(chr(i ^ 0x80) for i in range(256))
+# encoder settings of easy tiles (--AdaptiveTiles): (max luma variance, max mean squared difference between two
+# frames, kvazaar preset, QP offset). The first row which fits a tile is used, other tiles keep --preset slower and
+# the QP of the encoding.
+TILE_POLICY = [(20.0, 2.0, 'fast', 4),  # flat and static, e.g. sky
+               (100.0, 10.0, 'medium', 2)]
+# WS-PSNR weights are applied to the squared errors of runs of this many samples of a row (--Quality)
+WS_PSNR_SEGMENT = 32
+# PSNR of identical pictures
+MAX_PSNR = 100.0
+# a QP whose luma WS-PSNR is less than this many dB above the next lower rate QP is reported as not worth encoding
+QUALITY_MIN_GAIN = 0.5
+
+
+class TileComplexity(object):
+    """
+    Spatial and temporal complexity of a tile: the variance of the luma samples of each frame and the mean squared
+    difference of the luma samples of consecutive frames, both averaged over all frames. The sums are computed by
+    audioop on signed 16 bit samples ((v - 128) * 128), so measuring a tile costs a few passes over its luma plane.
+    """
+    def __init__(self, width, height):
+        self.luma_size = width * height
+        self.frames = 0
+        self.variance = 0.0
+        self.motion = 0.0
+        self.previous = None  # negated luma samples of the previous frame
+
+    def add_frame(self, tile):
+        luma = audioop.mul(audioop.lin2lin(tile[:self.luma_size].translate(SIGNED_BYTES), 1, 2), 2, 0.5)
+        mean = audioop.avg(luma, 2) / 128.0
+        rms = audioop.rms(luma, 2) / 128.0
+        self.variance += max(rms * rms - mean * mean, 0.0)
+        if self.previous is not None:
+            self.motion += (audioop.rms(audioop.add(luma, self.previous, 2), 2) / 128.0) ** 2
+        self.previous = audioop.mul(luma, 2, -1)
+        self.frames += 1
+
+    def get_stats(self):
+        return {'frames': self.frames, 'variance': self.variance / max(self.frames, 1),
+                'motion': self.motion / max(self.frames - 1, 1)}
+
+
+def get_complexity_name(width, height):
+    return "complexity_{}x{}.json".format(width, height)
+
+
+def write_tile_complexity(path, complexities):
+    with open(path, 'w') as f:
+        json.dump({'tiles': [complexity.get_stats() for complexity in complexities]}, f, indent=1, sort_keys=True)
+
+
+def analyze_tiles(tile_files, width, height, complexity_path):
+    """
+    Measures the TileComplexity of existing tile files (--AdaptiveTiles without step 3 or with --FfmpegTiling) and
+    writes them to complexity_path.
+    :return: True on success
+    """
+    frame_size = width * height * 3 / 2
+    complexities = []
+    for tile_file in tile_files:
+        complexities.append(TileComplexity(width, height))
+        with open(tile_file, mode='rb') as f:
+            while True:
+                frame = f.read(frame_size)
+                if len(frame) < frame_size:
+                    break
+                complexities[-1].add_frame(frame)
+    write_tile_complexity(complexity_path, complexities)
+    return True
+
+
+def get_tile_settings(complexity_path, n):
+    """
+    Returns the kvazaar preset and QP offset of tile n (see TILE_POLICY) from the complexity file of its tier.
+    """
+    with open(complexity_path) as f:
+        stats = json.load(f)['tiles'][n]
+    for max_variance, max_motion, preset, qp_offset in TILE_POLICY:
+        if stats['variance'] <= max_variance and stats['motion'] <= max_motion:
+            return preset, qp_offset
+    return 'slower', 0
+
+
+def set_tile_policy(job, complexity_path, n, apply_settings):
+    """
+    Lets the encoder job of tile n choose its settings when it is started (--AdaptiveTiles), since the complexity
+    file is only written by the tiling job. apply_settings(preset, qp_offset) creates the command of the job again
+    (see get_encode_cmd).
+    """
+    on_start = job.on_start
+
+    def apply_policy():
+        apply_settings(*get_tile_settings(complexity_path, n))
+        if on_start:
+            on_start()
+
+    job.on_start = apply_policy
+    job.inputs.append(complexity_path)
+
+
+class BitReader(object):
+    """
+    Reads the fixed length (u(n)) and Exp-Golomb (ue(v)) fields of the payload of a NAL unit. The emulation
+    prevention bytes are removed first.
+    """
+    def __init__(self, payload):
+        self.bits = ''.join(format(ord(c), '08b') for c in payload.replace('\x00\x00\x03', '\x00\x00'))
+        self.pos = 0
+
+    def read(self, n):
+        if self.pos + n > len(self.bits):
+            raise ValueError("NAL unit is truncated")
+        value = int(self.bits[self.pos:self.pos + n], 2) if n else 0
+        self.pos += n
+        return value
+
+    def read_ue(self):
+        zeros = 0
+        while not self.read(1):
+            zeros += 1
+            if zeros > 31:
+                raise ValueError("invalid Exp-Golomb code")
+        return (1 << zeros) - 1 + self.read(zeros)
+
+
+def get_sps_picture_size(payload):
+    """
+    Parses the start of a sequence parameter set (7.3.2.2 of the HEVC spec) up to the conformance window.
+    :param payload: the SPS without start code and NAL unit header
+    :return: (width, height) of the cropped pictures
+    """
+    reader = BitReader(payload[:64])  # the picture size is within the first bytes
+    reader.read(4)  # sps_video_parameter_set_id
+    max_sub_layers_minus1 = reader.read(3)
+    reader.read(1)  # sps_temporal_id_nesting_flag
+    # profile_tier_level(1, sps_max_sub_layers_minus1): general profile (88 bits) and level
+    reader.read(88 + 8)
+    sub_layers = [(reader.read(1), reader.read(1)) for _ in range(max_sub_layers_minus1)]
+    if max_sub_layers_minus1 > 0:
+        reader.read(2 * (8 - max_sub_layers_minus1))  # reserved_zero_2bits
+    for profile_present, level_present in sub_layers:
+        reader.read((88 if profile_present else 0) + (8 if level_present else 0))
+    reader.read_ue()  # sps_seq_parameter_set_id
+    chroma_format_idc = reader.read_ue()
+    if chroma_format_idc == 3:
+        reader.read(1)  # separate_colour_plane_flag
+    width = reader.read_ue()
+    height = reader.read_ue()
+    if reader.read(1):  # conformance_window_flag
+        sub_width = 2 if chroma_format_idc in (1, 2) else 1
+        sub_height = 2 if chroma_format_idc == 1 else 1
+        left, right, top, bottom = [reader.read_ue() for _ in range(4)]
+        width -= (left + right) * sub_width
+        height -= (top + bottom) * sub_height
+    return width, height
+
+
+def validate_bitstream(bitstream_path, report_path, width, height, frame_cnt=None, tile_path=None, rap_period=None,
+                       filtered=False):
+    """
+    Checks an encoded tile before it is packaged (--Validate): the number of access units (frame_cnt or the frames
+    of the yuv tile), an IRAP picture at the start and one per rap_period frames, the picture size in all SPS and,
+    for filtered bitstreams, that only VCL NAL units and parameter sets are left. The access units and IRAP
+    positions (in decoding order) and the errors are written to report_path.
+    :return: True if the bitstream is valid
+    """
+    errors = []
+    buf = map_file(bitstream_path) if os.path.isfile(bitstream_path) else None
+    nalus = get_nal_units(buf) if buf else NalUnitTable()
+    vps_type = NalUnitType.index('VPS_NUT')
+    irap_types = range(NalUnitType.index('BLA_W_LP'), NalUnitType.index('RSV_IRAP_VCL23') + 1)
+    frames = 0
+    iraps = []
+    sizes = set()
+    forbidden = set()
+    for idx in range(len(nalus)):
+        nal_type = nalus.types[idx]
+        payload = nalus.offsets[idx] + nalus.au_starts[idx] + 5  # after start code and NAL unit header
+        if nal_type < vps_type:
+            if ord(buf[payload]) & 0x80:  # first_slice_segment_in_pic_flag
+                frames += 1
+                if nal_type in irap_types:
+                    iraps.append(frames - 1)
+        elif nal_type == NalUnitType.index('SPS_NUT'):
+            end = nalus.offsets[idx + 1] if idx + 1 < len(nalus) else len(buf)
+            try:
+                sizes.add(get_sps_picture_size(buf[payload:end]))
+            except ValueError as e:
+                errors.append("can not parse SPS: {}".format(e))
+        elif filtered and nal_type > NalUnitType.index('PPS_NUT'):
+            forbidden.add(NalUnitType[nal_type])
+    if buf:
+        buf.close()
+
+    if frame_cnt is None and tile_path:
+        frame_cnt = get_frame_cnt_yuv420(tile_path, width, height)
+    if not len(nalus):
+        errors.append("no NAL units found")
+    elif frame_cnt is not None and not frames == frame_cnt:
+        errors.append("{} access units instead of {}".format(frames, frame_cnt))
+    if frames and iraps[:1] != [0]:
+        errors.append("does not start with an IRAP picture")
+    elif rap_period and frames and not len(iraps) == len(range(0, frames, rap_period)):
+        errors.append("{} IRAP pictures instead of {} (one per {} frames)".format(
+            len(iraps), len(range(0, frames, rap_period)), rap_period))
+    if len(nalus) and not sizes == set([(width, height)]):
+        errors.append("picture size {} instead of {}x{}".format(
+            ', '.join("{}x{}".format(*size) for size in sorted(sizes)) or "unknown (no SPS)", width, height))
+    if forbidden:
+        errors.append("NAL units which should have been removed: {}".format(', '.join(sorted(forbidden))))
+    with open(report_path, 'w') as f:
+        json.dump({'bitstream': bitstream_path, 'frames': frames, 'irap': iraps, 'errors': errors}, f, indent=1,
+                  sort_keys=True)
+    for error in errors:
+        print "ERROR: {}: {}".format(bitstream_path, error)
+    return not errors
+
+
+def check_bitstream_alignment(summary_path, report_paths):
+    """
+    Compares the validation reports of all bitstreams of a sequence (--Validate). All tiles and QPs have to have the
+    same number of access units and their IRAP pictures at the same positions, otherwise the packager can not
+    switch between them. The streams which differ from the most common pattern are reported and written to
+    summary_path.
+    :return: True if all bitstreams are aligned
+    """
+    patterns = {}  # (frames, IRAP positions) -> bitstreams
+    for report_path in report_paths:
+        with open(report_path) as f:
+            report = json.load(f)
+        patterns.setdefault((report['frames'], tuple(report['irap'])), []).append(report['bitstream'])
+    frames, iraps = max(patterns, key=lambda pattern: len(patterns[pattern]))
+    misaligned = sorted(path for pattern, paths in patterns.items() if not pattern == (frames, iraps)
+                        for path in paths)
+    for path in misaligned:
+        print "ERROR: {}: access units or IRAP pictures differ from the other {} bitstreams".format(
+            path, len(patterns[(frames, iraps)]))
+    with open(summary_path, 'w') as f:
+        json.dump({'bitstreams': len(report_paths), 'frames': frames, 'irap': list(iraps), 'misaligned': misaligned},
+                  f, indent=1, sort_keys=True)
+    return not misaligned
+
+
+def get_check_path(bitstream_path):
+    return bitstream_path[:-len('.265')] + '_check.json'
+
+
+def get_quality_path(bitstream_path):
+    return bitstream_path[:-len('.265')] + '_quality.json'
+
+
+def get_decode_cmd(bitstream_path, width, height):
+    return "ffmpeg -loglevel quiet -f hevc -i {} -f rawvideo -pix_fmt yuv420p -s:v {}x{} -".format(
+        bitstream_path, width, height)
+
+
+def get_psnr(mse):
+    return 10 * math.log10(255 * 255 / mse) if mse > 0 else MAX_PSNR
+
+
+def get_ws_weights(layout, tier, n, guardband_size, subsampling):
+    """
+    Computes the WS-PSNR weights of a plane of tile n. The weight of a CMP sample is the solid angle it covers,
+    1 / (1 + u^2 + v^2)^(3/2) for its position u, v in [-1, 1] on the cube face. The samples of the guard bands are
+    not displayed and get no weight, the samples between them are mapped to the area of the tile in the picture.
+    :param subsampling: 1 for luma, 2 for the chroma planes
+    :return: (weight of all samples, list of (first sample, sample count, mean weight) of the segments of each row)
+    """
+    width, height = layout.get_tile_size(tier)
+    x0, y0 = layout.get_tile_offset(tier, n)
+    face_size = float(layout.face_size) / layout.scales[tier]
+
+    def get_squared_coords(offset, size):
+        # squared face coordinate of each sample of a tile dimension, None for guard band samples
+        coords = []
+        for k in range(size / subsampling):
+            pos = (k + 0.5) * subsampling
+            if pos < guardband_size or pos > size - guardband_size:
+                coords.append(None)
+                continue
+            pos = offset + (pos - guardband_size) * size / (size - 2.0 * guardband_size)
+            coords.append(((pos % face_size) / face_size * 2 - 1) ** 2)
+        return coords
+
+    u2 = get_squared_coords(x0, width)
+    total = 0.0
+    rows = []
+    for v2 in get_squared_coords(y0, height):
+        sample_weights = [0.0 if u is None or v2 is None else (1 + u + v2) ** -1.5 for u in u2]
+        segments = []
+        for first in range(0, len(u2), WS_PSNR_SEGMENT):
+            weight = sum(sample_weights[first:first + WS_PSNR_SEGMENT])
+            count = min(WS_PSNR_SEGMENT, len(u2) - first)
+            if weight > 0:
+                segments.append((first, count, weight / count))
+            total += weight
+        rows.append(segments)
+    return total, rows
+
+
+def get_fixed_point_samples(plane):
+    # signed 32 bit samples with 16 fractional bits, audioop.rms of their differences is an integer
+    return audioop.mul(audioop.lin2lin(plane.translate(SIGNED_BYTES), 1, 4), 4, 1.0 / 256)
+
+
+def get_plane_errors(plane, reference, width, ws_rows):
+    """
+    Computes the squared errors between two 8 bit planes with audioop. The weighted sum uses one weight per segment
+    of a row (see get_ws_weights).
+    :return: (sum of squared errors, weighted sum of squared errors)
+    """
+    diff = audioop.add(get_fixed_point_samples(plane), audioop.mul(get_fixed_point_samples(reference), 4, -1), 4)
+    sse = (audioop.rms(diff, 4) / 65536.0) ** 2 * len(plane)
+    ws_sse = 0.0
+    for row, segments in enumerate(ws_rows):
+        for first, count, weight in segments:
+            start = (row * width + first) * 4
+            ws_sse += weight * count * (audioop.rms(diff[start:start + count * 4], 4) / 65536.0) ** 2
+    return sse, ws_sse
+
+
+def measure_tile_quality(bitstream_path, tile_path, quality_path, layout, tier, n, guardband_size=0,
+                         sample_step=1):
+    """
+    Decodes the bitstream of tile n with ffmpeg and compares every sample_step-th frame with the tile yuv file (which
+    is memory-mapped, so only the compared frames are read). Writes the PSNR and WS-PSNR of the Y, U and V planes,
+    averaged over the compared frames, and their mean squared errors to quality_path.
+    :return: True on success
+    """
+    width, height = layout.get_tile_size(tier)
+    luma_size = width * height
+    frame_size = luma_size * 3 / 2
+    # (name, offset, size, width, WS-PSNR weights) of the Y, U and V planes
+    luma_weights = get_ws_weights(layout, tier, n, guardband_size, 1)
+    chroma_weights = get_ws_weights(layout, tier, n, guardband_size, 2)
+    planes = [('y', 0, luma_size, width, luma_weights),
+              ('u', luma_size, luma_size / 4, width / 2, chroma_weights),
+              ('v', luma_size * 5 / 4, luma_size / 4, width / 2, chroma_weights)]
+    reference = map_file(tile_path)
+    if not reference:
+        print "ERROR: tile {} is empty".format(tile_path)
+        return False
+    sums = dict((name, {'sse': 0.0, 'ws_sse': 0.0, 'psnr': 0.0, 'ws_psnr': 0.0}) for name, _, _, _, _ in planes)
+    measured = 0
+    decoded = 0
+    p = subprocess.Popen(shlex.split(get_decode_cmd(bitstream_path, width, height)), stdout=subprocess.PIPE)
+    while True:
+        frame = p.stdout.read(frame_size)
+        if len(frame) < frame_size:
+            break
+        if decoded % sample_step == 0 and (decoded + 1) * frame_size <= len(reference):
+            ref = reference[decoded * frame_size:(decoded + 1) * frame_size]
+            for name, offset, size, plane_width, (weight, ws_rows) in planes:
+                sse, ws_sse = get_plane_errors(frame[offset:offset + size], ref[offset:offset + size], plane_width,
+                                               ws_rows)
+                sums[name]['sse'] += sse
+                sums[name]['ws_sse'] += ws_sse
+                sums[name]['psnr'] += get_psnr(sse / size)
+                sums[name]['ws_psnr'] += get_psnr(ws_sse / weight)
+            measured += 1
+        decoded += 1
+    p.stdout.close()
+    reference.close()
+    if not p.wait() == 0 or not measured:
+        print "ERROR: could not decode {} (errorcode={}, {} frames)".format(bitstream_path, p.returncode, decoded)
+        return False
+    quality = {
+        'decoded_frames': decoded,
+        'frames': measured,
+        'sample_step': sample_step,
+        'psnr': dict((name, sums[name]['psnr'] / measured) for name in sums),
+        'ws_psnr': dict((name, sums[name]['ws_psnr'] / measured) for name in sums),
+        # per frame, to combine the tiles of a picture
+        'planes': dict((name, {'samples': size, 'weight': weight, 'mse': sums[name]['sse'] / measured / size,
+                               'ws_mse': sums[name]['ws_sse'] / measured / weight})
+                       for name, offset, size, plane_width, (weight, ws_rows) in planes),
+    }
+    with open(quality_path, 'w') as f:
+        json.dump(quality, f, indent=1, sort_keys=True)
+    return True
+
+
+def summarize_quality(summary_path, tiers):
+    """
+    Combines the quality files and bitrate indexes of all tiles into the PSNR and WS-PSNR of the whole picture of each
+    tier and QP and writes them to summary_path. QPs which add little quality for their bitrate are reported.
+    :param tiers: list of (tier name, {qp: list of (quality path, bitrate index path) of all tiles})
+    :return: True on success
+    """
+    summary = {}
+    for tier_name, qps in tiers:
+        rungs = []
+        for qp, paths in sorted(qps.items()):
+            planes = {}
+            bitrate = 0
+            for quality_path, index_path in paths:
+                with open(quality_path) as f:
+                    quality = json.load(f)
+                with open(index_path) as f:
+                    bitrate += json.load(f)['bitrate']
+                for name, plane in quality['planes'].items():
+                    totals = planes.setdefault(name, [0.0, 0.0, 0.0, 0.0])
+                    totals[0] += plane['mse'] * plane['samples']
+                    totals[1] += plane['samples']
+                    totals[2] += plane['ws_mse'] * plane['weight']
+                    totals[3] += plane['weight']
+            rungs.append({'qp': qp, 'bitrate': bitrate,
+                          'psnr': dict((name, get_psnr(t[0] / t[1])) for name, t in planes.items()),
+                          'ws_psnr': dict((name, get_psnr(t[2] / t[3])) for name, t in planes.items())})
+        summary[tier_name] = rungs
+        rungs = sorted(rungs, key=lambda rung: rung['bitrate'])
+        for lower, rung in zip(rungs, rungs[1:]):
+            gain = rung['ws_psnr']['y'] - lower['ws_psnr']['y']
+            if gain < QUALITY_MIN_GAIN:
+                print "WARNING: QP {} of {} is only {:.2f} dB WS-PSNR better than QP {} at {:.0f}% more bitrate".format(
+                    rung['qp'], tier_name, gain, lower['qp'], 100.0 * (rung['bitrate'] / max(lower['bitrate'], 1) - 1))
+        for rung in rungs:
+            print "{} QP {}: {:.0f} kbit/s, WS-PSNR Y {:.2f} dB, PSNR Y {:.2f} dB".format(
+                tier_name, rung['qp'], rung['bitrate'] / 1000.0, rung['ws_psnr']['y'], rung['psnr']['y'])
+    with open(summary_path, 'w') as f:
+        json.dump(summary, f, indent=1, sort_keys=True)
+    return True
@@ -0,0 +1,325 @@
+"""
+This module is a part of The Fraunhofer OMAF Javascript Player implementation.
+(c) Copyright  1995 - 2019 Fraunhofer-Gesellschaft zur Foerderung der angewandten Forschung e.V. All rights reserved.
+
+Please see [LICENSE.txt](../LICENSE.txt) file for the terms of use of the contents of this repository.
+
+It contains the built-in ERP to CMP converter of create_omaf_files.py (--NativeConvert) and the tile layout.
+"""
+
+import sys
+import os
+import array
+import multiprocessing
+import math
+try:
+    import numpy  # optional, speeds up the built-in converter (--NativeConvert)
+except ImportError:
+    numpy = None
+
+from omaf_jobs import make_dirs_if_not_exist
+
+__author__ = "Dimitri Podborski"
+__version__ = "0.2"
+__maintainer__ = "Dimitri Podborski"
+__email__ = "dimitri.podborski@hhi.fraunhofer.de"
+__status__ = "Development"
+
+
+# cube faces of the CMP picture row by row with their counter-clockwise rotation in degrees (CodingFPStructure)
+CMP_FRAME_PACKING = [[(4, 0), (0, 0), (5, 0)], [(1, 0), (3, 90), (2, 270)]]
+# the built-in converter rounds the source positions to 1/CONVERT_PRECISION samples (a power of 2). Each of the
+# CONVERT_PRECISION x CONVERT_PRECISION weight classes has the bilinear weights of the top left, top right, bottom
+# left and bottom right neighbour, which add up to CONVERT_PRECISION ** 2.
+CONVERT_PRECISION = 16
+CONVERT_WEIGHTS = [((CONVERT_PRECISION - x) * (CONVERT_PRECISION - y), x * (CONVERT_PRECISION - y),
+                    (CONVERT_PRECISION - x) * y, x * y)
+                   for y in range(CONVERT_PRECISION) for x in range(CONVERT_PRECISION)]
+
+
+class TileLayout(object):
+    """
+    Geometry of the CMP pictures and their tiles which is used by all steps. The converter packs 3x2 cube faces of
+    face_size x face_size into the highres picture. Every resolution tier is the highres picture scaled down by a
+    factor (1 = highres) and is split into the same grid of cols x rows tiles. The default layout is a 6x4 grid with
+    768x768 highres and 384x384 lowres tiles, which is the only layout hevc2omaf can package.
+    """
+    def __init__(self, face_size=1536, cols=6, rows=4, scales=(1, 2)):
+        self.face_size = face_size
+        self.cols = cols
+        self.rows = rows
+        self.scales = list(scales)
+        self.width = face_size * 3
+        self.height = face_size * 2
+        self.tile_count = cols * rows
+
+    def __repr__(self):
+        # part of the command of tiling jobs and thereby of their cache key
+        return "TileLayout({}, {}, {}, {})".format(self.face_size, self.cols, self.rows, self.scales)
+
+    def is_default(self):
+        return (self.face_size, self.cols, self.rows, self.scales) == (1536, 6, 4, [1, 2])
+
+    def get_error(self, guardband_size=0):
+        """
+        :return: description of the first problem of the layout or None if the layout is valid
+        """
+        if self.face_size <= 0 or self.cols <= 0 or self.rows <= 0:
+            return "face size and tile grid have to be positive"
+        if not self.scales[0] == 1 or not sorted(set(self.scales)) == self.scales:
+            return "the first tier has to be the highres picture (1) followed by increasing scale factors"
+        for tier, scale in enumerate(self.scales):
+            if self.width % (scale * self.cols) or self.height % (scale * self.rows):
+                return "{}x{} picture scaled down by {} can not be split into {}x{} tiles".format(
+                    self.width, self.height, scale, self.cols, self.rows)
+            width, height = self.get_tile_size(tier)
+            # HEVC pictures consist of 8x8 minimum coding blocks
+            if width % 8 or height % 8:
+                return "tile size {}x{} of tier {} is not a multiple of 8".format(width, height, tier)
+            if min(width, height) <= guardband_size * 2:
+                return "tile size {}x{} of tier {} is too small for the guard bands".format(width, height, tier)
+        return None
+
+    def get_picture_size(self, tier):
+        return self.width / self.scales[tier], self.height / self.scales[tier]
+
+    def get_tile_size(self, tier):
+        width, height = self.get_picture_size(tier)
+        return width / self.cols, height / self.rows
+
+    def get_tile_offset(self, tier, n):
+        width, height = self.get_tile_size(tier)
+        return (n % self.cols) * width, (n / self.cols) * height
+
+    def get_tier_name(self, tier):
+        """
+        :return: "highres" for the first tier, "lowres_{width}x{height}" for all other tiers
+        """
+        if tier == 0:
+            return "highres"
+        return "lowres_{}x{}".format(*self.get_picture_size(tier))
+
+    def get_tiles(self):
+        """
+        :return: list of (tier, tile index) of all tiles
+        """
+        return [(tier, n) for tier in range(len(self.scales)) for n in range(self.tile_count)]
+
+
+def get_frame_cnt_yuv420(file_path, width, height):
+    file_size = os.path.getsize(file_path)
+    frame_size = (width*height*3)/2
+    return int(file_size/frame_size)
+
+
+def get_frame_cnt(file_path, width, height, bit_depth, chroma_format):
+    """
+    Returns the number of frames of a raw yuv file with any chroma format. Samples of more than 8 bits take 2 bytes.
+    """
+    frame_size = width * height * {400: 2, 420: 3, 422: 4, 444: 6}.get(chroma_format, 3) / 2
+    if bit_depth > 8:
+        frame_size *= 2
+    return int(os.path.getsize(file_path) / frame_size)
+
+
+def get_cube_face_point(face, pu, pv):
+    """
+    Returns the point on the unit cube of the face position pu, pv in [-1, 1] (360Lib cube map).
+    """
+    if face == 0:
+        return 1.0, -pv, -pu
+    elif face == 1:
+        return -1.0, -pv, pu
+    elif face == 2:
+        return pu, 1.0, pv
+    elif face == 3:
+        return pu, -1.0, -pv
+    elif face == 4:
+        return pu, -pv, 1.0
+    return -pu, -pv, -1.0
+
+
+def get_erp_to_cmp_taps(src_width, src_height, face_size, chroma=False):
+    """
+    Computes the source samples of every sample of a CMP plane with faces of face_size x face_size luma samples,
+    packed as in CMP_FRAME_PACKING, in an ERP plane of src_width x src_height luma samples. The sphere mapping is the
+    one of TApp360Convert. Chroma planes (4:2:0) have the chroma sample location type 0 of HEVC: each chroma sample
+    is at the position of the left one of its two luma columns and between its two luma rows.
+    The positions are computed for one row of a face at a time.
+    :return: (neighbours, weights) with one item per CMP sample in raster order: the index of its top left bilinear
+    neighbour in the ERP plane (array of 'i') and its weight class in CONVERT_WEIGHTS (array of 'B'), the position
+    between the neighbours in 1/CONVERT_PRECISION samples horizontally and vertically
+    """
+    sub = 2 if chroma else 1
+    offset_x, offset_y = (0.5, 1.0) if chroma else (0.5, 0.5)
+    size = face_size / sub
+    plane_width, plane_height = src_width / sub, src_height / sub
+    # positions in the face in [-1, 1] of the columns and rows of the plane
+    columns = [2.0 * (sub * n + offset_x) / face_size - 1 for n in range(size)]
+    rows = [2.0 * (sub * n + offset_y) / face_size - 1 for n in range(size)]
+    # source positions in 1/CONVERT_PRECISION samples of the plane, rounded
+    scale_x = CONVERT_PRECISION * src_width / (2 * math.pi * sub)
+    scale_y = CONVERT_PRECISION * src_height / (math.pi * sub)
+    bias_x = math.pi * scale_x + 0.5 - offset_x * CONVERT_PRECISION / sub
+    bias_y = 0.5 - offset_y * CONVERT_PRECISION / sub
+    wrap_x = plane_width * CONVERT_PRECISION
+    max_y = (plane_height - 1) * CONVERT_PRECISION
+    neighbours = array.array('i')
+    weights = array.array('B')
+    for packing_row in CMP_FRAME_PACKING:
+        for pv in rows:
+            for face, rotation in packing_row:
+                # positions in the face before it was rotated into the picture
+                if rotation == 90:
+                    face_positions = [-pv] * size, columns
+                elif rotation == 180:
+                    face_positions = [-pu for pu in columns], [-pv] * size
+                elif rotation == 270:
+                    face_positions = [pv] * size, [-pu for pu in columns]
+                else:
+                    face_positions = columns, [pv] * size
+                px, py, pz = zip(*map(get_cube_face_point, [face] * size, *face_positions))
+                # ERP wraps around horizontally, the rows are clamped at the poles
+                xs = [int(math.floor(bias_x - angle * scale_x)) % wrap_x for angle in map(math.atan2, pz, px)]
+                ys = [min(max(int(math.floor(angle * scale_y + bias_y)), 0), max_y)
+                      for angle in map(math.atan2, map(math.hypot, px, pz), py)]
+                for x, y in zip(xs, ys):
+                    neighbours.append(y / CONVERT_PRECISION * plane_width + x / CONVERT_PRECISION)
+                    weights.append(y % CONVERT_PRECISION * CONVERT_PRECISION + x % CONVERT_PRECISION)
+    return neighbours, weights
+
+
+def get_erp_to_cmp_lut_size(layout):
+    """
+    :return: size in bytes of the lookup table of create_erp_to_cmp_lut
+    """
+    # both chroma planes use the same table
+    sample_size = array.array('i').itemsize + array.array('B').itemsize
+    return layout.width * layout.height * 5 / 4 * sample_size
+
+
+def create_erp_to_cmp_lut(lut_path, width, height, layout):
+    """
+    Writes the lookup table of the built-in converter (--NativeConvert) for an ERP yuv of width x height and the CMP
+    picture of layout: the neighbours and weights of the luma plane followed by those of the chroma planes (4:2:0),
+    see get_erp_to_cmp_taps.
+    """
+    make_dirs_if_not_exist(os.path.dirname(lut_path))
+    temp_path = "{}.{}.tmp".format(lut_path, os.getpid())
+    with open(temp_path, mode='wb') as f:
+        for chroma in [False, True]:
+            neighbours, weights = get_erp_to_cmp_taps(width, height, layout.face_size, chroma)
+            neighbours.tofile(f)
+            weights.tofile(f)
+    # other sequences of a batch may create the same table
+    os.rename(temp_path, lut_path)
+    return True
+
+
+def load_erp_to_cmp_lut(lut_path, layout):
+    """
+    :return: (neighbours, weights) of the luma and of the chroma planes (see create_erp_to_cmp_lut) or None if the
+    table does not match the layout
+    """
+    if not os.path.getsize(lut_path) == get_erp_to_cmp_lut_size(layout):
+        print "Error: lookup table {} does not match the CMP layout".format(lut_path)
+        return None
+    taps = []
+    with open(lut_path, mode='rb') as f:
+        for sample_cnt in [layout.width * layout.height, layout.width * layout.height / 4]:
+            neighbours = array.array('i')
+            weights = array.array('B')
+            neighbours.fromfile(f, sample_cnt)
+            weights.fromfile(f, sample_cnt)
+            taps.append((neighbours, weights))
+    return taps
+
+
+def get_neighbour_planes(plane, width):
+    """
+    Returns the 2x2 neighbours of each sample of a plane (str of 8 bit samples with rows of width samples) as four
+    planes of the same size: the plane itself, the right neighbours (the rows wrap around), the neighbours below
+    (the last row is repeated) and their right neighbours.
+    """
+    right = ''.join(plane[begin + 1:begin + width] + plane[begin] for begin in xrange(0, len(plane), width))
+    return plane, right, plane[width:] + plane[-width:], right[width:] + right[-width:]
+
+
+def remap_plane(plane, width, taps):
+    """
+    Returns the plane (str of 8 bit samples with rows of width samples) remapped with the taps of get_erp_to_cmp_taps:
+    each output sample is the sum of its 2x2 neighbours times the weights of its weight class, rounded. numpy is used
+    if it is installed, it is much faster than the loop over the samples.
+    """
+    neighbours, weights = taps
+    shift = 2 * (CONVERT_PRECISION.bit_length() - 1)
+    if numpy:
+        indices = numpy.frombuffer(neighbours, dtype=numpy.intc)
+        classes = numpy.frombuffer(weights, dtype=numpy.uint8)
+        class_weights = numpy.array(CONVERT_WEIGHTS, dtype=numpy.int32)
+        total = numpy.full(len(neighbours), 1 << (shift - 1), dtype=numpy.int32)
+        for k, samples in enumerate(get_neighbour_planes(plane, width)):
+            total += numpy.frombuffer(samples, dtype=numpy.uint8)[indices] * class_weights[classes, k]
+        return (total >> shift).astype(numpy.uint8).tobytes()
+    top_left, top_right, bottom_left, bottom_right = [bytearray(samples)
+                                                      for samples in get_neighbour_planes(plane, width)]
+    output = bytearray(len(neighbours))
+    for k, n in enumerate(neighbours):
+        w0, w1, w2, w3 = CONVERT_WEIGHTS[weights[k]]
+        output[k] = (top_left[n] * w0 + top_right[n] * w1 + bottom_left[n] * w2 + bottom_right[n] * w3 +
+                     (1 << (shift - 1))) >> shift
+    return str(output)
+
+
+def remap_frames(input_path, output_path, width, height, layout, luma_taps, chroma_taps, skip_frames, frames,
+                 first_output_frame):
+    input_size = width * height * 3 / 2
+    output_size = layout.width * layout.height * 3 / 2
+    output_fd = os.open(output_path, os.O_WRONLY)
+    with open(input_path, mode='rb') as f:
+        f.seek(skip_frames * input_size)
+        os.lseek(output_fd, first_output_frame * output_size, os.SEEK_SET)
+        for n in range(frames):
+            frame = f.read(input_size)
+            if not len(frame) == input_size:
+                print "Error: {} ends before frame {}".format(input_path, skip_frames + n + 1)
+                os.close(output_fd)
+                return False
+            os.write(output_fd, remap_plane(frame[:width * height], width, luma_taps) +
+                     remap_plane(frame[width * height:input_size * 5 / 6], width / 2, chroma_taps) +
+                     remap_plane(frame[input_size * 5 / 6:], width / 2, chroma_taps))
+    os.close(output_fd)
+    return True
+
+
+def convert_erp_to_cmp(input_path, output_path, width, height, layout, lut_path, skip_frames=0, frame_cnt=0,
+                       processes=1):
+    """
+    Built-in replacement of TApp360Convert for 8 bit 4:2:0 yuv files (--NativeConvert). Converts frame_cnt frames
+    (0 = all) of the ERP yuv after skip_frames to the CMP yuv of layout with the lookup table of
+    create_erp_to_cmp_lut. The frames are split into ranges which are converted by processes child processes at the
+    same time and written to their place in the output file.
+    :return: True on success
+    """
+    if frame_cnt <= 0:
+        frame_cnt = get_frame_cnt_yuv420(input_path, width, height) - skip_frames
+    lut = load_erp_to_cmp_lut(lut_path, layout)
+    if not lut or frame_cnt <= 0:
+        return False
+    with open(output_path, mode='wb') as f:
+        f.truncate(frame_cnt * layout.width * layout.height * 3 / 2)
+    processes = max(1, min(processes, frame_cnt))
+    ranges = [(frame_cnt * k / processes, frame_cnt * (k + 1) / processes) for k in range(processes)]
+    if processes == 1:
+        return remap_frames(input_path, output_path, width, height, layout, lut[0], lut[1], skip_frames,
+                            frame_cnt, 0)
+    # the children are forked, so they share the lookup table with this process and stay in its process group
+    children = []
+    for begin, end in ranges:
+        args = (input_path, output_path, width, height, layout, lut[0], lut[1], skip_frames + begin, end - begin,
+                begin)
+        children.append(multiprocessing.Process(target=lambda args=args: sys.exit(0 if remap_frames(*args) else 1)))
+        children[-1].start()
+    for child in children:
+        child.join()
+    return all(child.exitcode == 0 for child in children)
@@ -0,0 +1,519 @@
+"""
+This module is a part of The Fraunhofer OMAF Javascript Player implementation.
+(c) Copyright  1995 - 2019 Fraunhofer-Gesellschaft zur Foerderung der angewandten Forschung e.V. All rights reserved.
+
+Please see [LICENSE.txt](../LICENSE.txt) file for the terms of use of the contents of this repository.
+
+It contains the distributed execution of create_omaf_files.py: the coordinator which hands jobs to remote workers and
+the worker which runs them (--Coordinator, --Worker).
+"""
+
+import sys
+import os
+import time
+import shutil
+import errno
+import signal
+import threading
+import json
+import hashlib
+import socket
+import SocketServer
+import tempfile
+import shlex, subprocess
+from distutils.spawn import find_executable
+
+from omaf_jobs import (Job, PIPE_READ_SIZE, get_file_identity, make_dirs_if_not_exist, make_pipe, wait_for_child,
+                       write_pipe)
+
+__author__ = "Dimitri Podborski"
+__version__ = "0.2"
+__maintainer__ = "Dimitri Podborski"
+__email__ = "dimitri.podborski@hhi.fraunhofer.de"
+__status__ = "Development"
+
+
+HEARTBEAT_INTERVAL = 5  # seconds between two heartbeats of a worker
+WORKER_TIMEOUT = 30  # jobs of a worker which was not seen for this time are given to other workers
+MAX_REMOTE_ATTEMPTS = 3
+
+
+def parse_address(address_str, default_host=''):
+    """
+    Parses [HOST:]PORT.
+    :return: (host, port) or None
+    """
+    host, _, port = address_str.rpartition(':')
+    port = cast_number(port)
+    if port is None:
+        return None
+    return host or default_host, port
+
+
+def send_message(f, msg):
+    f.write(json.dumps(msg) + '\n')
+    f.flush()
+
+
+def read_message(f):
+    line = f.readline()
+    if not line:
+        raise IOError("connection closed")
+    return json.loads(line)
+
+
+def copy_data(src, dst, size):
+    """
+    Copies size bytes from the file object src to dst.
+    """
+    while size > 0:
+        data = src.read(min(size, PIPE_READ_SIZE))
+        if not data:
+            raise IOError("unexpected end of data")
+        dst.write(data)
+        size -= len(data)
+
+
+def remote_call(address, msg, upload_path=None, download_path=None):
+    """
+    Sends a request to the coordinator and returns its response. The content of upload_path is sent after the
+    request. If the response announces data (size), the data is stored in download_path.
+    """
+    sock = socket.create_connection(address, timeout=WORKER_TIMEOUT)
+    try:
+        f = sock.makefile('rwb')
+        if upload_path:
+            msg['size'] = os.path.getsize(upload_path)
+        send_message(f, msg)
+        if upload_path:
+            with open(upload_path, mode='rb') as src:
+                copy_data(src, f, msg['size'])
+            f.flush()
+        response = read_message(f)
+        if download_path and 'size' in response:
+            with open(download_path, mode='wb') as dst:
+                copy_data(f, dst, response['size'])
+        return response
+    finally:
+        sock.close()
+
+
+class RemoteJob(Job):
+    """
+    Command line job which is executed by a worker of the coordinator instead of a local process. files are
+    additional input files of the command (e.g. the HM config file). threads is the number of cores the job uses on
+    the worker, it does not use any local cores.
+    """
+    local = False
+
+    def __init__(self, cmd, coordinator, files=None, **kwargs):
+        Job.__init__(self, cmd, **kwargs)
+        self.coordinator = coordinator
+        self.files = files or []
+
+    def start(self):
+        return self.coordinator.submit(self)
+
+
+class RemoteProcess(object):
+    """
+    Handle of a submitted RemoteJob. The pid is the negative job id, so it never collides with local processes.
+    """
+    def __init__(self, coordinator, job_id):
+        self.coordinator = coordinator
+        self.pid = -job_id
+        self.returncode = None
+
+    def cancel(self):
+        self.coordinator.cancel(-self.pid)
+
+
+class CoordinatorServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class CoordinatorHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        self.server.coordinator.handle(self.rfile, self.wfile)
+
+
+class Coordinator(object):
+    """
+    Distributes RemoteJobs to workers (see Worker) over TCP. Each request is one JSON line, file data follows the
+    line. Workers request jobs for their free cores, download input files they can't access, upload the outputs of
+    the job and report its return code. Jobs of a worker which was not seen for WORKER_TIMEOUT seconds are given to
+    other workers (at most MAX_REMOTE_ATTEMPTS times).
+    Finished jobs are reported to execute_jobs through a pipe (see fileno), which the runner waits on with select
+    together with the exits of its child processes.
+    """
+    def __init__(self, address):
+        self.server = CoordinatorServer(address, CoordinatorHandler)
+        self.server.coordinator = self
+        self.lock = threading.Condition()
+        self.next_id = 1
+        self.jobs = {}  # job id -> job
+        self.queue = []  # ids of the jobs which wait for a worker
+        self.assigned = {}  # job id -> (worker, attempt, time of assignment)
+        self.attempts = {}  # job id -> number of assignments
+        self.workers = {}  # worker name -> time of the last request
+        self.files = set()  # input files which may be downloaded
+        self.finished = []  # (job id, returncode, resource usage on the worker)
+        self.requests = 0  # number of requests which are handled right now
+        self.closed = False
+        self.pipe = None  # (read end, write end), a byte is written for each finished job
+
+    def get_address(self):
+        return "{}:{}".format(*self.server.server_address)
+
+    def fileno(self):
+        return self.pipe[0]
+
+    def start(self):
+        self.pipe = make_pipe()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        if self.pipe is None:
+            self.server.server_close()  # not started
+            return
+        self.server.shutdown()
+        with self.lock:
+            # release the long polling requests of idle workers and give running requests some time to finish
+            self.closed = True
+            self.lock.notify_all()
+            deadline = time.time() + HEARTBEAT_INTERVAL
+            while self.requests and time.time() < deadline:
+                self.lock.wait(deadline - time.time())
+        self.server.server_close()
+        for fd in self.pipe:
+            os.close(fd)
+
+    def submit(self, job):
+        with self.lock:
+            job_id = self.next_id
+            self.next_id += 1
+            self.jobs[job_id] = job
+            self.attempts[job_id] = 0
+            self.queue.append(job_id)
+            self.files.update(job.inputs + job.files)
+            self.lock.notify_all()
+        return RemoteProcess(self, job_id)
+
+    def cancel(self, job_id):
+        # workers are told to terminate the job with the response to their next heartbeat
+        with self.lock:
+            self.jobs.pop(job_id, None)
+            self.assigned.pop(job_id, None)
+            if job_id in self.queue:
+                self.queue.remove(job_id)
+
+    def pop_finished(self):
+        """
+        :return: (job id, returncode, resource usage) of a finished job or None
+        """
+        with self.lock:
+            return self.finished.pop(0) if self.finished else None
+
+    def handle(self, rfile, wfile):
+        with self.lock:
+            self.requests += 1
+        try:
+            msg = read_message(rfile)
+            handlers = {'get_job': self._get_job, 'heartbeat': self._heartbeat, 'get_file': self._get_file,
+                        'put_file': self._put_file, 'done': self._done}
+            if msg.get('type') not in handlers:
+                raise ValueError("unknown request {}".format(msg.get('type')))
+            with self.lock:
+                self._update_workers(msg['worker'])
+            handlers[msg['type']](msg, rfile, wfile)
+        except (IOError, ValueError, KeyError) as e:
+            print "WARN: request of a worker failed: {}".format(e)
+        finally:
+            with self.lock:
+                self.requests -= 1
+                self.lock.notify_all()
+
+    def _finish(self, job_id, returncode, usage=None):
+        self.jobs.pop(job_id, None)
+        self.assigned.pop(job_id, None)
+        self.finished.append((job_id, returncode, usage))
+        write_pipe(self.pipe[1])
+
+    def _requeue(self, job_id, reason):
+        worker = self.assigned.pop(job_id)[0]
+        if self.attempts[job_id] >= MAX_REMOTE_ATTEMPTS:
+            print "ERROR: {} on worker {}, giving up after {} attempts: {}".format(
+                reason, worker, self.attempts[job_id], self.jobs[job_id])
+            self._finish(job_id, 1)
+        else:
+            print "WARN: {} on worker {}, job is executed again: {}".format(reason, worker, self.jobs[job_id])
+            self.queue.insert(0, job_id)
+            self.lock.notify_all()
+
+    def _update_workers(self, name):
+        now = time.time()
+        if name not in self.workers:
+            print "Worker {} connected".format(name)
+        self.workers[name] = now
+        for worker, last_seen in self.workers.items():
+            if now - last_seen > WORKER_TIMEOUT:
+                print "WARN: worker {} did not respond for {} seconds".format(worker, int(now - last_seen))
+                del self.workers[worker]
+                for job_id, assignment in self.assigned.items():
+                    if assignment[0] == worker:
+                        self._requeue(job_id, "worker died")
+
+    def _is_assigned(self, msg):
+        return self.assigned.get(msg['job'], [None])[:2] == (msg['worker'], msg['attempt'])
+
+    def _get_job(self, msg, rfile, wfile):
+        # the request is held until a job fits into the free cores of the worker (long polling)
+        deadline = time.time() + HEARTBEAT_INTERVAL
+        with self.lock:
+            while True:
+                for job_id in self.queue:
+                    threads = min(self.jobs[job_id].threads, msg['cores'])
+                    if threads <= msg['free']:
+                        break
+                else:
+                    job_id = None
+                if job_id is not None or time.time() >= deadline or self.closed:
+                    break
+                self.lock.wait(deadline - time.time())
+            if job_id is None:
+                response = {'type': 'none'}
+            else:
+                job = self.jobs[job_id]
+                self.queue.remove(job_id)
+                self.attempts[job_id] += 1
+                self.assigned[job_id] = (msg['worker'], self.attempts[job_id], time.time())
+                response = {'type': 'job', 'job': job_id, 'attempt': self.attempts[job_id], 'cmd': job.cmd,
+                            'threads': threads, 'outputs': job.outputs,
+                            'inputs': [[path, get_file_identity(path)] for path in job.inputs + job.files]}
+        send_message(wfile, response)
+
+    def _heartbeat(self, msg, rfile, wfile):
+        now = time.time()
+        with self.lock:
+            running = set(msg['jobs'])
+            cancel = [job_id for job_id in running if self.assigned.get(job_id, [None])[0] != msg['worker']]
+            for job_id, (worker, attempt, assigned_time) in self.assigned.items():
+                # jobs are listed in the heartbeats from their assignment until the result was sent
+                if worker == msg['worker'] and job_id not in running and now - assigned_time > HEARTBEAT_INTERVAL:
+                    self._requeue(job_id, "job got lost")
+        send_message(wfile, {'type': 'ok', 'cancel': cancel})
+
+    def _get_file(self, msg, rfile, wfile):
+        path = msg['path'].encode('utf-8')
+        if path not in self.files or not os.path.isfile(path):
+            send_message(wfile, {'type': 'error', 'error': "{} can't be downloaded".format(path)})
+            return
+        with open(path, mode='rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            send_message(wfile, {'type': 'file', 'size': size})
+            copy_data(f, wfile, size)
+
+    def _put_file(self, msg, rfile, wfile):
+        path = msg['path'].encode('utf-8')
+        with self.lock:
+            valid = self._is_assigned(msg) and path in self.jobs[msg['job']].outputs
+        if not valid:
+            with open(os.devnull, mode='wb') as f:
+                copy_data(rfile, f, msg['size'])
+            send_message(wfile, {'type': 'error', 'error': "job is not assigned to this worker"})
+            return
+        with open(path + '.part', mode='wb') as f:
+            copy_data(rfile, f, msg['size'])
+        os.rename(path + '.part', path)
+        send_message(wfile, {'type': 'ok'})
+
+    def _done(self, msg, rfile, wfile):
+        with self.lock:
+            if self._is_assigned(msg):
+                if msg['returncode'] is None:
+                    self._requeue(msg['job'], "job could not be executed ({})".format(msg.get('error')))
+                else:
+                    if msg['returncode'] != 0:
+                        print "ERROR: job failed on worker {}".format(msg['worker'])
+                    self._finish(msg['job'], msg['returncode'], dict(msg['usage'] or {}, host=msg['worker']))
+        send_message(wfile, {'type': 'ok'})
+
+
+class Worker(object):
+    """
+    Executes the jobs of a coordinator on up to cores cores until the worker is interrupted. Input files are used
+    directly if they are accessible under the same path (shared file system or localhost), otherwise they are
+    downloaded once and kept until the worker exits. The outputs are always uploaded to the coordinator.
+    """
+    def __init__(self, address, cores, bin_dir):
+        self.address = address
+        self.cores = cores
+        self.bin_dir = bin_dir
+        self.name = "{}:{}".format(socket.gethostname(), os.getpid())
+        self.lock = threading.Condition()
+        self.free = cores
+        self.running = {}  # job id -> process of the job (None until it is started)
+        self.cancelled = set()
+        self.downloads = {}  # (path, identity) -> [lock, local path]
+        self.work_dir = None
+        self.last_contact = time.time()
+
+    def run(self):
+        # clean up when the worker is terminated
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        self.work_dir = tempfile.mkdtemp(prefix='omaf_worker_')
+        make_dirs_if_not_exist(os.path.join(self.work_dir, 'inputs'))
+        heartbeat = threading.Thread(target=self.send_heartbeats)
+        heartbeat.daemon = True
+        heartbeat.start()
+        print "Worker {} with {} cores, coordinator {}:{}".format(self.name, self.cores, *self.address)
+        connected = False
+        try:
+            while True:
+                with self.lock:
+                    while self.free == 0:
+                        self.lock.wait(1.0)
+                    free = self.free
+                try:
+                    msg = remote_call(self.address, {'type': 'get_job', 'worker': self.name, 'cores': self.cores,
+                                                     'free': free})
+                except (IOError, ValueError) as e:
+                    if connected:
+                        print "WARN: lost connection to the coordinator: {}".format(e)
+                    connected = False
+                    time.sleep(HEARTBEAT_INTERVAL)
+                    continue
+                if not connected:
+                    print "Connected to the coordinator"
+                    connected = True
+                if msg['type'] != 'job':
+                    continue
+                with self.lock:
+                    self.free -= msg['threads']
+                    self.running[msg['job']] = None
+                thread = threading.Thread(target=self.execute, args=(msg,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            self.cancel(list(self.running))
+            shutil.rmtree(self.work_dir, True)
+
+    def send_heartbeats(self):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            with self.lock:
+                jobs = list(self.running)
+            try:
+                response = remote_call(self.address, {'type': 'heartbeat', 'worker': self.name, 'jobs': jobs})
+                self.last_contact = time.time()
+            except (IOError, ValueError) as e:
+                if getattr(e, 'errno', None) == errno.ECONNREFUSED or time.time() - self.last_contact > WORKER_TIMEOUT:
+                    # the coordinator is gone or has given the jobs to other workers
+                    self.cancel(jobs)
+                continue
+            self.cancel(response['cancel'])
+
+    def cancel(self, job_ids):
+        with self.lock:
+            for job_id in job_ids:
+                if job_id not in self.running:
+                    continue
+                self.cancelled.add(job_id)
+                if self.running[job_id]:
+                    try:
+                        os.killpg(self.running[job_id].pid, signal.SIGTERM)
+                    except OSError:
+                        pass
+
+    def get_tool(self, tool):
+        if os.path.isfile(tool):
+            return tool
+        local_tool = os.path.join(self.bin_dir, os.path.basename(tool))
+        if os.path.isfile(local_tool):
+            return local_tool
+        return find_executable(os.path.basename(tool)) or tool
+
+    def get_input(self, path, identity):
+        """
+        :return: local path of an input file of a job
+        """
+        if identity and get_file_identity(path) == identity:
+            return os.path.abspath(path)
+        key = json.dumps([path, identity])
+        with self.lock:
+            download = self.downloads.setdefault(key, [threading.Lock(), None])
+        with download[0]:
+            if not download[1]:
+                local_path = os.path.join(self.work_dir, 'inputs', "{}_{}".format(
+                    hashlib.sha1(key).hexdigest()[:8], os.path.basename(path)))
+                response = remote_call(self.address, {'type': 'get_file', 'worker': self.name, 'path': path},
+                                       download_path=local_path + '.part')
+                if response['type'] != 'file':
+                    raise IOError(response.get('error'))
+                os.rename(local_path + '.part', local_path)
+                download[1] = local_path
+        return download[1]
+
+    def execute(self, msg):
+        job_id = msg['job']
+        job_dir = os.path.join(self.work_dir, str(job_id))
+        returncode = None
+        usage = None
+        error = None
+        try:
+            os.makedirs(job_dir)
+            paths = {}
+            for path, identity in msg['inputs']:
+                paths[path.encode('utf-8')] = self.get_input(path.encode('utf-8'), identity)
+            for path in msg['outputs']:
+                paths[path.encode('utf-8')] = os.path.join(job_dir, os.path.basename(path.encode('utf-8')))
+            # replace the paths of the coordinator in the arguments (also in --Option=path arguments)
+            args = shlex.split(msg['cmd'].encode('utf-8'))
+            args[0] = self.get_tool(args[0])
+            for idx, arg in enumerate(args):
+                key, sep, value = arg.rpartition('=')
+                if arg in paths:
+                    args[idx] = paths[arg]
+                elif sep and value in paths:
+                    args[idx] = key + sep + paths[value]
+            with self.lock:
+                if job_id not in self.cancelled:
+                    self.running[job_id] = subprocess.Popen(args, cwd=job_dir, preexec_fn=os.setpgrp)
+            p = self.running[job_id]
+            if p:
+                start = time.time()
+                returncode, usage = wait_for_child(p.pid)
+                p.returncode = returncode
+                usage['wall'] = time.time() - start
+            if returncode == 0 and job_id not in self.cancelled:
+                for path in msg['outputs']:
+                    response = remote_call(self.address, {'type': 'put_file', 'worker': self.name, 'job': job_id,
+                                                          'attempt': msg['attempt'], 'path': path},
+                                           upload_path=paths[path.encode('utf-8')])
+                    if response['type'] != 'ok':
+                        raise IOError(response.get('error'))
+        except (IOError, OSError, ValueError) as e:
+            print "WARN: job {} could not be executed: {}".format(job_id, e)
+            returncode = None
+            error = str(e)
+        try:
+            remote_call(self.address, {'type': 'done', 'worker': self.name, 'job': job_id, 'attempt': msg['attempt'],
+                                       'returncode': returncode, 'usage': usage, 'error': error})
+        except (IOError, ValueError):
+            pass  # the job is executed again by another worker
+        with self.lock:
+            del self.running[job_id]
+            self.cancelled.discard(job_id)
+            self.free += msg['threads']
+            self.lock.notify_all()
+        shutil.rmtree(job_dir, True)
+
+
+def cast_number(num_str):
+    try:
+        return int(num_str)
+    except ValueError:
+        return None
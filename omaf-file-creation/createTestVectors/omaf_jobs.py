@@ -0,0 +1,1079 @@
+"""
+This module is a part of The Fraunhofer OMAF Javascript Player implementation.
+(c) Copyright  1995 - 2019 Fraunhofer-Gesellschaft zur Foerderung der angewandten Forschung e.V. All rights reserved.
+
+Please see [LICENSE.txt](../LICENSE.txt) file for the terms of use of the contents of this repository.
+
+It contains the job runner of create_omaf_files.py: jobs, the job cache, scheduling, the adaptive concurrency
+control and the execution of the job graph.
+"""
+
+import sys
+import os
+import time
+import errno
+import fcntl
+import signal
+import select
+import heapq
+import traceback
+import json
+import hashlib
+import glob
+import multiprocessing
+import shlex, subprocess
+from distutils.spawn import find_executable
+try:
+    import numpy  # optional, the built-in converter is much faster with it
+except ImportError:
+    numpy = None
+
+__author__ = "Dimitri Podborski"
+__version__ = "0.2"
+__maintainer__ = "Dimitri Podborski"
+__email__ = "dimitri.podborski@hhi.fraunhofer.de"
+__status__ = "Development"
+
+
+PIPE_READ_SIZE = 1 << 20
+
+
+MAX_JOB_RETRIES = 1  # a job with Job.retry jobs may fail this often before the run is stopped
+
+
+# Rough single core throughput of each kind of job in pixels per second. Only used to estimate the cost of jobs,
+# so that the longest jobs can be started first, and by --Plan. Calibrated with the reports of earlier runs (see
+# load_job_calibration).
+JOB_THROUGHPUT = {
+    'convert': 10e6,
+    'remap': 10e6 if numpy else 1.3e6,  # built-in converter (--NativeConvert), much faster with numpy
+    'lut': 0.4e6,
+    'downscale': 100e6,
+    'crop': 200e6,
+    'tile': 400e6,
+    'encode0': 0.05e6,  # HM
+    'encode1': 0.5e6,  # kvazaar --preset slower
+    'encode2': 2e6,  # HHI encoder
+    'filter': 2000e6,
+    'quality': 10e6,  # decoding and measuring a tile (--Quality)
+    'package': 500e6,
+}
+# rough size of an encoded picture at QP 32 in bytes per pixel, only used by --Plan
+ENCODED_BYTES_PER_PIXEL = 0.01
+
+
+# classes of intermediate files (Job.intermediate), see --Cleanup and --Keep
+INTERMEDIATE_CLASSES = ['shards', 'highres', 'lowres', 'tiles', 'chunks', 'unfiltered']
+# seconds between two samples of the memory and CPU usage (--AdaptiveThreads)
+CONCURRENCY_INTERVAL = 2
+# part of the physical memory which is kept free, jobs are not started if they would use it (--AdaptiveThreads)
+MEMORY_RESERVE = 0.1
+# the number of jobs is lowered above this share of time in which tasks stalled on memory (PSI "some avg10", %)
+MEMORY_PRESSURE_LIMIT = 10.0
+
+
+class Job(object):
+    """
+    Command line job for execute_jobs. The job is started when all jobs in deps have finished successfully.
+    on_start is called right before the process is started and on_exit(returncode) after it has exited.
+    The job fails if on_exit returns False.
+    cost is the estimated run time in seconds (see estimate_job_cost), kind its key in JOB_THROUGHPUT and threads the
+    number of cores the job uses. output_bytes is the estimated size of the outputs if it is known in advance (--Plan).
+    tile, qp and sequence (its file prefix) are only used to group the jobs in the JobStats report. intermediate is
+    the class of the output files if they are only needed by other jobs (see IntermediateFiles). Jobs with a higher
+    priority and the jobs they depend on are started first (see get_priorities). If a job with retry jobs fails, the
+    retry jobs (e.g. the encoder of a broken bitstream) and the job itself are executed again (see execute_jobs).
+    """
+    local = True  # the job runs on this machine and uses its cores
+
+    def __init__(self, cmd, on_start=None, on_exit=None, inputs=None, deps=None, step=None, shell=False, cost=0.0,
+                 threads=1, kind=None):
+        self.cmd = cmd
+        self.on_start = on_start
+        self.on_exit = on_exit
+        self.inputs = inputs or []
+        self.outputs = []
+        self.deps = deps or []
+        self.step = step
+        self.shell = shell
+        self.cost = cost
+        self.kind = kind
+        self.threads = threads
+        self.output_bytes = None
+        self.tile = None
+        self.qp = None
+        self.sequence = None
+        self.intermediate = None
+        self.priority = 0
+        self.retry = []
+
+    def __str__(self):
+        return self.cmd
+
+    def get_name(self):
+        """
+        Short name of the job: name of the tool and of the first output.
+        """
+        name = os.path.basename(shlex.split(self.cmd)[0])
+        if self.outputs:
+            name += " " + os.path.basename(self.outputs[0])
+        return name
+
+    def get_tool(self):
+        """
+        Returns the path of the executable which is run by the job.
+        """
+        tool = shlex.split(self.cmd)[0]
+        if os.path.dirname(tool):
+            return tool
+        return find_executable(tool) or tool
+
+    def start(self):
+        # each job gets its own process group, so it can be terminated together with all its child processes
+        if self.shell:
+            return subprocess.Popen(self.cmd, shell=True, preexec_fn=os.setpgrp)
+        return subprocess.Popen(shlex.split(self.cmd), preexec_fn=os.setpgrp)
+
+
+class FunctionProcess(object):
+    """
+    Runs func(*args, **kwargs) in a forked child process. Provides pid and returncode like subprocess.Popen.
+    """
+    def __init__(self, func, args, kwargs=None):
+        self.returncode = None
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self.pid = os.fork()
+        if self.pid == 0:
+            code = 1
+            try:
+                os.setpgrp()
+                # the exits of the child processes of func don't wake up the runner (see ChildWatcher)
+                signal.set_wakeup_fd(-1)
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                code = 0 if func(*args, **(kwargs or {})) is not False else 1
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+
+
+class FunctionJob(Job):
+    """
+    Job which runs func(*args, **kwargs) in a separate process. The job fails if the function returns False. Only
+    args identify the job, kwargs must not change its outputs (e.g. the number of processes).
+    """
+    def __init__(self, name, func, args=(), deps=None, step=None, cost=0.0, kind=None, kwargs=None):
+        Job.__init__(self, name, deps=deps, step=step, cost=cost, kind=kind)
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+
+    def get_tool(self):
+        # the function is part of the script or of one of its modules
+        module = sys.modules.get(self.func.__module__)
+        return os.path.abspath(getattr(module, '__file__', __file__)).replace('.pyc', '.py')
+
+    def start(self):
+        return FunctionProcess(self.func, self.args, self.kwargs)
+
+    def get_name(self):
+        name = self.func.__name__
+        if self.outputs:
+            name += " " + os.path.basename(self.outputs[0])
+        return name
+
+    def __str__(self):
+        return "{}{}".format(self.func.__name__, self.args)
+
+
+def get_file_identity(path):
+    """
+    Returns [size, mtime] of a file, 'dir' for directories or None if the path does not exist.
+    """
+    if os.path.isdir(path):
+        return 'dir'
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, int(stat.st_mtime)]
+
+
+class JobCache(object):
+    """
+    Manifest of finished jobs, stored in the output directory. A job is identified by a hash of its command, the
+    identity of the tool binary and the identity of its input files. Inputs which are created by other jobs are
+    identified by the key of that job. Jobs whose key is in the manifest and whose outputs did not change are
+    skipped, so a run can be resumed and only jobs with changed parameters are executed again.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.keys = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def get_key(self, job, producers):
+        if job not in self.keys:
+            key = hashlib.sha1(str(job))
+            key.update(json.dumps([job.get_tool(), get_file_identity(job.get_tool())]))
+            for path in job.inputs:
+                if path in producers:
+                    key.update(self.get_key(producers[path], producers))
+                else:
+                    key.update(json.dumps([path, get_file_identity(path)]))
+            self.keys[job] = key.hexdigest()
+        return self.keys[job]
+
+    def is_done(self, job):
+        entry = self.entries.get(self.keys[job])
+        if not entry:
+            return False
+        return all(get_file_identity(path) == identity for path, identity in entry['outputs'])
+
+    def add(self, job):
+        self.entries[self.keys[job]] = {'cmd': str(job),
+                                        'outputs': [[path, get_file_identity(path)] for path in job.outputs]}
+        self._write()
+
+    def remove(self, job):
+        # the job is executed again by the next run
+        if self.entries.pop(self.keys.get(job), None):
+            self._write()
+
+    def _write(self):
+        # write a new file and replace the old one, so the manifest stays valid if the script is killed
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.rename(self.path + '.tmp', self.path)
+
+    def get_jobs_to_run(self, jobs, skip_done=True):
+        """
+        Computes the keys of all jobs and removes all jobs which are up to date (if skip_done is set). A job which is
+        not up to date is also skipped if all jobs which depend on it are up to date (e.g. an encoder job whose unfiltered bitstream was already removed).
+        :return: jobs which have to be executed, finished jobs are removed from their deps
+        """
+        producers = {}
+        dependents = dict((job, []) for job in jobs)
+        for job in jobs:
+            for path in job.outputs:
+                producers[path] = job
+            for dep in job.deps:
+                dependents[dep].append(job)
+        skip = set()
+        for job in reversed(get_topological_order(jobs, dependents)):
+            self.get_key(job, producers)
+            if not skip_done:
+                continue
+            if self.is_done(job) or (dependents[job] and all(dependent in skip for dependent in dependents[job])):
+                skip.add(job)
+        for job in jobs:
+            job.deps = [dep for dep in job.deps if dep not in skip]
+        return [job for job in jobs if job not in skip]
+
+
+def get_usage(rusage):
+    """
+    Converts the resource usage of wait4 into a dict: user and sys CPU time in seconds, peak RSS in bytes and bytes
+    read and written to block devices (cached file accesses are not counted).
+    """
+    max_rss = rusage.ru_maxrss if sys.platform.startswith('darwin') else rusage.ru_maxrss * 1024
+    return {'user': rusage.ru_utime, 'sys': rusage.ru_stime, 'max_rss': max_rss, 'read': rusage.ru_inblock * 512,
+            'write': rusage.ru_oublock * 512}
+
+
+def get_path_size(path):
+    """
+    Returns the size of a file or of all files in a directory, 0 if the path does not exist.
+    """
+    if os.path.isdir(path):
+        return sum(get_path_size(os.path.join(root, name)) for root, dirs, files in os.walk(path) for name in files)
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class JobStats(object):
+    """
+    Resource usage of all jobs executed by execute_jobs: wall time, CPU time, peak RSS and block I/O (from wait4)
+    and the sizes of the input and output files of each job. Written as a JSON report with aggregates per step,
+    tile and QP and as a Chrome trace (chrome://tracing or ui.perfetto.dev) with one row per used core.
+    """
+    FIELDS = ['wall', 'user', 'sys', 'max_rss', 'read', 'write', 'input_bytes', 'output_bytes']
+
+    def __init__(self, num_threads):
+        self.num_threads = num_threads
+        self.start_time = time.time()
+        self.started = {}  # job -> (start time, size of the inputs)
+        self.records = []
+        self.peak_disk_bytes = 0  # peak size of all job outputs (see IntermediateFiles)
+
+    def start(self, job):
+        # the inputs are measured now, some jobs remove their input file
+        self.started[job] = (time.time(), sum(get_path_size(path) for path in job.inputs))
+
+    def finish(self, job, returncode, usage):
+        end = time.time()
+        start, input_bytes = self.started.pop(job)
+        usage = usage or {}
+        if 'wall' in usage:
+            start = end - usage['wall']  # job of a worker, the time it waited for a worker is not counted
+        record = {'name': job.get_name(), 'cmd': str(job), 'step': job.step, 'tile': job.tile, 'qp': job.qp,
+                  'sequence': job.sequence, 'kind': job.kind, 'cost': job.cost, 'host': usage.get('host', 'local'),
+                  'threads': job.threads, 'returncode': returncode, 'start': start - self.start_time,
+                  'wall': end - start, 'input_bytes': input_bytes,
+                  'output_bytes': sum(get_path_size(path) for path in job.outputs)}
+        for field in ['user', 'sys', 'max_rss', 'read', 'write']:
+            record[field] = usage.get(field, 0)
+        self.records.append(record)
+
+    def get_summary(self):
+        local = [record for record in self.records if record['host'] == 'local']
+        makespan = max([record['start'] + record['wall'] for record in self.records] or [0.0])
+        cpu = sum(record['user'] + record['sys'] for record in local)
+        return {'jobs': len(self.records), 'makespan': makespan, 'num_threads': self.num_threads,
+                'cpu': sum(record['user'] + record['sys'] for record in self.records),
+                'local_utilization': cpu / (makespan * self.num_threads) if makespan else 0.0,
+                'peak_disk_bytes': self.peak_disk_bytes}
+
+    def aggregate(self, key):
+        groups = {}
+        for record in self.records:
+            if record[key] is None:
+                continue
+            group = groups.setdefault(str(record[key]), dict([('jobs', 0)] + [(field, 0) for field in self.FIELDS]))
+            group['jobs'] += 1
+            for field in self.FIELDS:
+                if field == 'max_rss':
+                    group[field] = max(group[field], record[field])
+                else:
+                    group[field] += record[field]
+        return groups
+
+    def write_report(self, path):
+        # the throughput table the costs are based on, needed to calibrate it with this report
+        report = {'summary': self.get_summary(), 'steps': self.aggregate('step'), 'tiles': self.aggregate('tile'),
+                  'qps': self.aggregate('qp'), 'hosts': self.aggregate('host'),
+                  'sequences': self.aggregate('sequence'), 'throughput': JOB_THROUGHPUT, 'jobs': self.records}
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+
+    def write_trace(self, path):
+        """
+        Writes the jobs as complete events. Each host is a process and the jobs are distributed to rows, so that
+        jobs in one row don't overlap. The rows show how many cores were busy over time.
+        """
+        events = []
+        hosts = sorted(set(record['host'] for record in self.records), key=lambda host: host != 'local')
+        for pid, host in enumerate(hosts):
+            events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': host}})
+            rows = []  # end time of the last job in each row
+            for record in sorted([r for r in self.records if r['host'] == host], key=lambda r: r['start']):
+                for tid, end in enumerate(rows):
+                    if end <= record['start']:
+                        break
+                else:
+                    tid = len(rows)
+                    rows.append(0.0)
+                rows[tid] = record['start'] + record['wall']
+                args = dict((field, record[field]) for field in ['cmd', 'returncode'] + self.FIELDS)
+                events.append({'name': record['name'], 'cat': 'step{}'.format(record['step']), 'ph': 'X',
+                               'ts': int(record['start'] * 1e6), 'dur': int(record['wall'] * 1e6), 'pid': pid,
+                               'tid': tid, 'args': args})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def print_summary(self):
+        summary = self.get_summary()
+        for step, group in sorted(self.aggregate('step').items()):
+            print "Step {}: {} jobs, {:.1f}s wall, {:.1f}s CPU, peak RSS {:.0f} MB, {:.0f} MB in, {:.0f} MB out".format(
+                step, group['jobs'], group['wall'], group['user'] + group['sys'], group['max_rss'] / 1e6,
+                group['input_bytes'] / 1e6, group['output_bytes'] / 1e6)
+        print "{} jobs in {:.1f}s, {:.1f}s CPU, {:.0f}% of {} local cores used".format(
+            summary['jobs'], summary['makespan'], summary['cpu'], summary['local_utilization'] * 100,
+            self.num_threads)
+        print "Peak disk usage of all job outputs: {:.0f} MB".format(self.peak_disk_bytes / 1e6)
+
+
+def load_job_calibration(report_dirs):
+    """
+    Calibrates JOB_THROUGHPUT with the JobStats reports of earlier runs in report_dirs. The throughput of a kind of
+    job is the estimated work of all its successful jobs (cost times the throughput the cost was based on) divided by
+    their wall time.
+    :return: (throughput of each kind, peak RSS of each kind, number of jobs used)
+    """
+    work = {}
+    wall = {}
+    max_rss = {}
+    count = 0
+    for report_dir in report_dirs:
+        for path in sorted(glob.glob(os.path.join(report_dir, 'run_*.json'))):
+            if path.endswith('_trace.json'):
+                continue
+            try:
+                with open(path) as f:
+                    report = json.load(f)
+            except (IOError, ValueError):
+                print "WARNING: can not read report {}".format(path)
+                continue
+            throughput = report.get('throughput', {})  # older reports can not be used
+            for record in report.get('jobs', []):
+                kind = record.get('kind')
+                if kind not in JOB_THROUGHPUT or kind not in throughput or record['returncode'] != 0 or \
+                        not record['wall'] > 0 or not record.get('cost'):
+                    continue
+                work[kind] = work.get(kind, 0.0) + record['cost'] * throughput[kind]
+                wall[kind] = wall.get(kind, 0.0) + record['wall']
+                max_rss[kind] = max(max_rss.get(kind, 0), record['max_rss'])
+                count += 1
+    return dict((kind, work[kind] / wall[kind]) for kind in work), max_rss, count
+
+
+class IntermediateFiles(object):
+    """
+    Removes the intermediate files of the classes in remove (e.g. 'tiles') as soon as all jobs which read them have
+    finished successfully. Each output file of a job whose intermediate class is in remove gets a reference count of
+    the jobs which will be executed and have it as input. Files which are not created by a job of the graph are never
+    removed. Also tracks the size of all job outputs on disk and its peak. The sizes are updated when a job finishes,
+    so the peak does not include files of jobs which are still running.
+    """
+    def __init__(self, jobs, jobs_to_run, remove):
+        self.sizes = {}  # output path -> bytes on disk
+        self.consumers = {}  # path of a removable file -> number of jobs which still need it
+        for job in jobs:
+            for path in job.outputs:
+                self.sizes[path] = get_path_size(path)
+                if job.intermediate in remove:
+                    self.consumers[path] = 0
+        for job in jobs_to_run:
+            for path in set(job.inputs):
+                if path in self.consumers:
+                    self.consumers[path] += 1
+        self.bytes = sum(self.sizes.values())
+        self.peak_bytes = self.bytes
+        self.removed_bytes = 0
+
+    def _update(self, path, size):
+        self.bytes += size - self.sizes[path]
+        self.sizes[path] = size
+
+    def finish(self, job):
+        # the inputs still existed while the outputs were written, e.g. the unfiltered and the filtered bitstream
+        for path in job.outputs:
+            self._update(path, get_path_size(path))
+        self.peak_bytes = max(self.peak_bytes, self.bytes)
+        for path in set(job.inputs):
+            if path not in self.sizes:
+                continue
+            self._update(path, get_path_size(path))  # some jobs remove their input files
+            if path not in self.consumers:
+                continue
+            self.consumers[path] -= 1
+            if self.consumers[path] == 0 and os.path.isfile(path):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    print "WARNING: can not remove intermediate file {}: {}".format(path, e)
+                    continue
+                self.removed_bytes += self.sizes[path]
+                self._update(path, 0)
+
+    def retry(self, job):
+        # the job is executed again and reads its inputs once more
+        for path in set(job.inputs):
+            if path in self.consumers:
+                self.consumers[path] += 1
+
+
+def read_meminfo():
+    """
+    :return: dict of the values of /proc/meminfo in bytes, empty if it does not exist (not Linux)
+    """
+    info = {}
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                fields = line.split()
+                info[fields[0].rstrip(':')] = int(fields[1]) * 1024
+    except (IOError, ValueError, IndexError):
+        return {}
+    return info
+
+
+def get_memory_pressure():
+    """
+    :return: share of the last 10 seconds in which some tasks stalled on memory in percent (PSI), None if the kernel
+             does not provide it
+    """
+    try:
+        with open('/proc/pressure/memory') as f:
+            for line in f:
+                if line.startswith('some '):
+                    return float(line.split()[1].split('=')[1])
+    except (IOError, ValueError, IndexError):
+        pass
+    return None
+
+
+def read_cpu_times():
+    """
+    :return: (idle jiffies of all cores, all jiffies of all cores, number of runnable tasks) from /proc/stat
+    """
+    idle = total = running = 0
+    with open('/proc/stat') as f:
+        for line in f:
+            fields = line.split()
+            if fields[0] == 'cpu':
+                times = [int(x) for x in fields[1:]]
+                idle = times[3] + times[4]  # idle and iowait
+                total = sum(times[:8])  # without guest times, which are part of user
+            elif fields[0] == 'procs_running':
+                running = int(fields[1])
+    return idle, total, running
+
+
+def get_group_rss(groups):
+    """
+    Sums up the resident memory of all processes of the given process groups (the jobs of execute_jobs).
+    :return: dict of process group -> bytes
+    """
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    rss = dict((group, 0) for group in groups)
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(os.path.join('/proc', name, 'stat')) as f:
+                # the fields after the command: state, ppid, pgrp, ..., rss is the 24th field of the file
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (IOError, IndexError):
+            continue  # exited in the meantime
+        group = int(fields[2])
+        if group in rss:
+            rss[group] += int(fields[21]) * page_size
+    return rss
+
+
+class ConcurrencyControl(object):
+    """
+    Adapts the number of cores execute_jobs uses to the memory and the CPU usage of the host (--AdaptiveThreads).
+    Every CONCURRENCY_INTERVAL seconds the runner stops waiting for its jobs (see next_sample) and samples the RSS of
+    the running jobs, the available memory, the memory pressure (PSI) and the idle cores:
+    - on memory pressure or if less than MEMORY_RESERVE of the memory is available, the limit is lowered by one
+    - if the CPU is oversubscribed by other processes, the limit is lowered by one
+    - if a core is idle, enough memory is available and jobs are waiting for the limit, it is raised by one
+    A job is only started if the peak RSS of its kind (from earlier runs and from the running jobs) fits into the
+    available memory, so the run pauses before the memory runs out. The limit which was used for the longest time
+    is written to path and is the start value of the next run.
+    """
+    def __init__(self, min_threads, max_threads, start_threads, path, max_rss=None):
+        self.min_threads = min_threads
+        self.max_threads = max_threads
+        self.path = path
+        self.limit = start_threads
+        try:
+            with open(path) as f:
+                self.limit = json.load(f)['threads']
+                print "Starting with {} parallel jobs like the last run ({})".format(self.limit, path)
+        except (IOError, ValueError, KeyError):
+            pass
+        self.limit = max(min_threads, min(max_threads, self.limit))
+        self.max_rss = dict(max_rss or {})  # kind of job -> peak RSS
+        self.cores = multiprocessing.cpu_count()
+        self.total_memory = read_meminfo().get('MemTotal', 0)
+        self.available = None  # bytes which can be used by new jobs, None if unknown
+        self.seconds = {}  # limit -> seconds in which it was used
+        self.last_time = time.time()
+        self.cpu_times = read_cpu_times()
+        self.peak_rss = 0  # of all running jobs together
+        self.next_sample = None  # time of the next sample
+        self.warned = False
+
+    @staticmethod
+    def is_supported():
+        return bool(read_meminfo()) and os.path.exists('/proc/stat')
+
+    def start(self):
+        self.sample({})
+
+    def stop(self):
+        self._count_time()
+
+    def _count_time(self):
+        now = time.time()
+        self.seconds[self.limit] = self.seconds.get(self.limit, 0.0) + now - self.last_time
+        self.last_time = now
+
+    def get_job_rss(self, job):
+        return self.max_rss.get(job.kind, 0)
+
+    def admits(self, job, running):
+        """
+        :return: True if the peak RSS of the job fits into the available memory. A job is always started if no
+                 other job is running, so the run can not get stuck.
+        """
+        if self.available is None or not job.local or self.get_job_rss(job) <= self.available:
+            return True
+        if not running:
+            if not self.warned:
+                print "WARNING: starting {} although only {:.0f} MB of memory are available".format(
+                    job.get_name(), self.available / 1e6)
+                self.warned = True
+            return True
+        return False
+
+    def add(self, job):
+        # the RSS of a new job is not sampled yet, its expected peak is reserved until the next sample
+        if self.available is not None and job.local:
+            self.available -= self.get_job_rss(job)
+
+    def finish(self, job, usage):
+        if job.local and usage and usage.get('max_rss'):
+            self.max_rss[job.kind] = max(self.max_rss.get(job.kind, 0), usage['max_rss'])
+
+    def sample(self, running, waiting=False):
+        """
+        Samples the host and the running jobs and adapts the limit. Called at next_sample.
+        :param running: dict of process group -> (job, process) of execute_jobs
+        :param waiting: True if ready jobs are waiting for the limit
+        """
+        self._count_time()
+        local = dict((pid, job) for pid, (job, p) in running.items() if job.local)
+        rss = get_group_rss(local.keys())
+        self.peak_rss = max(self.peak_rss, sum(rss.values()))
+        for pid, job in local.items():
+            self.max_rss[job.kind] = max(self.max_rss.get(job.kind, 0), rss[pid])
+        # the running jobs may still grow up to the peak RSS of their kind
+        growth = sum(max(self.get_job_rss(job) - rss[pid], 0) for pid, job in local.items())
+        reserve = self.total_memory * MEMORY_RESERVE
+        available = read_meminfo().get('MemAvailable')
+        self.available = max(available - growth - reserve, 0) if available is not None else None
+        pressure = get_memory_pressure()
+        idle, total, runnable = read_cpu_times()
+        last_idle, last_total, last_runnable = self.cpu_times
+        self.cpu_times = (idle, total, runnable)
+        idle_cores = float(idle - last_idle) / (total - last_total) * self.cores if total > last_total else 0.0
+        threads = sum(min(job.threads, self.limit) for job in local.values())
+
+        limit = self.limit
+        if available is not None and available < reserve:
+            limit, reason = self.limit - 1, "{:.0f} MB of memory available".format(available / 1e6)
+        elif pressure is not None and pressure > MEMORY_PRESSURE_LIMIT:
+            limit, reason = self.limit - 1, "memory pressure {:.1f}%".format(pressure)
+        elif idle_cores < 0.5 and runnable > self.cores + 1 and threads >= self.limit:
+            limit, reason = self.limit - 1, "{} runnable tasks on {} cores".format(runnable, self.cores)
+        elif waiting and idle_cores >= 0.9 and self.available:
+            limit, reason = self.limit + 1, "{:.1f} idle cores".format(idle_cores)
+        limit = max(self.min_threads, min(self.max_threads, limit))
+        if not limit == self.limit:
+            print "Parallel jobs: {} -> {} ({})".format(self.limit, limit, reason)
+            self.limit = limit
+        self.next_sample = time.time() + CONCURRENCY_INTERVAL
+
+    def get_settled_limit(self):
+        # the limit which was used for the longest time
+        return max(sorted(self.seconds.items()), key=lambda item: item[1])[0] if self.seconds else self.limit
+
+    def write(self):
+        record = {'threads': self.get_settled_limit(), 'min_threads': self.min_threads,
+                  'max_threads': self.max_threads, 'seconds': dict((str(limit), seconds) for limit, seconds in
+                                                                   self.seconds.items()),
+                  'peak_rss': self.peak_rss, 'max_rss': self.max_rss}
+        with open(self.path, 'w') as f:
+            json.dump(record, f, indent=1, sort_keys=True)
+
+
+def make_dirs_if_not_exist(dir_path):
+    if not os.path.exists(dir_path):
+        os.makedirs(dir_path)
+
+
+def print_message(msg):
+    print "\n" + "#" * 80
+    print "### " + str(msg)
+    print "#" * 80 + "\n"
+
+
+def execute_cmd(cmd_string):
+    ret_code = subprocess.call(cmd_string, shell=True)
+    if not ret_code == 0:
+        print "ERROR: something went wrong with: ", cmd_string
+        sys.exit(-1)
+
+
+def execute_cmds(cmds_string, num_threads=8):
+    return execute_jobs([cmd if isinstance(cmd, Job) else Job(cmd) for cmd in cmds_string], num_threads)
+
+
+def get_topological_order(jobs, dependents):
+    missing_deps = dict((job, len(job.deps)) for job in jobs)
+    order = [job for job in jobs if missing_deps[job] == 0]
+    for job in order:
+        for dependent in dependents[job]:
+            missing_deps[dependent] -= 1
+            if missing_deps[dependent] == 0:
+                order.append(dependent)
+    return order
+
+
+def get_remaining_costs(jobs, dependents):
+    """
+    Returns the estimated cost of each job plus the most expensive chain of jobs which depend on it.
+    """
+    remaining = {}
+    for job in reversed(get_topological_order(jobs, dependents)):
+        remaining[job] = job.cost + max([remaining[dependent] for dependent in dependents[job]] or [0.0])
+    return remaining
+
+
+def get_priorities(jobs, dependents):
+    """
+    Returns the priority of each job: the highest priority of the job itself and of all jobs which depend on it.
+    """
+    priorities = {}
+    for job in reversed(get_topological_order(jobs, dependents)):
+        priorities[job] = max([job.priority] + [priorities[dependent] for dependent in dependents[job]])
+    return priorities
+
+
+def make_pipe():
+    """
+    :return: (read end, write end) of a non-blocking pipe which is not inherited by executed programs
+    """
+    fds = os.pipe()
+    for fd in fds:
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+    return fds
+
+
+def write_pipe(fd):
+    try:
+        os.write(fd, 'x')
+    except OSError as e:
+        if e.errno != errno.EAGAIN:
+            raise
+        # the pipe is full, the reader wakes up anyway
+
+
+def drain_pipe(fd):
+    try:
+        while os.read(fd, 4096):
+            pass
+    except OSError as e:
+        if e.errno != errno.EAGAIN:
+            raise
+
+
+class ChildWatcher(object):
+    """
+    Wakes up execute_jobs when a child process exits: SIGCHLD writes a byte into a pipe (signal.set_wakeup_fd) and
+    wait sleeps in select on this pipe and the pipes of other event sources (e.g. the Coordinator). Has to be started
+    in the main thread.
+    """
+    def __init__(self):
+        self.pipe = None
+        self.handler = None
+        self.wakeup_fd = None
+
+    def start(self):
+        self.pipe = make_pipe()
+        self.handler = signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        # system calls of other threads (e.g. of the Coordinator) are restarted instead of failing with EINTR
+        signal.siginterrupt(signal.SIGCHLD, False)
+        self.wakeup_fd = signal.set_wakeup_fd(self.pipe[1])
+
+    def stop(self):
+        signal.set_wakeup_fd(self.wakeup_fd)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL if self.handler is None else self.handler)
+        for fd in self.pipe:
+            os.close(fd)
+        self.pipe = None
+
+    def wait(self, fds=(), timeout=None):
+        """
+        Blocks until a child process has exited, one of the pipes fds is readable or timeout seconds have passed. The
+        pipes are drained, so the caller has to look for exited child processes and new events after the call.
+        """
+        try:
+            readable = select.select([self.pipe[0]] + list(fds), [], [], timeout)[0]
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return
+        for fd in readable:
+            drain_pipe(fd)
+
+
+def get_exit_status(status, rusage):
+    """
+    :return: (returncode like subprocess.Popen, resource usage (see get_usage)) of a child process from os.wait4
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status), get_usage(rusage)
+    return os.WEXITSTATUS(status), get_usage(rusage)
+
+
+def wait_for_child(pid):
+    """
+    Blocks until the child process pid exits.
+    :return: (returncode, resource usage (see get_usage))
+    """
+    while True:
+        try:
+            child, status, rusage = os.wait4(pid, 0)
+        except OSError as e:
+            if e.errno != errno.EINTR:
+                raise
+            continue
+        return get_exit_status(status, rusage)
+
+
+def wait_for_jobs(watcher, running, coordinator=None, deadline=None):
+    """
+    Blocks until a job in running exits, a job of the coordinator has finished or the time deadline has passed.
+    Sleeps in select (see ChildWatcher) in between. Only the processes of the running jobs are reaped, other child
+    processes of the caller are left alone.
+    :param running: dict of pid -> (job, process) of execute_jobs
+    :return: (pid, returncode, resource usage (see get_usage)), pid is the negative job id for jobs of the coordinator,
+             None after the deadline
+    """
+    while True:
+        finished = coordinator.pop_finished() if coordinator else None
+        if finished:
+            job_id, returncode, usage = finished
+            return -job_id, returncode, usage
+        for pid, (job, p) in running.items():
+            if not job.local:
+                continue
+            child, status, rusage = os.wait4(pid, os.WNOHANG)
+            if child:
+                return (pid,) + get_exit_status(status, rusage)
+        timeout = None
+        if deadline is not None:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                return None
+        watcher.wait([coordinator.fileno()] if coordinator else [], timeout)
+
+
+def cancel_jobs(running):
+    """
+    Terminates the process groups of all running jobs and waits until they have exited. Jobs of the coordinator are
+    cancelled on their workers.
+    """
+    for pid, (job, p) in running.items():
+        if not job.local:
+            p.cancel()
+            continue
+        try:
+            os.killpg(pid, signal.SIGTERM)
+        except OSError:
+            pass
+    for pid, (job, p) in running.items():
+        try:
+            if job.local:
+                os.waitpid(pid, 0)
+        except OSError:
+            pass
+        p.returncode = -signal.SIGTERM
+        if job.on_exit:
+            job.on_exit(p.returncode)
+    running.clear()
+
+
+def execute_jobs(jobs, num_threads=8, cache=None, coordinator=None, stats=None, files=None, control=None):
+    """
+    Runs a graph of jobs on num_threads cores. A job is started as soon as all its deps have finished and enough
+    cores are free for its threads. Ready jobs with the highest priority (see get_priorities) and then with the
+    highest remaining cost (the job and the longest chain of jobs depending on it) are started first, so long jobs
+    don't end up running alone at the end.
+    The runner sleeps until a child process exits or a job of the coordinator has finished (see ChildWatcher),
+    execute_jobs has to be called in the main thread. On the first failure all running jobs are terminated, unless the
+    failed job has retry jobs: then these and the job are executed again (at most MAX_JOB_RETRIES times).
+    Finished jobs are recorded in the optional JobCache and their resource usage in the optional JobStats. The
+    optional IntermediateFiles removes the inputs which are not needed anymore after each successful job.
+    RemoteJobs are passed to their coordinator and don't use any of the num_threads cores.
+    With the optional ConcurrencyControl, its limit replaces num_threads and jobs are only started if their memory is
+    available.
+    :return: True if all jobs finished successfully
+    """
+    count = len(jobs)
+    n = 0
+    if count == 0:
+        return True
+    dependents = dict((job, []) for job in jobs)
+    missing_deps = {}
+    for job in jobs:
+        missing_deps[job] = len(job.deps)
+        for dep in job.deps:
+            dependents[dep].append(job)
+    remaining_costs = get_remaining_costs(jobs, dependents)
+    priorities = get_priorities(jobs, dependents)
+    order = dict((job, idx) for idx, job in enumerate(jobs))
+
+    ready = []
+    for job in jobs:
+        if missing_deps[job] == 0:
+            heapq.heappush(ready, (-priorities[job], -remaining_costs[job], order[job], job))
+    running = {}
+    started = set()
+    retries = {}  # job -> number of times it was executed again
+    used_threads = {}  # process group -> cores of the running job
+    watcher = ChildWatcher()
+    watcher.start()
+    if control:
+        control.start()
+    try:
+        while True:
+            limit = control.limit if control else num_threads
+            while ready:
+                job = ready[0][-1]
+                if missing_deps[job] > 0 or job in started:
+                    heapq.heappop(ready)  # one of its deps is executed again, the job is pushed again later
+                    continue
+                threads = min(job.threads, limit) if job.local else 0
+                if threads > limit - sum(used_threads.values()):
+                    break
+                if control and not control.admits(job, used_threads):
+                    break
+                heapq.heappop(ready)
+                started.add(job)
+                if job.on_start:
+                    job.on_start()
+                p = job.start()
+                running[p.pid] = (job, p)
+                if stats:
+                    stats.start(job)
+                if control:
+                    control.add(job)
+                used_threads[p.pid] = threads
+
+            if not running:
+                break
+            result = wait_for_jobs(watcher, running, coordinator, control.next_sample if control else None)
+            if result is None:
+                control.sample(running, bool(ready))
+                continue
+            pid, returncode, usage = result
+            job, p = running.pop(pid)
+            p.returncode = returncode
+            if stats:
+                stats.finish(job, returncode, usage)
+            if control:
+                control.finish(job, usage)
+            del used_threads[pid]
+            job_ok = True
+            if job.on_exit:
+                job_ok = job.on_exit(returncode) is not False
+            if returncode == 0 and job_ok:
+                if cache:
+                    cache.add(job)
+                if files:
+                    files.finish(job)
+                n += 1
+                print "{} jobs finished. Still to finish: {}".format(n, count-n)
+                for dependent in dependents[job]:
+                    missing_deps[dependent] -= 1
+                    if missing_deps[dependent] == 0:
+                        heapq.heappush(ready, (-priorities[dependent], -remaining_costs[dependent], order[dependent],
+                                               dependent))
+            elif job.retry and retries.get(job, 0) < MAX_JOB_RETRIES:
+                retries[job] = retries.get(job, 0) + 1
+                again = set([retry_job for retry_job in job.retry if retry_job in dependents] + [job])
+                print "WARNING: {} failed, executing it and {} jobs it depends on again".format(job.get_name(),
+                                                                                            len(again) - 1)
+                for retry_job in again:
+                    started.discard(retry_job)
+                    if retry_job is not job:
+                        # finished before, the dependents which were not started yet wait for it again
+                        n -= 1
+                        if files:
+                            files.retry(retry_job)
+                        for dependent in dependents[retry_job]:
+                            if dependent not in again and dependent not in started:
+                                missing_deps[dependent] += 1
+                    missing_deps[retry_job] = len([dep for dep in retry_job.deps if dep in again])
+                    if missing_deps[retry_job] == 0:
+                        heapq.heappush(ready, (-priorities[retry_job], -remaining_costs[retry_job], order[retry_job],
+                                               retry_job))
+            else:
+                print "ERROR: executing command: errorcode={}: {}".format(returncode, job)
+                if cache:
+                    # e.g. the encoder of a broken bitstream, it is executed again by the next run
+                    for retry_job in job.retry:
+                        cache.remove(retry_job)
+                print "Terminating {} running jobs".format(len(running))
+                cancel_jobs(running)
+                return False
+    except KeyboardInterrupt:
+        cancel_jobs(running)
+        raise
+    finally:
+        if control:
+            control.stop()
+        watcher.stop()
+    return n == count
+
+
+def simulate_jobs(jobs, num_threads):
+    """
+    Simulates execute_jobs with the estimated cost of each job as its run time.
+    :return: list of (start time, end time, job) in the order in which the jobs are started
+    """
+    dependents = dict((job, []) for job in jobs)
+    missing_deps = {}
+    for job in jobs:
+        missing_deps[job] = len(job.deps)
+        for dep in job.deps:
+            dependents[dep].append(job)
+    remaining_costs = get_remaining_costs(jobs, dependents)
+    priorities = get_priorities(jobs, dependents)
+    order = dict((job, idx) for idx, job in enumerate(jobs))
+    ready = [(-priorities[job], -remaining_costs[job], order[job], job) for job in jobs if missing_deps[job] == 0]
+    heapq.heapify(ready)
+    running = []  # heap of (end time, order, job)
+    schedule = []
+    free_threads = num_threads
+    now = 0.0
+    while ready or running:
+        while ready:
+            job = ready[0][-1]
+            threads = min(job.threads, num_threads) if job.local else 0
+            if threads > free_threads:
+                break
+            heapq.heappop(ready)
+            heapq.heappush(running, (now + job.cost, order[job], job))
+            schedule.append((now, now + job.cost, job))
+            free_threads -= threads
+        now, idx, job = heapq.heappop(running)
+        free_threads += min(job.threads, num_threads) if job.local else 0
+        for dependent in dependents[job]:
+            missing_deps[dependent] -= 1
+            if missing_deps[dependent] == 0:
+                heapq.heappush(ready, (-priorities[dependent], -remaining_costs[dependent], order[dependent],
+                                       dependent))
+    return schedule
+
+
+def estimate_job_cost(kind, pixels, frames, qp=None):
+    """
+    Estimates the run time of a job in seconds from the JOB_THROUGHPUT table.
+    """
+    cost = float(pixels) * frames / JOB_THROUGHPUT[kind]
+    if qp is not None:
+        # lower QPs produce more bits and take longer to encode
+        cost *= 2 ** ((32 - qp) / 12.0)
+    return cost
+
+
+def estimate_bitstream_bytes(pixels, frames, qp):
+    """
+    Roughly estimates the size of an encoded tile (--Plan). The bitrate doubles with every 6 QP steps.
+    """
+    return int(ENCODED_BYTES_PER_PIXEL * pixels * frames * 2 ** ((32 - qp) / 6.0))
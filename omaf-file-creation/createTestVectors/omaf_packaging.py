@@ -0,0 +1,827 @@
+"""
+This module is a part of The Fraunhofer OMAF Javascript Player implementation.
+(c) Copyright  1995 - 2019 Fraunhofer-Gesellschaft zur Foerderung der angewandten Forschung e.V. All rights reserved.
+
+Please see [LICENSE.txt](../LICENSE.txt) file for the terms of use of the contents of this repository.
+
+It contains the HEVC bitstream handling and the OMAF packaging of create_omaf_files.py: NAL unit parsing and filtering,
+the packager command and the live packaging (--LivePackaging).
+"""
+
+import os
+import time
+import shutil
+import re
+import mmap
+import array
+import struct
+import errno
+import fcntl
+import threading
+import json
+import subprocess
+
+from omaf_jobs import Job, PIPE_READ_SIZE, make_dirs_if_not_exist
+
+__author__ = "Dimitri Podborski"
+__version__ = "0.2"
+__maintainer__ = "Dimitri Podborski"
+__email__ = "dimitri.podborski@hhi.fraunhofer.de"
+__status__ = "Development"
+
+
+NalUnitType = ['TRAIL_N',
+  'TRAIL_R',
+  'TSA_N',
+  'TLA_R',
+  'STSA_N',
+  'STSA_R',
+  'RADL_N',
+  'RADL_R',
+  'RASL_N',
+  'RASL_R',
+  'RSV_VCL_N10',
+  'RSV_VCL_R11',
+  'RSV_VCL_N12',
+  'RSV_VCL_R13',
+  'RSV_VCL_N14',
+  'RSV_VCL_R15',
+  'BLA_W_LP',
+  'BLA_W_RADL',
+  'BLA_N_LP',
+  'IDR_W_RADL',
+  'IDR_N_LP',
+  'CRA_NUT',
+  'RSV_IRAP_VCL22',
+  'RSV_IRAP_VCL23',
+  'RSV_VCL24',
+  'RSV_VCL25',
+  'RSV_VCL26',
+  'RSV_VCL27',
+  'RSV_VCL28',
+  'RSV_VCL29',
+  'RSV_VCL30',
+  'RSV_VCL31',
+  'VPS_NUT',
+  'SPS_NUT',
+  'PPS_NUT',
+  'AUD_NUT',
+  'EOS_NUT',
+  'EOB_NUT',
+  'FD_NUT',
+  'PREFIX_SEI_NUT',
+  'SUFFIX_SEI_NUT',
+  'RSV_NVCL41',
+  'RSV_NVCL42',
+  'RSV_NVCL43',
+  'RSV_NVCL44',
+  'RSV_NVCL45',
+  'RSV_NVCL46',
+  'RSV_NVCL47',
+  'UNSPEC48',
+  'UNSPEC49',
+  'UNSPEC50',
+  'UNSPEC51',
+  'UNSPEC52',
+  'UNSPEC53',
+  'UNSPEC54',
+  'UNSPEC55',
+  'UNSPEC56',
+  'UNSPEC57',
+  'UNSPEC58',
+  'UNSPEC59',
+  'UNSPEC60',
+  'UNSPEC61',
+  'UNSPEC62',
+  'UNSPEC63',
+  'INVALID']
+
+
+START_CODE = '\x00\x00\x01'
+
+
+# segment duration of hevc2omaf in frames (default of its --segmentSize)
+PACKAGER_SEGMENT_FRAMES = 9
+
+
+class NalUnitTable(object):
+    """
+    Compact list of NAL units found in an Annex-B byte stream. Each field is kept in its own typed array instead of
+    using one dict per NAL unit.
+    """
+    def __init__(self):
+        self.offsets = array.array('L')
+        self.au_starts = array.array('B')
+        self.types = array.array('B')
+        self.layer_ids = array.array('B')
+        self.temp_ids = array.array('b')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, idx):
+        return {'offset': self.offsets[idx], 'auStart': bool(self.au_starts[idx]), 'type': self.types[idx],
+                'layerID': self.layer_ids[idx], 'tempID': self.temp_ids[idx]}
+
+    def append(self, buf, pos):
+        """
+        Adds the NAL unit whose 3 byte start code begins at pos in buf.
+        A leading zero byte (4 byte start code) is counted to the NAL unit and marks the start of an access unit.
+        """
+        if buf[pos - 1] == '\x00':
+            self.offsets.append(pos - 1)
+            self.au_starts.append(1)
+        else:
+            self.offsets.append(pos)
+            self.au_starts.append(0)
+        h1 = ord(buf[pos + 3])
+        h2 = ord(buf[pos + 4])
+        self.types.append((h1 & 0x7E) >> 1)
+        self.layer_ids.append(((h1 & 0x01) << 5) + ((h2 & 0xF8) >> 3))
+        self.temp_ids.append((h2 & 0x07) - 1)
+
+
+class BitrateIndex(object):
+    """
+    Sizes of the access units of a bitstream, which are summed up per segment of segment_frames frames. The NAL
+    units are added while the bitstream is filtered, the index is written as JSON to path.
+    """
+    # NAL unit types which start a new access unit if they follow a slice (7.4.2.4.4 of the HEVC spec)
+    AU_START_TYPES = frozenset(range(NalUnitType.index('VPS_NUT'), NalUnitType.index('AUD_NUT') + 1) +
+                               [NalUnitType.index('PREFIX_SEI_NUT')] + range(41, 45) + range(48, 56))
+
+    def __init__(self, path, fps, segment_frames):
+        self.path = path
+        self.fps = fps
+        self.segment_frames = segment_frames
+        self.au_bytes = array.array('L')
+        self.au_has_slice = False
+
+    def __repr__(self):
+        # part of the command of filter jobs and thereby of their cache key
+        return "BitrateIndex({}, {}, {})".format(self.path, self.fps, self.segment_frames)
+
+    def add_nal_unit(self, nal_type, first_slice, size):
+        """
+        :param first_slice: first_slice_segment_in_pic_flag of a slice
+        :param size: bytes of the NAL unit including the start code
+        """
+        is_slice = nal_type < NalUnitType.index('VPS_NUT')
+        if self.au_has_slice and ((is_slice and first_slice) or nal_type in self.AU_START_TYPES):
+            self.au_bytes.append(0)
+            self.au_has_slice = False
+        if not self.au_bytes:
+            self.au_bytes.append(0)
+        self.au_bytes[-1] += size
+        self.au_has_slice = self.au_has_slice or is_slice
+
+    def add_nal_units(self, nalus, buf, max_type=None):
+        """
+        Adds all NAL units of a NalUnitTable of buf whose type is not above max_type. If max_type is given, the
+        NAL units are sized like in the filtered bitstream, whose last byte is cut (see find_filtered_nalu_offsets).
+        """
+        stream_end = len(buf) if max_type is None else len(buf) - 1
+        for idx in range(len(nalus)):
+            if max_type is not None and nalus.types[idx] > max_type:
+                continue
+            begin = nalus.offsets[idx]
+            end = nalus.offsets[idx + 1] if idx < len(nalus) - 1 else stream_end
+            # the slice header starts after the start code and the 2 byte NAL unit header
+            first_slice = ord(buf[begin + 3 + nalus.au_starts[idx] + 2]) & 0x80
+            self.add_nal_unit(nalus.types[idx], first_slice, end - begin)
+
+    def write(self):
+        frames = len(self.au_bytes)
+        segment_bytes = [sum(self.au_bytes[first:first + self.segment_frames])
+                         for first in range(0, frames, self.segment_frames)]
+        # bits per second of each segment, the last segment may be shorter
+        segment_bitrates = [size * 8 * self.fps / min(self.segment_frames, frames - k * self.segment_frames)
+                            for k, size in enumerate(segment_bytes)]
+        index = {
+            'fps': self.fps,
+            'frames': frames,
+            'segment_frames': self.segment_frames,
+            'bytes': sum(segment_bytes),
+            'bitrate': sum(segment_bytes) * 8 * self.fps / frames if frames else 0,
+            'peak_bitrate': max(segment_bitrates) if segment_bitrates else 0,
+            'segment_bytes': segment_bytes,
+            'au_bytes': self.au_bytes.tolist(),
+        }
+        with open(self.path, 'w') as f:
+            json.dump(index, f, sort_keys=True, separators=(',', ':'))
+
+
+class NalStreamFilter(object):
+    """
+    Filters an Annex-B byte stream while it is received. Produces exactly the same output as
+    find_filtered_nalu_offsets and write_file_from_offsets do on the complete stream. The kept NAL units are added
+    to index (a BitrateIndex) if it is given.
+    """
+    def __init__(self, out_file, index=None):
+        self.out_file = out_file
+        self.index = index
+        self.nalu_cnt = 0
+        self.buf = ''
+        self.base = 0  # stream offset of buf[0]
+        self.search_pos = 1  # stream offset where the search for the next start code continues
+        self.write_pos = 0  # stream offset of the first byte of the current NAL unit which was not written yet
+        self.keep = False  # current NAL unit shall be written
+        self.nal_begin = 0  # stream offset, type and first_slice_segment_in_pic_flag of the current NAL unit
+        self.nal_type = 0
+        self.first_slice = 0
+
+    def write(self, data):
+        self.buf += data
+        end = self.base + len(self.buf)
+        max_type = NalUnitType.index('PPS_NUT')
+        while True:
+            pos = self.buf.find(START_CODE, self.search_pos - self.base)
+            if pos < 0:
+                self.search_pos = max(self.search_pos, end - 2)
+                break
+            pos += self.base
+            if pos + 6 > end:
+                self.search_pos = pos  # wait until the NAL unit header is complete
+                break
+            begin = pos - 1 if self.buf[pos - 1 - self.base] == '\x00' else pos
+            if self.keep:
+                self._flush(begin)
+                if self.index:
+                    self.index.add_nal_unit(self.nal_type, self.first_slice, begin - self.nal_begin)
+            self.nal_type = (ord(self.buf[pos + 3 - self.base]) & 0x7E) >> 1
+            self.first_slice = ord(self.buf[pos + 5 - self.base]) & 0x80
+            self.keep = self.nal_type <= max_type
+            self.nal_begin = begin
+            self.write_pos = begin
+            self.search_pos = pos + 3
+            self.nalu_cnt += 1
+
+        # bytes in front of search_pos - 1 can not be part of a following NAL unit anymore
+        safe_pos = self.search_pos - 1
+        if self.keep:
+            self._flush(safe_pos)
+        self.buf = self.buf[safe_pos - self.base:]
+        self.base = safe_pos
+
+    def close(self):
+        # the last NAL unit is cut one byte before the end of the stream, same as in write_file_from_offsets
+        if self.keep:
+            self._flush(self.base + len(self.buf) - 1)
+            if self.index:
+                self.index.add_nal_unit(self.nal_type, self.first_slice, self.base + len(self.buf) - 1 - self.nal_begin)
+        self.buf = ''
+
+    def _flush(self, end):
+        if end > self.write_pos:
+            self.out_file.write(self.buf[self.write_pos - self.base:end - self.base])
+            self.write_pos = end
+
+
+class NalFilterReader(threading.Thread):
+    """
+    Reads the bitstream of an encoder from a named pipe and writes the filtered bitstream to output_path. If index
+    (a BitrateIndex) is given, it is written as well.
+    """
+    def __init__(self, fifo_path, output_path, index=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.fifo_path = fifo_path
+        self.output_path = output_path
+        self.index = index
+        self.nalu_cnt = 0
+        self.error = None
+
+    def run(self):
+        try:
+            with open(self.fifo_path, mode='rb') as pipe, open(self.output_path, mode='wb') as out:
+                nal_filter = NalStreamFilter(out, self.index)
+                while True:
+                    data = pipe.read(PIPE_READ_SIZE)
+                    if not data:
+                        break
+                    nal_filter.write(data)
+                nal_filter.close()
+                self.nalu_cnt = nal_filter.nalu_cnt
+            if self.index and self.nalu_cnt > 0:
+                self.index.write()
+        except (IOError, OSError) as e:
+            self.error = e
+
+    def stop(self):
+        """
+        Waits until the bitstream is completely filtered and removes the named pipe. If the encoder exited without
+        opening the pipe, the reader is released by opening and closing the write end.
+        """
+        while self.is_alive():
+            try:
+                os.close(os.open(self.fifo_path, os.O_WRONLY | os.O_NONBLOCK))
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+            self.join(0.05)
+        os.remove(self.fifo_path)
+        if self.error:
+            print "ERROR: filtering {} failed: {}".format(self.output_path, self.error)
+            return False
+        if self.nalu_cnt < 1:
+            print 'WARN: no nal units could be found in', self.output_path
+            os.remove(self.output_path)
+        return True
+
+
+def open_fifo_for_writing(fifo_path, process):
+    """
+    Opens a named pipe for writing as soon as process has opened it for reading.
+    :return: file object or None if the process exited before it opened the pipe
+    """
+    while True:
+        try:
+            fd = os.open(fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+            break
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+            if process.poll() is not None:
+                return None
+            time.sleep(0.05)
+    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) & ~os.O_NONBLOCK)
+    return os.fdopen(fd, 'wb')
+
+
+def open_fifo_for_reading(fifo_path, process):
+    """
+    Opens a named pipe for reading. If process exits without opening the pipe for writing, the blocking open is
+    released by opening and closing the write end. The returned pipe is at EOF in this case.
+    """
+    opened = threading.Event()
+
+    def release():
+        while not opened.is_set():
+            if process.poll() is not None:
+                try:
+                    os.close(os.open(fifo_path, os.O_WRONLY | os.O_NONBLOCK))
+                except OSError:
+                    pass  # open() of the read end was not called yet
+            opened.wait(0.05)
+
+    watcher = threading.Thread(target=release)
+    watcher.daemon = True
+    watcher.start()
+    pipe = open(fifo_path, mode='rb')
+    opened.set()
+    watcher.join()
+    return pipe
+
+
+def create_inline_filter_job(cmd, fifo_path, output_path, index=None):
+    """
+    Creates a job for an encoder command which writes its bitstream to fifo_path. The bitstream is filtered while it
+    is written and only the filtered file (and the BitrateIndex if given) is stored in output_path.
+    """
+    readers = []
+
+    def start_reader():
+        if os.path.exists(fifo_path):
+            os.remove(fifo_path)
+        os.mkfifo(fifo_path)
+        # a new reader and index for every execution, the job may be executed again (see Job.retry)
+        readers.append(NalFilterReader(fifo_path, output_path, index and BitrateIndex(index.path, index.fps,
+                                                                                      index.segment_frames)))
+        readers[-1].start()
+
+    return Job(cmd, on_start=start_reader, on_exit=lambda returncode: readers[-1].stop())
+
+
+def get_nal_units(buf):
+    """
+    Finds all NAL units in an Annex-B byte stream. The start codes are located with the bulk search of str/mmap
+    objects instead of looking at every single byte in python.
+    :param buf: str or mmap object with the HEVC bitstream
+    :return: NalUnitTable
+    """
+    nalus = NalUnitTable()
+    last_pos = len(buf) - 6  # the header of the NAL unit has to fit into the buffer
+    pos = buf.find(START_CODE, 1)
+    while 0 <= pos <= last_pos:
+        nalus.append(buf, pos)
+        pos = buf.find(START_CODE, pos + 3)
+    return nalus
+
+
+def find_filtered_nalu_offsets(nalus):
+    """
+    Returns [begin, end] ranges of all NAL units which shall be kept. Ranges of consecutive NAL units are merged.
+    The end of the last NAL unit is -1 (the last byte of the stream is not copied).
+    """
+    offsets = list()
+    nalu_cnt = len(nalus)
+    max_type = NalUnitType.index('PPS_NUT')
+    for idx in range(nalu_cnt):
+        if nalus.types[idx] > max_type:
+            continue  # skip all non picture NALs (but don't touch param sets)
+        begin = nalus.offsets[idx]
+        if idx < nalu_cnt - 1:
+            end = nalus.offsets[idx + 1]
+        else:
+            end = -1
+        if offsets and offsets[-1][1] == begin:
+            offsets[-1][1] = end
+        else:
+            offsets.append([begin, end])
+
+    return offsets
+
+
+def write_file_from_offsets(filename, buf, split_offsets):
+    """
+    Writes the provided ranges of buf to filename. Ranges are passed to write() as buffer views to avoid copies.
+    """
+    buf_len = len(buf)
+    with open(filename, mode='wb') as file:
+        for begin, end in split_offsets:
+            if end < 0:
+                end += buf_len
+            if end > begin:
+                file.write(buffer(buf, begin, end - begin))
+
+
+def map_file(file_path):
+    """
+    Maps the file read-only into memory. Returns None for empty files since those can not be mapped.
+    """
+    with open(file_path, mode='rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def normalize_param_set(nal):
+    # without start code and trailing zero bytes
+    return nal[nal.find(START_CODE) + len(START_CODE):].rstrip('\x00')
+
+
+def concat_bitstreams(input_paths, output_path, remove_inputs=False, filter_nals=False):
+    """
+    Concatenates the bitstreams of consecutive chunks which each start with a closed GOP. VPS, SPS and PPS in
+    front of the first picture of a chunk are dropped if the same parameter sets were already written. With
+    filter_nals all non picture NAL units except the parameter sets are dropped as well (see filter_nalu_file).
+    :return: True on success
+    """
+    param_sets = set()
+    with open(output_path, mode='wb') as out:
+        for input_path in input_paths:
+            buf = map_file(input_path)
+            nalus = get_nal_units(buf) if buf else []
+            if len(nalus) < 1:
+                print 'WARN: no nal units could be found in', input_path
+                if buf:
+                    buf.close()
+                return False
+            ends = list(nalus.offsets[1:]) + [len(buf)]
+            out.write(buf[:nalus.offsets[0]])
+            leading = True
+            for idx in range(len(nalus)):
+                begin = nalus.offsets[idx]
+                nal_type = nalus.types[idx]
+                if filter_nals and nal_type > NalUnitType.index('PPS_NUT'):
+                    continue
+                if nal_type < NalUnitType.index('VPS_NUT'):
+                    leading = False
+                elif leading and nal_type <= NalUnitType.index('PPS_NUT'):
+                    param_set = normalize_param_set(buf[begin:ends[idx]])
+                    if param_set in param_sets:
+                        continue
+                    param_sets.add(param_set)
+                out.write(buffer(buf, begin, ends[idx] - begin))
+            buf.close()
+    if remove_inputs:
+        for input_path in input_paths:
+            os.remove(input_path)
+    return True
+
+
+def get_step5_cmd(mode, bin_dir, input_dir, output_dir, qps, frame_cnt, fps, file_prefix, guardband_size,
+                  segment_frames=PACKAGER_SEGMENT_FRAMES):
+    cmd = os.path.join(bin_dir, 'hevc2omaf')
+    if not os.path.exists(cmd):
+        print "\"{}\" not found".format(cmd)
+        return None
+    cmd += " --mode {} --inputDir {} --outputDir {} --QP {} --duration {} --fps {} --inputFilePrefix {}" \
+           " --guardbands {}".format(mode, input_dir, output_dir, ' '.join(str(q) for q in qps), frame_cnt, fps,
+                                     file_prefix, guardband_size)
+    if not segment_frames == PACKAGER_SEGMENT_FRAMES:
+        cmd += " --segmentSize {}".format(segment_frames)
+    return cmd
+
+
+def get_live_windows(chunks, segment_frames, duration):
+    """
+    Returns the packaging windows of --LivePackaging as (first chunk, number of chunks, first frame, number of
+    frames). A window starts where the previous window ended and ends after the next chunk which ends on a segment
+    boundary, so each window only contains its own segments. Frames from the end of the last window up to the full
+    duration are published by the last job, which packages the whole bitstreams.
+    """
+    windows = []
+    first_chunk = first_frame = 0
+    for k, (first, count) in enumerate(chunks):
+        end = first + count
+        if end % segment_frames == 0 and first_frame < end < duration:
+            windows.append((first_chunk, k + 1 - first_chunk, first_frame, end - first_frame))
+            first_chunk, first_frame = k + 1, end
+    return windows
+
+
+def get_boxes(buf, start=0, end=None):
+    """
+    Yields (type, offset of the payload, end) of the ISOBMFF boxes in buf[start:end].
+    """
+    end = len(buf) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack('>I4s', buf[pos:pos + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', buf[pos + 8:pos + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            return
+        yield box_type, pos + header, pos + size
+        pos += size
+
+
+def shift_fragments(buf, sequence_offset, time_offset):
+    """
+    Adds sequence_offset to the sequence numbers (mfhd) and time_offset to the decode times (tfdt) of all movie
+    fragments of a media segment (bytearray, changed in place).
+    """
+    for box_type, payload, end in get_boxes(buf):
+        if not box_type == 'moof':
+            continue
+        for child_type, child, child_end in get_boxes(buf, payload, end):
+            if child_type == 'mfhd':
+                number = struct.unpack_from('>I', buf, child + 4)[0]
+                struct.pack_into('>I', buf, child + 4, number + sequence_offset)
+            elif child_type == 'traf':
+                for traf_type, traf_child, traf_end in get_boxes(buf, child, child_end):
+                    if traf_type == 'tfdt':
+                        fmt = '>Q' if buf[traf_child] == 1 else '>I'
+                        time = struct.unpack_from(fmt, buf, traf_child + 4)[0]
+                        struct.pack_into(fmt, buf, traf_child + 4, time + time_offset)
+
+
+def scale_fragment_duration(buf, num, den):
+    """
+    Scales the duration of all movie fragments (mehd) of an initialization segment (bytearray, changed in place) by
+    num / den.
+    """
+    for box_type, payload, end in get_boxes(buf):
+        if not box_type == 'moov':
+            continue
+        for child_type, child, child_end in get_boxes(buf, payload, end):
+            if not child_type == 'mvex':
+                continue
+            for mvex_type, mvex_child, mvex_end in get_boxes(buf, child, child_end):
+                if mvex_type == 'mehd':
+                    fmt = '>Q' if buf[mvex_child] == 1 else '>I'
+                    duration = struct.unpack_from(fmt, buf, mvex_child + 4)[0]
+                    struct.pack_into(fmt, buf, mvex_child + 4, duration * num / den)
+
+
+def scale_mpd_duration(mpd, num, den):
+    """
+    Scales the media presentation duration and the period duration (PT<seconds>S) of an MPD by num / den.
+    """
+    def scale(match):
+        seconds = float(match.group(2)) * num / den
+        return '{}"PT{}S"'.format(match.group(1), ('%.3f' % seconds).rstrip('0').rstrip('.'))
+    return re.sub(r'((?:mediaPresentationDuration|<Period duration)=)"PT([0-9.]+)S"', scale, mpd)
+
+
+def get_live_segment_number(path):
+    """
+    :return: number of a media segment of the live profile of hevc2omaf (e.g. live/qp32/Track_1_Seg_3.mp4) or None
+    """
+    match = re.search(r'_Seg_(\d+)\.mp4$', path)
+    return int(match.group(1)) if match else None
+
+
+def get_fragments(buf):
+    """
+    :return: list of (sequence number, decode time of the first track fragment or None) of the movie fragments of a
+    media segment
+    """
+    fragments = []
+    for box_type, payload, end in get_boxes(buf):
+        if not box_type == 'moof':
+            continue
+        sequence = time = None
+        for child_type, child, child_end in get_boxes(buf, payload, end):
+            if child_type == 'mfhd':
+                sequence = struct.unpack_from('>I', buf, child + 4)[0]
+            elif child_type == 'traf' and time is None:
+                for traf_type, traf_child, traf_end in get_boxes(buf, child, child_end):
+                    if traf_type == 'tfdt':
+                        time = struct.unpack_from('>Q' if buf[traf_child] == 1 else '>I', buf, traf_child + 4)[0]
+        fragments.append((sequence, time))
+    return fragments
+
+
+def check_live_window(mpds, segments):
+    """
+    Checks that the live profile of a --LivePackaging window has the structure which merge_live_window expects from
+    hevc2omaf (reference/hevc2omaf_live.tar.gz): every SegmentTemplate of the MPDs has the same duration, starts
+    with number 1 and names its media segments <track>_Seg_$Number$.mp4, every track has the segments 1..n, the
+    fragments of all tracks of segment k are numbered after each other following the fragments of segment k - 1 and
+    segment k starts at (k - 1) * duration.
+    :param mpds: dict of MPD path: MPD
+    :param segments: dict of segment path: segment (bytearray)
+    :return: (segment duration, number of fragments of one segment of all tracks)
+    :raise ValueError: if the window does not have this structure
+    """
+    durations = set()
+    for path, mpd in mpds.items():
+        for template in re.findall(r'<SegmentTemplate [^>]*>', mpd):
+            attributes = dict(re.findall(r'(\w+)="([^"]*)"', template))
+            if not attributes.get('media', '').endswith('_Seg_$Number$.mp4') or \
+                    not attributes.get('startNumber', '1') == '1' or not attributes.get('duration', '').isdigit():
+                raise ValueError("{}: unexpected {}, expected a duration, startNumber 1 and media segments "
+                                 "*_Seg_$Number$.mp4".format(path, template))
+            durations.add(int(attributes['duration']))
+    if not len(durations) == 1:
+        raise ValueError("no common segment duration in {}: {}".format(', '.join(sorted(mpds)), sorted(durations)))
+    duration = durations.pop()
+    tracks = {}
+    for path in segments:
+        tracks.setdefault(re.sub(r'_Seg_\d+\.mp4$', '', path), []).append(get_live_segment_number(path))
+    for track, track_numbers in sorted(tracks.items()):
+        if not sorted(track_numbers) == range(1, len(segments) / len(tracks) + 1):
+            raise ValueError("{}: segments {}, expected 1-{} like the other tracks".format(
+                track, sorted(track_numbers), len(segments) / len(tracks)))
+    fragments = {}
+    for path, buf in segments.items():
+        number = get_live_segment_number(path)
+        for sequence, time in get_fragments(buf):
+            if not time == (number - 1) * duration:
+                raise ValueError("{}: fragment {} starts at {}, expected {}".format(path, sequence, time,
+                                                                                   (number - 1) * duration))
+            fragments.setdefault(number, []).append(sequence)
+    if not fragments.get(1):
+        raise ValueError("the segments 1 have no movie fragments")
+    count = len(fragments[1])
+    first = min(fragments[1])
+    for number, sequences in fragments.items():
+        expected = range(first + (number - 1) * count, first + number * count)
+        if not sorted(sequences) == expected:
+            raise ValueError("the {} fragments of segment {} are not numbered {}-{}: missing {}, unexpected {}".format(
+                len(sequences), number, expected[0], expected[-1], sorted(set(expected) - set(sequences)),
+                sorted(set(n for n in sequences if n not in expected or sequences.count(n) > 1))))
+    return duration, count
+
+
+def merge_live_window(output_dir, window):
+    """
+    Moves the live profile of a --LivePackaging window from output_dir into omaf_dir. The packager numbers the
+    segments of the window from 1 and starts them at time 0; they are renamed to follow the published segments and
+    their fragments are shifted by the published fragments and the duration of the published segments (SegmentTemplate
+    duration of the MPD, which has the timescale of the tracks). The initialization segments and the MPD get the
+    duration of all published frames. The vod and local files of the window are not published.
+    The structure of the segments is checked first (check_live_window), nothing is changed if it differs.
+    :param window: (number of published segments, number of published frames, number of frames of the window)
+    :return: list of (path in output_dir, path in the omaf directory) in the order in which they have to be moved
+    :raise ValueError: if the MPDs or the segments do not have the structure of hevc2omaf
+    """
+    segments, frames, window_frames = window
+    mpds = {}
+    init_paths = []
+    segment_bufs = {}
+    for root, dirs, files in os.walk(output_dir):
+        for name in files:
+            path = os.path.relpath(os.path.join(root, name), output_dir)
+            if name.endswith('_live.mpd'):
+                with open(os.path.join(output_dir, path)) as f:
+                    mpds[path] = f.read()
+            elif not path.startswith(os.path.join('dash', 'live') + os.sep):
+                continue
+            elif get_live_segment_number(path) is None:
+                init_paths.append(path)
+            else:
+                with open(os.path.join(output_dir, path), 'rb') as f:
+                    segment_bufs[path] = bytearray(f.read())
+    if not mpds or not segment_bufs:
+        raise ValueError("no live MPD or no live segments")
+    segment_duration, fragments = check_live_window(mpds, segment_bufs)
+    moves = []
+    for path, buf in sorted(segment_bufs.items()):
+        shift_fragments(buf, segments * fragments, segments * segment_duration)
+        with open(os.path.join(output_dir, path), 'wb') as f:
+            f.write(buf)
+        number = get_live_segment_number(path)
+        moves.append((path, re.sub(r'_Seg_\d+\.mp4$', '_Seg_{}.mp4'.format(number + segments), path)))
+    for path in init_paths:
+        with open(os.path.join(output_dir, path), 'rb') as f:
+            buf = bytearray(f.read())
+        scale_fragment_duration(buf, frames + window_frames, window_frames)
+        with open(os.path.join(output_dir, path), 'wb') as f:
+            f.write(buf)
+        moves.append((path, path))
+    for path, mpd in sorted(mpds.items()):
+        with open(os.path.join(output_dir, path), 'w') as f:
+            f.write(scale_mpd_duration(mpd, frames + window_frames, window_frames))
+        moves.append((path, path))
+    return moves
+
+
+def package_segments(cmd, package_dir, omaf_dir, bitstreams=(), filter_nals=False, window=None):
+    """
+    Runs the packager command cmd, which writes into package_dir/omaf, and moves its files into omaf_dir
+    (--LivePackaging). Each file is replaced with a single rename and the MPDs are moved last, so a player which
+    reads omaf_dir in the meantime only finds MPDs whose segments exist.
+    :param bitstreams: list of (chunk paths, output path), the chunks are concatenated to the input bitstreams of
+    the packager before it is started (see concat_bitstreams)
+    :param window: the packager only packaged a window of frames after the published ones, see merge_live_window
+    :return: True on success
+    """
+    for chunk_paths, output_path in bitstreams:
+        make_dirs_if_not_exist(os.path.dirname(output_path))
+        if not concat_bitstreams(chunk_paths, output_path, filter_nals=filter_nals):
+            return False
+        if window:
+            # hevc2omaf adds bytes behind the end of the file to the last picture unless another NAL unit follows,
+            # the live benchmark compares a window packaged like this with the packaging of the whole bitstreams
+            with open(output_path, mode='ab') as out:
+                out.write(START_CODE + chr(NalUnitType.index('EOB_NUT') << 1) + '\x01')
+    output_dir = os.path.join(package_dir, 'omaf')
+    make_dirs_if_not_exist(output_dir)
+    if not subprocess.call(cmd, shell=True) == 0:
+        print "Error: packaging failed: {}".format(cmd)
+        return False
+    if window:
+        try:
+            moves = merge_live_window(output_dir, window)
+        except (IOError, ValueError) as e:
+            print "Error: merging the segments of {} failed: {}".format(output_dir, e)
+            return False
+    else:
+        paths = []
+        for root, dirs, files in os.walk(output_dir):
+            paths += [os.path.relpath(os.path.join(root, name), output_dir) for name in files]
+        # the segments of the windows are replaced as well
+        moves = [(path, path) for path in sorted(paths, key=lambda p: p.endswith('.mpd'))]
+    for path, omaf_path in moves:
+        make_dirs_if_not_exist(os.path.dirname(os.path.join(omaf_dir, omaf_path)))
+        os.rename(os.path.join(output_dir, path), os.path.join(omaf_dir, omaf_path))
+    shutil.rmtree(package_dir)
+    try:
+        os.removedirs(os.path.dirname(package_dir))
+    except OSError:
+        pass  # other sequences are packaged at the same time
+    return True
+
+
+def filter_nalu_file(input_path, output_path, remove_input=False, index=None):
+    """
+    Writes the bitstream from input_path without non picture NAL units (parameter sets are kept) to output_path.
+    The kept NAL units are added to index (a BitrateIndex) which is written as well.
+    :return: False if no NAL units were found
+    """
+    buf = map_file(input_path)
+    nalus = get_nal_units(buf) if buf else []
+    if len(nalus) < 1:
+        print 'WARN: no nal units could be found in', input_path
+        if buf:
+            buf.close()
+        return False
+    filter_offsets = find_filtered_nalu_offsets(nalus)
+    write_file_from_offsets(output_path, buf, filter_offsets)
+    if index:
+        index.add_nal_units(nalus, buf, NalUnitType.index('PPS_NUT'))
+        index.write()
+    buf.close()
+    if remove_input:
+        os.remove(input_path)
+    return True
+
+
+def index_bitstream(input_path, index):
+    """
+    Adds all NAL units of the bitstream in input_path to index (a BitrateIndex) and writes it. Used for bitstreams
+    which are not filtered.
+    :return: False if no NAL units were found
+    """
+    buf = map_file(input_path)
+    nalus = get_nal_units(buf) if buf else []
+    if len(nalus) < 1:
+        print 'WARN: no nal units could be found in', input_path
+        if buf:
+            buf.close()
+        return False
+    index.add_nal_units(nalus, buf)
+    index.write()
+    buf.close()
+    return True
+
+
+def get_index_path(bitstream_path):
+    return bitstream_path[:-len('.265')] + '.json'